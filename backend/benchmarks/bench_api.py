@@ -0,0 +1,340 @@
+"""
+Benchmark of every route of books.py, authors.py and categories.py, to catch
+performance regressions between runs.
+
+A fresh database is seeded with the given volumes of genres, categories, authors and
+books: a temporary SQLite file by default, or `--database` (e.g. a local Postgres
+database, whose tables are dropped and created again). A local token issuer is trusted,
+so `require_auth` runs its real code path. Each route then gets `--requests` requests
+through the Flask test client, one at a time, after `--warmup` unmeasured ones. Routes
+changing data run after the read routes; deletions run last.
+
+For every route: p50/p95/p99 latency, throughput, SQL statements per request and
+response statuses (exceptions count as "error"). Results are written as JSON with
+`--output`. With `--baseline`, they are compared to the results of an earlier run and the
+exit status is 1 when a route got slower than `--tolerance` at p95, runs more SQL
+statements per request or fails more often.
+
+Usage:
+    python -m backend.benchmarks.bench_api [--books 2000] [--requests 200] [--output results.json]
+    python -m backend.benchmarks.bench_api --database postgresql://localhost/e_library_bench --baseline results.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DATA_DIR = tempfile.mkdtemp(prefix="e-library-bench-")
+os.environ.setdefault("BOOKS_DIR", os.path.join(DATA_DIR, "books"))
+
+from flask_migrate import stamp  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+from backend.benchmarks.local_auth import LocalIssuer  # noqa: E402
+from backend.src.api.api import create_app  # noqa: E402
+from backend.src.database.models import (  # noqa: E402
+    Author, Book, Category, Genre, author_genre, book_genre, db, db_drop_and_create_all
+)
+from backend.src.storage.storage import storage  # noqa: E402
+
+PERMISSIONS = [
+    "get:books", "get:books-details", "post:books", "patch:books", "delete:books", "post:ratings",
+    "get:authors", "get:authors_details", "post:authors", "patch:authors", "delete:authors",
+    "get:categories", "get:categories_details", "post:categories", "patch:categories", "delete:categories",
+]
+
+FILE_SIZE = 256 * 1024  # bytes of the file uploaded for books downloaded by GET /books/<id>/file
+FILES = 100  # books with a file
+DELETIONS = 20  # measured requests of deletion routes, each deletes another seeded row
+
+
+class Route:
+    def __init__(self, name: str, request, max_requests: int = None):
+        """`request(i, seeded)` returns (method, path, keyword arguments of the test client) of the i-th request."""
+
+        self.name = name
+        self.request = request
+        self.max_requests = max_requests
+
+
+def cycle(ids: list, i: int):
+    return ids[i % len(ids)]
+
+
+def book_json(i: int, seeded: dict) -> dict:
+    return {
+        "name": f"bench book {i}",
+        "author": cycle(seeded["author_names"], i),
+        "category": cycle(seeded["category_names"], i),
+        "description": "benchmark book",
+        "num_of_pages": 100 + i % 900,
+        "year_of_publishing": 1950 + i % 70,
+        "genres": [cycle(seeded["genre_names"], i), cycle(seeded["genre_names"], i + 1)],
+    }
+
+
+def import_body(i: int, seeded: dict) -> bytes:
+    lines = (json.dumps(book_json(i * 10 + j, seeded) | {"name": f"imported book {i}.{j}"}) for j in range(10))
+    return "\n".join(lines).encode()
+
+
+ROUTES = [
+    # reads
+    Route("GET /book", lambda i, s: ("GET", "/book", {})),
+    Route("GET /book (facets)", lambda i, s: ("GET", "/book?facets=true", {})),
+    Route("GET /book (filtered)", lambda i, s: (
+        "GET", f"/book?genre={s['genre_names'][0]}&genre={s['genre_names'][1]}"
+               f"&year_of_publishing_min=1980&num_of_pages_max=600&rating_min=2", {}
+    )),
+    Route("GET /book/top", lambda i, s: ("GET", f"/book/top?by={('downloads', 'rating')[i % 2]}", {})),
+    Route("GET /books/<id>", lambda i, s: ("GET", f"/books/{cycle(s['books'], i)}", {})),
+    Route("GET /books/<id>/similar", lambda i, s: ("GET", f"/books/{cycle(s['books'], i)}/similar", {})),
+    Route("GET /books/<id>/file", lambda i, s: ("GET", f"/books/{cycle(s['books'][:FILES], i)}/file", {})),
+    Route("GET /export", lambda i, s: ("GET", "/export", {}), max_requests=10),
+    Route("GET /suggest", lambda i, s: ("GET", f"/suggest?q={('b', 'bo', 'book ', f'book {i}')[i % 4]}", {})),
+    Route("GET /authors", lambda i, s: ("GET", "/authors", {})),
+    Route("GET /authors/<id>", lambda i, s: ("GET", f"/authors/{cycle(s['authors'], i)}", {})),
+    Route("GET /categories", lambda i, s: ("GET", "/categories", {})),
+    Route("GET /categories/<id>", lambda i, s: ("GET", f"/categories/{cycle(s['categories'], i)}", {})),
+    # writes
+    Route("POST /books/<id>/rating", lambda i, s: (
+        "POST", f"/books/{cycle(s['books'], i)}/rating", {"json": {"rating": 1 + i % 5}}
+    )),
+    Route("PUT /books/<id>/file", lambda i, s: (
+        "PUT", f"/books/{cycle(s['books'], i)}/file", {"data": f"book file {i}".encode() * 1024}
+    )),
+    Route("POST /book", lambda i, s: ("POST", "/book", {"json": book_json(i, s)})),
+    Route("POST /book/import", lambda i, s: (
+        "POST", "/book/import", {"data": import_body(i, s), "content_type": "application/x-ndjson"}
+    )),
+    Route("PATCH /books/<id>", lambda i, s: (
+        "PATCH", f"/books/{cycle(s['books'], i)}",
+        {"json": {**book_json(i, s), "id": cycle(s["books"], i), "title": f"patched book {i}"}}
+    )),
+    Route("POST /authors", lambda i, s: (
+        "POST", "/authors", {"json": {"name": f"bench author {i}", "age": 40, "books": [], "genres": []}}
+    )),
+    Route("PATCH /authors/<id>", lambda i, s: (
+        "PATCH", f"/authors/{cycle(s['authors'], i)}",
+        {"json": {"id": cycle(s["authors"], i), "name": f"patched author {i}", "age": 41, "books": [], "genres": []}}
+    )),
+    Route("POST /categories", lambda i, s: (
+        "POST", "/categories", {"json": {"name": f"bench category {i}", "books": []}}
+    )),
+    Route("PATCH /categories/<id>", lambda i, s: ("PATCH", f"/categories/{cycle(s['categories'], i)}", {})),
+    # deletions, from the last seeded rows
+    Route("DELETE /books/<id>", lambda i, s: ("DELETE", f"/books/{s['books'][-1 - i]}", {}), DELETIONS),
+    Route("DELETE /authors/<id>", lambda i, s: ("DELETE", f"/authors/{s['authors'][-1 - i]}", {}), DELETIONS),
+    Route("DELETE /categories/<id>", lambda i, s: ("DELETE", f"/categories/{s['categories'][-1 - i]}", {}), DELETIONS),
+]
+
+
+def seed(volumes: dict, rng: random.Random) -> dict:
+    """Insert rows in bulk, return ids and names of the seeded rows."""
+
+    def insert_ids(model, rows: list) -> list:
+        return db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+
+    genre_names = [f"genre {i}" for i in range(volumes["genres"])]
+    category_names = [f"category {i}" for i in range(volumes["categories"])]
+    author_names = [f"author {i}" for i in range(volumes["authors"])]
+
+    genres = insert_ids(Genre, [{"name": name} for name in genre_names])
+    categories = insert_ids(Category, [{"name": name} for name in category_names])
+    authors = insert_ids(Author, [{"name": name, "age": rng.randint(20, 90)} for name in author_names])
+    books = insert_ids(Book, [
+        {
+            "name": f"book {i}",
+            "description": "benchmark book",
+            "author_id": rng.choice(authors),
+            "category_id": rng.choice(categories),
+            "rating": round(rng.uniform(1, 5), 2),
+            "rates": rng.randint(0, 500),
+            "downloads": rng.randint(0, 10000),
+            "num_of_pages": rng.randint(50, 1200),
+            "year_of_publishing": rng.randint(1900, 2024),
+        }
+        for i in range(volumes["books"])
+    ])
+
+    db.session.execute(insert(author_genre), [
+        {"author_id": author, "genre_id": genre}
+        for author in authors for genre in rng.sample(genres, min(2, len(genres)))
+    ])
+    db.session.execute(insert(book_genre), [
+        {"book_id": book, "genre_id": genre}
+        for book in books for genre in rng.sample(genres, rng.randint(1, min(3, len(genres))))
+    ])
+
+    stored = storage.save(io.BytesIO(os.urandom(FILE_SIZE)))
+    db.session.execute(
+        Book.__table__.update().where(Book.id.in_(books[:FILES])).values(file_sha256=stored.sha256, file_size=stored.size)
+    )
+    db.session.commit()
+
+    return {
+        "genres": genres, "categories": categories, "authors": authors, "books": books,
+        "genre_names": genre_names, "category_names": category_names, "author_names": author_names,
+    }
+
+
+class StatementCounter:
+    """Number of SQL statements executed by the benchmark thread, background flushes are left out."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self.thread = threading.get_ident()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+def measure(client, route: Route, seeded: dict, headers: dict, requests: int, warmup: int, statements) -> dict:
+    requests = min(requests, route.max_requests or requests)
+    timings, statuses, num_of_statements = [], {}, 0
+
+    for i in range(warmup + requests):
+        method, path, kwargs = route.request(i, seeded)
+        before = statements.count
+        start = time.perf_counter()
+        try:
+            response = client.open(path, method=method, headers=headers, **kwargs)
+            response.get_data()
+            status = str(response.status_code)
+        except Exception:
+            status = "error"
+        elapsed = time.perf_counter() - start
+
+        if i >= warmup:
+            timings.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            num_of_statements += statements.count - before
+
+    percentiles = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+
+    return {
+        "requests": requests,
+        "statuses": statuses,
+        "p50_ms": round(percentiles[49] * 1000, 3),
+        "p95_ms": round(percentiles[94] * 1000, 3),
+        "p99_ms": round(percentiles[98] * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "throughput_rps": round(requests / sum(timings), 1),
+        "queries_per_request": round(num_of_statements / requests, 2),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of `results` against `baseline` as printable lines."""
+
+    regressions = []
+    for name, route in results["routes"].items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+
+        if route["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {route['p95_ms']} ms")
+        if route["statuses"].get("error", 0) > before["statuses"].get("error", 0):
+            regressions.append(f"{name}: statuses {before['statuses']} -> {route['statuses']}")
+        if route["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(
+                f"{name}: queries per request {before['queries_per_request']} -> {route['queries_per_request']}"
+            )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"sqlite:///{os.path.join(DATA_DIR, 'bench.db')}",
+                        help="database URL, its tables are dropped (default: a temporary SQLite file)")
+    parser.add_argument("--genres", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--authors", type=int, default=200)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per route")
+    parser.add_argument("--routes", nargs="+", metavar="ROUTE", help="only routes starting with these, e.g. 'GET /book'")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random seeded values")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth against the baseline")
+    args = parser.parse_args()
+
+    volumes = {"genres": args.genres, "categories": args.categories, "authors": args.authors, "books": args.books}
+    deletions = args.warmup + min(args.requests, DELETIONS)
+    if min(args.books, args.authors, args.categories) < deletions:
+        parser.error(f"deletion routes need at least {deletions} books, authors and categories")
+
+    logging.getLogger("backend.src.api.metrics").setLevel(logging.ERROR)  # the import is flagged on every request
+
+    issuer = LocalIssuer()
+    issuer.install()
+    headers = {"Authentication": f"bearer {issuer.token(PERMISSIONS)}"}
+
+    config = {"DATABASE_URL": args.database, "DB_REPLICAS": []}
+    if not args.cache:
+        config["RESPONSE_CACHE_SIZE"] = 0  # every request runs its queries
+
+    app = create_app(config)
+    client = app.test_client()
+    routes = [route for route in ROUTES if not args.routes or route.name.startswith(tuple(args.routes))]
+
+    with app.app_context():
+        db_drop_and_create_all()
+        stamp(revision="head")
+        seeded = seed(volumes, random.Random(args.seed))
+        statements = StatementCounter(db.engine)
+        database = db.engine.dialect.name
+
+    print(f"{database}, {volumes}, {args.requests} requests per route")
+    print(f"{'route':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}  statuses")
+
+    results = {
+        "meta": {
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": database,
+            "volumes": volumes,
+            "requests": args.requests,
+            "cache": args.cache,
+        },
+        "routes": {},
+    }
+
+    for route in routes:
+        result = results["routes"][route.name] = measure(
+            client, route, seeded, headers, args.requests, args.warmup, statements
+        )
+        print(f"{route.name:<28}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+              f"{result['throughput_rps']:>10}{result['queries_per_request']:>9}  {result['statuses']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        print("\n".join(["regressions against the baseline:", *regressions]) if regressions else "no regressions")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Load test of the catalogue read routes served by the WSGI app (`app.run()`, one request
+at a time per worker) and by the ASGI app (uvicorn, async handlers).
+
+Both servers run in this process on the same seeded SQLite file and trust a local
+token issuer. Concurrent clients request book lists and book details; latency
+percentiles and throughput are printed for each server. With `--slow-clients`, that
+many extra clients keep trickling their request headers in during the run, like
+clients on a bad mobile connection.
+
+Usage:
+    python -m backend.benchmarks.bench_asgi [--books 500] [--clients 32] [--requests 2000]
+"""
+
+import argparse
+import http.client
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DATA_DIR = tempfile.mkdtemp(prefix="e-library-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(DATA_DIR, 'bench.db')}")
+
+import uvicorn  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from backend.benchmarks.local_auth import LocalIssuer  # noqa: E402
+from backend.src.api.asgi import app as asgi_app  # noqa: E402
+from backend.src.api.asgi import flask_app  # noqa: E402
+from backend.src.api.cache import MemoryBackend, response_cache  # noqa: E402
+from backend.src.database.models import Author, Book, Category, Genre, db, upgrade_db  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def seed(num_of_books: int) -> None:
+    with flask_app.app_context():
+        upgrade_db()
+        genres = [Genre(name=f"genre {i}") for i in range(5)]
+        authors = [Author(name=f"author {i}", age=40, genres=genres[:2]) for i in range(num_of_books // 10 + 1)]
+        categories = [Category(name=f"category {i}") for i in range(10)]
+
+        db.session.add_all([
+            Book(
+                name=f"book {i}", description="benchmark book", rating=0.0, rates=0, downloads=0,
+                author=authors[i % len(authors)], category=categories[i % len(categories)],
+                genres=genres[i % 3:i % 3 + 2]
+            )
+            for i in range(num_of_books)
+        ])
+        db.session.commit()
+
+
+def run_wsgi(port: int):
+    server = make_server(HOST, port, flask_app, threaded=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server.shutdown
+
+
+def run_asgi(port: int):
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host=HOST, port=port, log_level="warning", lifespan="off"))
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+
+    return stop
+
+
+def trickle(port: int, token: str, delay: float, stop: threading.Event) -> None:
+    """Send requests one header line every `delay` seconds until `stop` is set."""
+
+    lines = [b"GET /book HTTP/1.1\r\n", f"Host: {HOST}\r\n".encode(),
+             f"Authentication: bearer {token}\r\n".encode(), b"Connection: close\r\n", b"\r\n"]
+
+    while not stop.is_set():
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        connection.connect()
+        for line in lines:
+            connection.sock.sendall(line)
+            time.sleep(delay)
+        connection.sock.recv(65536)
+        connection.close()
+
+
+def load(port: int, token: str, paths: list, clients: int, requests: int) -> dict:
+    headers = {"Authentication": f"bearer {token}"}
+
+    def fetch(path: str) -> float:
+        start = time.perf_counter()
+        connection = http.client.HTTPConnection(HOST, port, timeout=60)
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+
+        if response.status != 200:
+            raise RuntimeError(f"GET {path} returned {response.status}")
+
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        latencies = sorted(executor.map(fetch, (paths[i % len(paths)] for i in range(requests))))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+
+    return {
+        "p50_ms": percentiles[49] * 1e3,
+        "p95_ms": percentiles[94] * 1e3,
+        "p99_ms": percentiles[98] * 1e3,
+        "requests_per_second": requests / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--slow-clients", type=int, default=0)
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="seconds between header lines of slow clients")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache of the WSGI routes")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if not args.cache:
+        response_cache.backend = MemoryBackend(maxsize=0)  # both servers run the queries
+
+    issuer = LocalIssuer()
+    issuer.install()
+    token = issuer.token(["get:books", "get:books-details", "get:authors", "get:categories"])
+
+    seed(args.books)
+    paths = ["/book?limit=20"] + [f"/books/{id}" for id in range(1, args.books + 1, max(args.books // 50, 1))]
+
+    print(f"books: {args.books}, clients: {args.clients}, requests: {args.requests}, "
+          f"slow clients: {args.slow_clients}, cache: {args.cache}")
+    print(f"{'server':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+
+    for name, run, port in (("wsgi", run_wsgi, args.port), ("asgi", run_asgi, args.port + 1)):
+        stop = run(port)
+        load(port, token, paths, args.clients, min(args.requests, 100))  # warm up
+
+        stop_trickling = threading.Event()
+        slow_clients = [
+            threading.Thread(target=trickle, args=(port, token, args.slow_delay, stop_trickling), daemon=True)
+            for _ in range(args.slow_clients)
+        ]
+        for client in slow_clients:
+            client.start()
+
+        try:
+            result = load(port, token, paths, args.clients, args.requests)
+        finally:
+            stop_trickling.set()
+            for client in slow_clients:
+                client.join()
+            stop()
+
+        print(
+            f"{name:<8}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+            f"{result['p99_ms']:>10.1f}{result['requests_per_second']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Auth overhead per request with and without the verified-token cache.
+
+Usage:
+    python -m backend.benchmarks.bench_auth [--requests 2000]
+"""
+
+import argparse
+import time
+
+from backend.benchmarks.local_auth import LocalIssuer
+from backend.src.auth import auth
+from backend.src.auth.token_cache import VerifiedTokenCache
+
+
+def measure(token: str, requests: int) -> float:
+    """Return mean time of `verify_decode_jwt` in microseconds."""
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        auth.verify_decode_jwt(token)
+
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    issuer = LocalIssuer()
+    issuer.install()
+    token = issuer.token(["get:books"])
+
+    cached = auth.token_cache
+
+    auth.token_cache = VerifiedTokenCache(maxsize=0)
+    uncached_us = measure(token, args.requests)
+
+    auth.token_cache = cached
+    cached_us = measure(token, args.requests)
+
+    print(f"requests:      {args.requests}")
+    print(f"without cache: {uncached_us:10.1f} us/request")
+    print(f"with cache:    {cached_us:10.1f} us/request")
+    print(f"speedup:       {uncached_us / cached_us:10.1f}x")
+    print(f"cache stats:   {auth.token_cache.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Throughput of the `Book.short` list serialization, from query to response bytes.
+
+For each row count, books are read from an in-memory SQLite database and encoded
+three ways:
+- orm+json:   `Book.short_query()` instances, `book.short()`, Flask's stdlib provider;
+- rows+json:  `Book.short_rows_query()` tuples, `Book.short_row()`, stdlib provider;
+- rows+fast:  the same tuples, `FastJSONProvider` (orjson when installed).
+
+Usage:
+    python -m backend.benchmarks.bench_json [--rows 100 1000 10000] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from backend.src.api.json_provider import FastJSONProvider
+from backend.src.database.models import Author, Book, Category, db, setup_db
+
+
+def seed(num_of_books: int) -> None:
+    authors = [Author(name=f"author {i}", age=40) for i in range(max(num_of_books // 10, 1))]
+    category = Category(name="category")
+
+    db.session.add_all([
+        Book(name=f"book {i}", author=authors[i % len(authors)], category=category,
+             rating=i % 50 / 10, rates=i % 7, downloads=i)
+        for i in range(num_of_books)
+    ])
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def orm_json(provider) -> bytes:
+    books = Book.short_query().order_by(Book.id).all()
+    return provider.response({"books": [book.short() for book in books]}).get_data()
+
+
+def rows_json(provider) -> bytes:
+    books = Book.short_rows_query().order_by(Book.id).all()
+    return provider.response({"books": [Book.short_row(book) for book in books]}).get_data()
+
+
+def best_of(f, provider, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(provider)
+        db.session.expunge_all()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    setup_db(app, "sqlite://", replicas=[])
+    default, fast = DefaultJSONProvider(app), FastJSONProvider(app)
+
+    print(f"fast provider uses orjson: {fast.fast}, throughput in rows/s")
+    print(f"{'rows':>8}{'orm+json':>14}{'rows+json':>14}{'rows+fast':>14}")
+
+    for num_of_rows in args.rows:
+        with app.app_context():
+            db.create_all(bind_key=None)
+            seed(num_of_rows)
+
+            assert orm_json(default) == rows_json(default)
+            timings = [
+                best_of(orm_json, default, args.repeat),
+                best_of(rows_json, default, args.repeat),
+                best_of(rows_json, fast, args.repeat),
+            ]
+
+            db.session.remove()
+            db.drop_all(bind_key=None)
+
+        print(f"{num_of_rows:>8}" + "".join(f"{num_of_rows / timing:>14,.0f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold start of a worker: time from interpreter start to the first served request.
+
+Every run is a fresh interpreter which imports `backend.src.api.api`, calls
+`create_app()` and serves GET /book through the test client, on a seeded SQLite
+file. Two modes are compared:
+- lazy:  `create_app()` as deployed, the search index is built by the first search;
+- eager: the schema is checked with `upgrade_db()` and the search index is built
+         while the app is created, like the module-level setup used to do.
+
+Usage:
+    python -m backend.benchmarks.bench_startup [--books 20000] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+START = time.perf_counter()
+
+
+def child(mode: str) -> None:
+    """Runs in the measured interpreter, prints phase timings as JSON."""
+
+    from backend.src.api.api import create_app
+    imported = time.perf_counter()
+
+    app = create_app({"SEARCH_LAZY_INDEX": mode == "lazy"})
+    if mode == "eager":
+        from backend.src.database.models import upgrade_db
+
+        with app.app_context():
+            upgrade_db()
+    created = time.perf_counter()
+
+    from backend.benchmarks.local_auth import LocalIssuer
+
+    issuer = LocalIssuer(private_pem=os.environ["BENCH_PRIVATE_PEM"])
+    issuer.install()
+    headers = {"Authentication": f"bearer {issuer.token(['get:books'])}"}
+    prepared = time.perf_counter()
+
+    response = app.test_client().get("/book", headers=headers)
+    assert response.status_code == 200, response.status_code
+    served = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": (imported - START) * 1e3,
+        "create_app_ms": (created - imported) * 1e3,
+        "first_request_ms": (served - prepared) * 1e3,
+        "total_ms": (served - prepared + created - START) * 1e3,
+    }))
+
+
+def seed(database_url: str, num_of_books: int) -> None:
+    from backend.src.api.api import create_app
+    from backend.src.database.importer import import_books
+    from backend.src.database.models import upgrade_db
+
+    app = create_app({"DATABASE_URL": database_url})
+    rows = (
+        json.dumps({
+            "name": f"book {i}", "author": f"author {i % 500}", "category": f"category {i % 20}",
+            "genres": [f"genre {i % 7}"], "description": f"description of book {i}",
+            "num_of_pages": 100, "year_of_publishing": 2000,
+        })
+        for i in range(num_of_books)
+    )
+
+    with app.app_context():
+        upgrade_db()
+        import_books(rows, "ndjson")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", choices=("lazy", "eager"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    from backend.benchmarks.local_auth import LocalIssuer
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    database_url = f"sqlite:///{os.path.join(tmp_dir.name, 'startup.db')}"
+    seed(database_url, args.books)
+
+    env = dict(os.environ, DATABASE_URL=database_url, BENCH_PRIVATE_PEM=LocalIssuer(bits=1024).private_pem)
+
+    print(f"books: {args.books}, runs: {args.runs} (medians)")
+    print(f"{'mode':<8}{'import ms':>12}{'create ms':>12}{'1st req ms':>12}{'total ms':>12}")
+
+    for mode in ("lazy", "eager"):
+        runs = [
+            json.loads(subprocess.run(
+                [sys.executable, "-m", "backend.benchmarks.bench_startup", "--child", mode],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout.splitlines()[-1])
+            for _ in range(args.runs)
+        ]
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+        print(
+            f"{mode:<8}{median['import_ms']:>12.0f}{median['create_app_ms']:>12.0f}"
+            f"{median['first_request_ms']:>12.0f}{median['total_ms']:>12.0f}"
+        )
+
+    tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
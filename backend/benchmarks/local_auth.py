@@ -0,0 +1,54 @@
+"""
+Local stand-in for the Auth0 tenant used by benchmarks.
+
+Generates an RSA key pair, points the auth layer at a JWKS document with its public
+key and signs tokens with the private key, so `require_auth` runs its real code path
+without network access.
+"""
+
+import time
+
+import rsa
+from jose import jwk, jwt
+
+from backend.src.auth import auth
+from backend.src.auth.jwks import JWKSKeyStore
+
+KID = "local-bench-key"
+DOMAIN = "e-library.local"
+AUDIENCE = "e-library-bench"
+
+
+class LocalIssuer:
+    def __init__(self, bits: int = 2048, private_pem: str = None):
+        """New key pair of `bits`, or the key of `private_pem` to share an issuer between processes."""
+
+        if private_pem is None:
+            _, private_key = rsa.newkeys(bits)
+            private_pem = private_key.save_pkcs1().decode()
+        self.private_pem = private_pem
+
+        public_key = jwk.construct(self.private_pem, "RS256").public_key().to_dict()
+        self.jwks = {"keys": [{**public_key, "kid": KID, "use": "sig"}]}
+
+    def install(self) -> None:
+        """Make the auth layer trust this issuer."""
+
+        auth.AUTH0_DOMAIN = DOMAIN
+        auth.ALGORITHMS = ["RS256"]
+        auth.API_AUDIENCE = AUDIENCE
+        auth.jwks_store = JWKSKeyStore(lambda: self.jwks, background=False)
+        auth.token_cache.clear()
+
+    def token(self, permissions: list, lifetime: int = 3600) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": f"https://{DOMAIN}",
+            "aud": AUDIENCE,
+            "sub": "bench|user",
+            "iat": now,
+            "exp": now + lifetime,
+            "permissions": permissions,
+        }
+
+        return jwt.encode(claims, self.private_pem, algorithm="RS256", headers={"kid": KID})
@@ -1,36 +1,148 @@
-from flask import Flask
-from flask_smorest import Api
+"""
+Application factory of the e-Library API.
+
+    flask --app backend.src.api.api run
+    gunicorn "backend.src.api.api:create_app()"
+
+Creating the app does not touch the database: the schema is managed explicitly with
+`flask schema upgrade` (or `flask db ...`), engines connect on first use and the search
+and autocomplete indexes are built by their first request. Views and their marshmallow
+schemas are imported when an app is created, not when this module is.
+"""
+
+from flask import Flask, jsonify
+
+from backend.src.api.metrics import request_metrics
+from backend.src.auth.auth import AuthError, require_auth
+from backend.src.database.models import DB_PATH, db, setup_db
+from backend.src.database.pool import pool_stats
+from backend.src.database.replicas import replica_router
+
+DEFAULT_CONFIG = {
+    "PROPAGATE_EXCEPTIONS": True,
+    "API_TITLE": "e-Library",
+    "API_VERSION": "v0.1",
+    "OPENAPI_VERSION": "3.0.3",
+    "OPENAPI_URL_PREFIX": "/",
+    "OPENAPI_SWAGGER_UI_PATH": "/swagger-ui",
+    "OPENAPI_SWAGGER_UI_URL": "https://cdn.jsdelivr.net/npm/swagger-ui-dist/",
+    "DATABASE_URL": DB_PATH,
+    "DB_REPLICAS": None,  # list of read replica URLs, DB_REPLICAS env variable by default
+    "SEARCH_LAZY_INDEX": True,  # build the search index on first search instead of at start
+    "SUGGEST_LAZY_INDEX": True,  # build the autocomplete index on first suggestion instead of at start
+    "JSON_FAST": True,  # encode responses with orjson when installed, see json_provider.py
+    "SLOW_QUERY_THRESHOLD": None,  # seconds, SLOW_QUERY_THRESHOLD env variable by default, see metrics.py
+    "N_PLUS_ONE_THRESHOLD": None,  # executions of a statement per request, N_PLUS_ONE_THRESHOLD env variable by default
+}
+
+
+def create_app(config: dict = None) -> Flask:
+    from flask_smorest import Api
+
+    from backend.src.api.authors import blp as AuthorBluePrint
+    from backend.src.api.books import blp as BookBluePrint
+    from backend.src.api.cache import response_cache
+    from backend.src.api.categories import blp as CategoryBluePrint
+    from backend.src.api.json_provider import FastJSONProvider
+    from backend.src.api.search import blp as SearchBluePrint
+    from backend.src.database.commands import books_cli, schema_cli
+    from backend.src.database.counters import counters
+    from backend.src.database.leaderboards import leaderboards
+    from backend.src.search.engines import search
+    from backend.src.search.similar import similar_books
+    from backend.src.search.suggest import suggestions
+    from backend.src.storage.commands import storage_cli
+
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    if app.config["JSON_FAST"]:
+        app.json = FastJSONProvider(app)
+
+    request_metrics.init_app(
+        app,
+        slow_query_threshold=app.config["SLOW_QUERY_THRESHOLD"],
+        n_plus_one_threshold=app.config["N_PLUS_ONE_THRESHOLD"]
+    )
+
+    api = Api(app)
+    app.register_error_handler(AuthError, handle_auth_error)
+
+    api.register_blueprint(BookBluePrint)
+    api.register_blueprint(AuthorBluePrint)
+    api.register_blueprint(CategoryBluePrint)
+    api.register_blueprint(SearchBluePrint)
+
+    app.add_url_rule("/stats/db-pool", view_func=get_db_pool_stats, methods=["GET"])
+    app.add_url_rule("/stats/queries", view_func=get_query_stats, methods=["GET"])
+    app.add_url_rule("/metrics", view_func=get_metrics, methods=["GET"])
+
+    app.cli.add_command(books_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(storage_cli)
+
+    setup_db(app, app.config["DATABASE_URL"], replicas=app.config["DB_REPLICAS"])
+
+    with app.app_context():
+        search.init_app(app, lazy=app.config["SEARCH_LAZY_INDEX"])
+        counters.init_app(app)
+        leaderboards.init_app(app)
+        similar_books.init_app(app)
+        suggestions.init_app(app, lazy=app.config["SUGGEST_LAZY_INDEX"])
+        response_cache.init_app(app)
+
+    return app
 
-from backend.src.api.authors import blp as AuthorBluePrint
-from backend.src.api.books import blp as BookBluePrint
-from backend.src.database.models import db_drop_and_create_all, setup_db
 
-app = Flask(__name__)
+###################################################################################
+#                                'GET' ROUTES                                     #
+###################################################################################
+
+@require_auth("get:stats")
+def get_db_pool_stats():
+    """Connection pool usage of this worker by bind: checkout wait times, connections in use, timeouts, replicas."""
+
+    return jsonify({
+        "success": True,
+        "pools": {name: pool_stats(pool) for name, pool in engine_pools().items()},
+        "replicas": replica_router.format()
+    })
+
 
-app.config["PROPAGATE_EXCEPTIONS"] = True
-app.config["API_TITLE"] = "e-Library"
-app.config["API_VERSION"] = "v0.1"
-app.config["OPENAPI_VERSION"] = "3.0.3"
-app.config["OPENAPI_URL_PREFIX"] = "/"
-app.config["OPENAPI_SWAGGER_UI_PATH"] = "/swagger-ui"
-app.config["OPENAPI_SWAGGER_UI_URL"] = "https://cdn.jsdelivr.net/npm/swagger-ui-dist/"
+@require_auth("get:stats")
+def get_query_stats():
+    """Recent slow statements and statements repeated within a request (probable N+1 queries), with their SQL."""
 
+    return jsonify({
+        "success": True,
+        **request_metrics.format()
+    })
 
-api = Api(app)
 
-api.register_blueprint(BookBluePrint)
-api.register_blueprint(AuthorBluePrint)
+# left open for Prometheus scraping, which sends no token: restrict it at the network level
+def get_metrics():
+    """Request, SQL, auth and connection pool metrics of this worker in the Prometheus text format."""
 
+    return request_metrics.response(engine_pools())
 
-with app.app_context():
-    setup_db(app)
-    db_drop_and_create_all()
+
+def engine_pools() -> dict:
+    """Connection pool of every engine, by bind: "primary", "replica_0", ..."""
+
+    return {key or "primary": engine.pool for key, engine in db.engines.items()}
 
 
 ###################################################################################
-#                                'GET' ROUTES                                     #
+#                               ERROR HANDLERS                                    #
 ###################################################################################
 
+def handle_auth_error(error: AuthError):
+    """Same response as asgi.py `handle_auth_error`."""
+
+    return jsonify({"success": False, **error.error}), error.status_code
+
+
 # @app.route("/categories/<int:category_id>", methods=["GET"])
 # @require_auth("get:categories_details")
 # def get_category_details(category_id: int):
@@ -110,5 +222,5 @@ with app.app_context():
 
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
     
\ No newline at end of file
@@ -0,0 +1,452 @@
+"""
+ASGI serving mode for the e-Library API.
+
+Read routes of books, authors and categories (and book file downloads) are served by
+async handlers on an async SQLAlchemy engine, so slow clients and file transfers wait
+on the event loop instead of holding a worker. Every other route is forwarded to the
+Flask app, which keeps the URL surface and schemas identical to the WSGI mode.
+
+The async routes share the response cache (`cached`), replica routing (`read_session`)
+and request metrics (`RequestMetricsMiddleware`) of the Flask app.
+
+Run with:
+    uvicorn backend.src.api.asgi:app --workers 4
+"""
+
+import contextlib
+import contextvars
+import functools
+import re
+import time
+
+from a2wsgi import WSGIMiddleware
+from flask_smorest import abort
+from marshmallow import EXCLUDE, ValidationError, fields
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Match, Mount, Route
+from werkzeug.exceptions import HTTPException
+
+from backend.src.api.api import create_app
+from backend.src.api.cache import MemoryBackend, response_cache
+from backend.src.api.json_provider import FastJSONProvider
+from backend.src.api.metrics import RequestStats, request_metrics
+from backend.src.api.pagination import page_of, split_page
+from backend.src.auth import auth
+from backend.src.auth.auth import AuthError, check_permission, parse_auth_header
+from backend.src.database.counters import counters
+from backend.src.database.models import Author, Book, Category, engine_options
+from backend.src.database.replicas import replica_router
+from backend.src.database.schemas import BookListArgsSchema, PageArgsSchema
+from backend.src.search.facets import BookFilter
+from backend.src.storage.storage import storage
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(database_path: str) -> str:
+    """Same database with its asyncio driver, e.g. postgresql+psycopg2:// -> postgresql+asyncpg://."""
+
+    scheme, rest = database_path.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+def async_engine_options(database_path: str) -> dict:
+    options = engine_options(database_path)
+    options.pop("poolclass", None)  # async engines need an asyncio-compatible pool
+
+    return options
+
+
+flask_app = create_app()
+database_url = flask_app.config["DATABASE_URL"]
+
+engine = create_async_engine(async_url(database_url), **async_engine_options(database_url))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+replica_engines = {  # bind key -> async engine of the replica
+    key: create_async_engine(async_url(url), **async_engine_options(url))
+    for key, url in (
+        (key, flask_app.config["SQLALCHEMY_BINDS"][key]["url"]) for key in replica_router.engines
+    )
+}
+
+read_from_replica = contextvars.ContextVar("read_from_replica", default=False)  # set by `read_session`, see `cached`
+
+page_args_schema = PageArgsSchema()
+book_list_args_schema = BookListArgsSchema()
+json_provider = FastJSONProvider(flask_app)
+
+
+class FastJSONResponse(JSONResponse):
+    """Same encoding as responses of the Flask app, see json_provider.py."""
+
+    def render(self, content) -> bytes:
+        return json_provider.dumps_bytes(content)
+
+
+class DownloadResponse(FileResponse):
+    """Book file which counts a download once its status is known, with the rule of `BookFile.get`."""
+
+    def __init__(self, book_id: int, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.book_id = book_id
+
+    async def __call__(self, scope, receive, send):
+        range_header = Headers(scope=scope).get("range", "").replace(" ", "")
+
+        async def count_download(message):
+            # full transfers and the first chunk of ranged ones
+            if message["type"] == "http.response.start" and (
+                message["status"] == 200 or (message["status"] == 206 and range_header.startswith("bytes=0-"))
+            ):
+                counters.add_download(self.book_id)
+            await send(message)
+
+        await super().__call__(scope, receive, count_download)
+
+
+@contextlib.asynccontextmanager
+async def read_session():
+    """Session on the replica `replica_router` picks for this request, or on the primary."""
+
+    key = replica_router.acquire()
+    if key is not None:
+        read_from_replica.set(True)
+    try:
+        async with Session(bind=replica_engines[key] if key is not None else engine) as session:
+            yield session
+    finally:
+        replica_router.release(key)
+
+
+async def authorize(request, permission: str) -> dict:
+    """Async counterpart of `require_auth`. Signature verification runs off the event loop."""
+
+    start = time.perf_counter()
+    token = parse_auth_header(request.headers.get("Authentication"))
+    payload = auth.token_cache.get(token)
+
+    if payload is None:
+        payload = await run_in_threadpool(auth.verify_decode_jwt, token)
+
+    stats = request_metrics.current()
+    if stats is not None:
+        stats.auth_seconds = time.perf_counter() - start
+
+    check_permission(permission, payload)
+    return payload
+
+
+def requires(permission: str):
+    """Decorator of handlers, authorizes before any cached response is served like `require_auth`."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            await authorize(request, permission)
+            return await handler(request)
+
+        return wrapper
+
+    return decorator
+
+
+async def cache_call(function, *args):
+    # Redis round trips block, lookups in the in-process LRU do not
+    if isinstance(response_cache.backend, MemoryBackend):
+        return function(*args)
+
+    return await run_in_threadpool(function, *args)
+
+
+def etag_matches(request, etag: str) -> bool:
+    values = [value.strip().removeprefix("W/") for value in request.headers.get("if-none-match", "").split(",")]
+    return "*" in values or f'"{etag}"' in values
+
+
+def cached(*tags):
+    """Async counterpart of `response_cache.cached`, entries and invalidations are shared with it."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            full_path = f"{request.url.path}?{request.url.query}"  # as `request.full_path` of Flask
+            key = await cache_call(
+                response_cache.key, full_path, [tag.format(**request.path_params) for tag in tags]
+            )
+
+            entry = await cache_call(response_cache.lookup, key)
+            if entry is None:
+                token = read_from_replica.set(False)
+                try:
+                    response = await handler(request)
+                    from_replica = read_from_replica.get()
+                finally:
+                    read_from_replica.reset(token)
+
+                if response.status_code != 200:
+                    return response
+
+                entry = await cache_call(
+                    response_cache.store, key, response.media_type, response.body, from_replica
+                )
+
+            etag, media_type, body = entry
+            if etag_matches(request, etag):
+                response_cache.stats["not_modified"] += 1
+                return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+
+            return Response(body, media_type=media_type, headers={"ETag": f'"{etag}"'})
+
+        return wrapper
+
+    return decorator
+
+
+def query_args(schema, request) -> dict:
+    """Load the query string like `blp.arguments(schema, location="query")`, repeated keys fill List fields."""
+
+    params = request.query_params
+    return schema.load({
+        key: params.getlist(key) if isinstance(schema.fields.get(key), fields.List) else params[key]
+        for key in params.keys()
+    }, unknown=EXCLUDE)
+
+
+def page_args(request) -> dict:
+    return query_args(page_args_schema, request)
+
+
+@requires("get:books")
+@cached("books", "authors", "categories", "genres")
+async def book_list(request):
+    args = query_args(book_list_args_schema, request)
+    book_filter = BookFilter(args)
+
+    async with read_session() as session:
+        statement = page_of(Book.short_rows_select().where(*book_filter.conditions()), Book.id, args["limit"], args["after"])
+        books, next_cursor = split_page((await session.execute(statement)).all(), args["limit"])
+
+        result = {
+            "success": True,
+            "books": [Book.short_row(book) for book in books],
+            "next_cursor": next_cursor
+        }
+        if args["facets"]:
+            result["total"] = await session.scalar(book_filter.count_select())
+            result["facets"] = book_filter.format_facets({
+                dimension: (await session.execute(statement)).all()
+                for dimension, statement in book_filter.facet_selects().items()
+            })
+
+        return FastJSONResponse(result)
+
+
+@requires("get:books-details")
+@cached("book:{id}", "authors", "categories", "genres")
+async def book_detail(request):
+
+    async with read_session() as session:
+        statement = select(Book).options(*Book.long_options()).where(Book.id == request.path_params["id"])
+        book = (await session.scalars(statement)).unique().one_or_none()
+
+        if not book:
+            abort(404, message="REQUESTED BOOK DOES NOT EXIST")
+
+        return FastJSONResponse({
+            "success": True,
+            "book": book.long()
+        })
+
+
+@requires("get:books-details")
+async def book_file(request):
+    book_id = request.path_params["id"]
+
+    async with read_session() as session:
+        book = await session.get(Book, book_id)
+
+    if not book or not storage.exists(book.file_sha256):
+        abort(404, message="BOOK FILE NOT FOUND")
+
+    headers = {"ETag": f'"{book.file_sha256}"', "Cache-Control": "no-cache"}
+    if etag_matches(request, book.file_sha256):
+        return Response(status_code=304, headers=headers)
+
+    return DownloadResponse(
+        book_id,
+        storage.path(book.file_sha256),
+        media_type="application/octet-stream",
+        filename=book.name,
+        headers=headers
+    )
+
+
+@requires("get:authors")
+@cached("authors")
+async def author_list(request):
+    args = page_args(request)
+
+    async with read_session() as session:
+        statement = page_of(select(Author).options(*Author.short_options()), Author.id, args["limit"], args["after"])
+        authors, next_cursor = split_page((await session.scalars(statement)).all(), args["limit"])
+
+        return FastJSONResponse({
+            "success": True,
+            "authors": [author.short() for author in authors],
+            "next_cursor": next_cursor
+        })
+
+
+@requires("get:authors_details")
+@cached("author:{id}", "books", "genres")
+async def author_detail(request):
+
+    async with read_session() as session:
+        statement = select(Author).options(*Author.long_options()).where(Author.id == request.path_params["id"])
+        author = (await session.scalars(statement)).one_or_none()
+
+        if not author:
+            abort(404, message="AUTHOR NOT FOUND")
+
+        return FastJSONResponse({
+            "success": True,
+            "author": author.long()
+        })
+
+
+@requires("get:categories")
+@cached("categories", "books")
+async def category_list(request):
+
+    async with read_session() as session:
+        rows = (await session.execute(Category.num_of_books_select())).all()
+        data = [category.short(num_of_books) for category, num_of_books in rows]
+
+        return FastJSONResponse({
+            "success": True,
+            "categories": data,
+            "total": len(data)
+        })
+
+
+@requires("get:categories_details")
+@cached("category:{id}", "books", "authors")
+async def category_detail(request):
+    args = page_args(request)
+    category_id = request.path_params["id"]
+
+    async with read_session() as session:
+        category = await session.get(Category, category_id)
+
+        if not category:
+            abort(404, message="CATEGORY NOT FOUND")
+
+        statement = page_of(
+            Book.short_rows_select().where(Book.category_id == category_id),
+            Book.id, args["limit"], args["after"]
+        )
+        books, next_cursor = split_page((await session.execute(statement)).all(), args["limit"])
+        num_of_books = await session.scalar(category.count_books_select())
+
+        return FastJSONResponse({
+            "success": True,
+            "category": category.long(books, num_of_books),
+            "next_cursor": next_cursor
+        })
+
+
+async def handle_http_error(request, error: HTTPException):
+    # `abort()` of flask-smorest, same body as its error handler
+    body = {"code": error.code, "status": error.name}
+    body.update(getattr(error, "data", {}))
+
+    return FastJSONResponse(body, status_code=error.code)
+
+
+async def handle_auth_error(request, error: AuthError):
+    return FastJSONResponse({"success": False, **error.error}, status_code=error.status_code)
+
+
+async def handle_validation_error(request, error: ValidationError):
+    # same shape as flask-smorest's 422 responses
+    return FastJSONResponse(
+        {"code": 422, "errors": {"query": error.messages}, "status": "Unprocessable Entity"},
+        status_code=422
+    )
+
+
+async_routes = [
+    Route("/book", book_list, methods=["GET"]),
+    Route("/books/{id:int}", book_detail, methods=["GET"]),
+    Route("/books/{id:int}/file", book_file, methods=["GET"]),
+    Route("/authors", author_list, methods=["GET"]),
+    Route("/authors/{id:int}", author_detail, methods=["GET"]),
+    Route("/categories", category_list, methods=["GET"]),
+    Route("/categories/{id:int}", category_detail, methods=["GET"]),
+]
+
+
+class RequestMetricsMiddleware:
+    """
+    Records requests of `async_routes` in `request_metrics` under the URL rule of the
+    Flask route they replace (e.g. /books/<int:id>). Requests forwarded to the Flask app
+    are recorded by its own hooks.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.rules = [(route, re.sub(r"{(\w+):(\w+)}", r"<\2:\1>", route.path)) for route in async_routes]
+
+    async def __call__(self, scope, receive, send):
+        rule = self._rule(scope) if scope["type"] == "http" else None
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope["method"], rule)
+        token = request_metrics.bind(stats)
+
+        async def record_status(message):
+            if message["type"] == "http.response.start":
+                stats.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            request_metrics.unbind(token)
+            if stats.status is None:  # unhandled exception
+                stats.status = 500
+            request_metrics.finish(stats)
+
+    def _rule(self, scope):
+        for route, rule in self.rules:
+            if route.matches(scope)[0] == Match.FULL:
+                return rule
+
+        return None
+
+
+app = Starlette(
+    routes=[
+        *async_routes,
+        # writes, search, import, docs, ...: same handlers as the WSGI mode
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(RequestMetricsMiddleware)],
+    exception_handlers={
+        AuthError: handle_auth_error,
+        HTTPException: handle_http_error,
+        ValidationError: handle_validation_error,
+    },
+)
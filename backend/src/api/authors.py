@@ -1,10 +1,13 @@
 from flask import request, jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
-from sqlalchemy import exc
-from backend.src.database.models import Author, db, Book, Genre
+from sqlalchemy import exc, or_, select, update
+from backend.src.database.models import Author, db, Book, Genre, author_genre, replace_associations
+from backend.src.database.signals import models_changed
 from backend.src.auth.auth import require_auth
-from backend.src.database.schemas import AuthorSchema
+from backend.src.database.schemas import AuthorSchema, GenreArgsSchema, PageArgsSchema
+from backend.src.api.cache import response_cache
+from backend.src.api.pagination import paginate
 
 
 blp = Blueprint("authors", __name__, description="Operations on Author")
@@ -14,12 +17,15 @@ blp = Blueprint("authors", __name__, description="Operations on Author")
 class AuthorList(MethodView):
 
     @require_auth("get:authors")
-    def get(self):
-        authors = [author.short() for author in Author.query.all()]
+    @response_cache.cached("authors")
+    @blp.arguments(PageArgsSchema, location="query")
+    def get(self, args):
+        authors, next_cursor = paginate(Author.short_query(), Author.id, args["limit"], args["after"])
 
         return jsonify({
             "success": True,
-            "authors": authors
+            "authors": [author.short() for author in authors],
+            "next_cursor": next_cursor
         }), 200
 
     @require_auth("post:authors")
@@ -51,31 +57,32 @@ class AuthorList(MethodView):
                 "success": True,
                 "new_author": author.short()
             }), 201
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
             abort(500)
-        finally:
-            db.session.close()
 
 
 @blp.route("/authors/<int:id>")
-class Author(MethodView):
+class AuthorDetail(MethodView):
 
     @require_auth("get:authors_details")
+    @response_cache.cached("author:{id}", "books", "genres")
     def get(self, id: int):
-        try:
-            return jsonify({
-                "success": True,
-                "author": Author.query.filter_by(id=id).long()
-            }), 200
-        except exc:
+        author = Author.long_query().filter_by(id=id).one_or_none()
+
+        if not author:
             # user inputted author id by himself
-            print(exc)
             abort(404, message="AUTHOR NOT FOUND")
+
+        return jsonify({
+            "success": True,
+            "author": author.long()
+        }), 200
     
     @require_auth("patch:authors")
-    def patch(self, id: int):
+    @blp.arguments(GenreArgsSchema, location="query")
+    def patch(self, args, id: int):
         """Example JSON:
         {
             "id": int,
@@ -116,8 +123,11 @@ class Author(MethodView):
                 "downloads": 12441
             },
         ]
+
+        Genres and books are looked up with one query each, missing genres are created with
+        `?create_genres=true`. Books left out of "books" need another author, so they are rejected.
         """
-        
+
         author = Author.query.filter_by(id=id).one_or_none()
 
         if not author:
@@ -132,59 +142,65 @@ class Author(MethodView):
             abort(422)
         
         try:
-            author.name = json_data["name"]
-            author.age = json_data["age"]
+            # submitted books and current books of the author, in one query
+            book_ids = {book["id"] for book in json_data["books"]}
+            books = dict(db.session.execute(
+                select(Book.id, Book.author_id).where(or_(Book.id.in_(book_ids), Book.author_id == id))
+            ).all())
+
+            own_books = {book_id for book_id, author_id in books.items() if author_id == id}
 
-            for genre in json_data["genres"]:
-                genre_object = Genre.query.filter_by(name=genre)
+            if book_ids - books.keys():
+                abort(404, message="BOOK NOT FOUND")
+            if own_books - book_ids:
+                abort(422, message="BOOKS CANNOT BE LEFT WITHOUT AUTHOR")
 
-                if genre_object:
-                    author.genres.append(genre_object)
+            # genres are created last, a rejected request must not insert them
+            genre_ids, created_genres = Genre.ids_by_name(json_data["genres"], create=args["create_genres"])
+            if len(genre_ids) < len(set(json_data["genres"])):
+                abort(404, message="GENRE NOT FOUND")
 
-            # check for removed books
-            for book in author.books:
-                found = False
-                for json_book in json_data["books"]:
-                    if book.id == json_book["id"]:
-                        found = True
-                        break
-                if not found:
-                    author.books.remove(book)
+            author.name = json_data["name"]
+            author.age = json_data["age"]
 
-            # check for new books
-            for book in json_data["books"]:
-                book_object = Book.query.filter_by(id=book["id"])
+            replace_associations(author_genre, "author_id", id, "genre_id", genre_ids.values())
+            moved_books = sorted(book_ids - own_books)
+            if moved_books:
+                db.session.execute(update(Book).where(Book.id.in_(moved_books)).values(author_id=id))
+            db.session.expire(author, ["genres", "books"])
 
-                if book_object not in author.books:
-                    author.books.append(book_object)
+            author.update()
+            if created_genres:
+                models_changed.send(Genre, ids=created_genres)
+            if moved_books:
+                models_changed.send(Book, ids=moved_books)
 
             return jsonify({
                 "success": True,
                 "updated_book": author.short()
             })
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
             abort(500)
-        finally:
-            db.session.close()
 
     @require_auth("delete:authors")
     def delete(self, id: int):
-        author = Author.query.filter_by(id=id)
+        author = db.session.get(Author, id)
 
         if not author:
             abort(404, message="AUTHOR NOT FOUND")
-        
+
+        if author.books:  # book.author_id is not nullable
+            abort(409, message="AUTHOR HAS BOOKS")
+
         try:
             author.delete()
             return jsonify({
                 "success": True,
-                "deleted_author_id": author.id
+                "deleted_author_id": id
             }), 200
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
             abort(500)
-        finally:
-            db.session.close()
@@ -1,12 +1,24 @@
-from flask import request, jsonify
+from flask import Response, request, jsonify, send_file, stream_with_context
 from flask.views import MethodView
 from flask_smorest import Blueprint, abort
 from sqlalchemy import exc
-import os
 
-from backend.src.database.models import Book, db, Author, Category, Genre
-from backend.src.database.schemas import BookSchema
+from backend.src.database.models import Book, db, Author, Category, Genre, book_genre, replace_associations
+from backend.src.database.counters import counters
+from backend.src.database.signals import models_changed
+from backend.src.database.exporter import export_books, gzip_stream
+from backend.src.database.importer import import_books, text_stream
+from backend.src.database.leaderboards import leaderboards
+from backend.src.database.schemas import (
+    BookListArgsSchema, BookSchema, ExportArgsSchema, GenreArgsSchema, ImportArgsSchema, RatingSchema, SimilarArgsSchema,
+    TopArgsSchema
+)
 from backend.src.auth.auth import require_auth
+from backend.src.api.cache import response_cache
+from backend.src.api.pagination import paginate
+from backend.src.search.facets import BookFilter
+from backend.src.search.similar import similar_books
+from backend.src.storage.storage import storage
 
 
 blp = Blueprint("books", __name__, description="Operations on books")
@@ -15,17 +27,28 @@ blp = Blueprint("books", __name__, description="Operations on books")
 @blp.route("/book")
 class BookList(MethodView):
     @require_auth("get:books")
-    def get(self):
-        books = [book.short() for book in Book.query.all()]
+    @response_cache.cached("books", "authors", "categories", "genres")
+    @blp.arguments(BookListArgsSchema, location="query")
+    def get(self, args):
+        book_filter = BookFilter(args)
+        query = Book.short_rows_query().filter(*book_filter.conditions())
+        books, next_cursor = paginate(query, Book.id, args["limit"], args["after"])
 
-        return jsonify({
+        result = {
             "success": True,
-            "books": books
-        }), 200
+            "books": [Book.short_row(book) for book in books],
+            "next_cursor": next_cursor
+        }
+        if args["facets"]:
+            result["total"] = db.session.scalar(book_filter.count_select())
+            result["facets"] = book_filter.facets()
+
+        return jsonify(result), 200
 
     @require_auth("post:books")
     @blp.arguments(BookSchema)
-    def post(self, data):
+    @blp.arguments(GenreArgsSchema, location="query")
+    def post(self, data, args):
         """
         Get new book's data in form of JSON data. e.g.:
         {
@@ -37,17 +60,27 @@ class BookList(MethodView):
             "genres": list<string> | <list with genre names>,
             "description": string | <description of the book>,
         }
+        The file of the book is uploaded afterwards with PUT /books/<id>/file.
+        Genres are looked up at once, missing ones are created with `?create_genres=true`.
         """
         try:
             author = Author.query.filter_by(name=data["author"]).one_or_none()
+            if not author:
+                abort(404, message="AUTHOR NOT FOUND")
+
             category = Category.query.filter_by(name=data["category"]).one_or_none()
-            file = request.files["book"]
-            file.save(os.path.join("../../resources/books", data["name"]))
+            if not category:
+                abort(404, message="CATEGORY NOT FOUND")
+
+            # genres are created last, a rejected request must not insert them
+            genre_ids, created_genres = Genre.ids_by_name(data["genres"], create=args["create_genres"])
+            if len(genre_ids) < len(set(data["genres"])):
+                abort(404, message="GENRE NOT FOUND")
 
             book = Book(
                 name=data["name"],
                 description=data["description"],
-                author=author.id,
+                author_id=author.id,
                 rating=0.0,
                 rates=0,
                 downloads=0,
@@ -56,59 +89,142 @@ class BookList(MethodView):
                 category_id=category.id
             )
 
-            for genre_name in data["genres"]:
-                genre = Genre.query.filter_by(name=genre_name)
-                book.genres.append(genre)
-        
+            db.session.add(book)
+            db.session.flush()  # id of the book for its book_genre rows
+            replace_associations(book_genre, "book_id", book.id, "genre_id", genre_ids.values())
+            db.session.expire(book, ["genres"])
+
             book.insert()
+            if created_genres:
+                models_changed.send(Genre, ids=created_genres)
 
             return jsonify({
                 "success": True,
                 "new_book": book.short()
             }), 201
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
-        finally:
-            db.session.close()
+            abort(500)
+
+
+@blp.route("/book/top")
+class BookTop(MethodView):
+    @require_auth("get:books")
+    @response_cache.cached("books", "authors", "categories", "genres")
+    @blp.arguments(TopArgsSchema, location="query")
+    def get(self, args):
+        """
+        Most downloaded or best rated books, optionally of one category and/or genre.
+        Ratings are ranked by Bayesian average, so a single 5-star rate does not top
+        books rated by hundreds; `score` is the value books are ranked by.
+        """
+        category_id = genre_id = None
+
+        if args["category"] is not None:
+            category = Category.query.filter_by(name=args["category"]).one_or_none()
+            if not category:
+                abort(404, message="CATEGORY NOT FOUND")
+            category_id = category.id
+
+        if args["genre"] is not None:
+            genre = Genre.query.filter_by(name=args["genre"]).one_or_none()
+            if not genre:
+                abort(404, message="GENRE NOT FOUND")
+            genre_id = genre.id
+
+        scores = dict(leaderboards.top(args["by"], args["limit"], category_id, genre_id))
+        books = Book.short_rows_query().filter(Book.id.in_(scores)).all() if scores else []
+        books.sort(key=lambda book: (-scores[book.id], book.id))
+
+        return jsonify({
+            "success": True,
+            "by": args["by"],
+            "books": [dict(Book.short_row(book), score=round(scores[book.id], 4)) for book in books]
+        }), 200
+
+
+@blp.route("/book/import")
+class BookImport(MethodView):
+    @require_auth("post:books")
+    @blp.arguments(ImportArgsSchema, location="query")
+    def post(self, args):
+        """
+        Bulk import of books. Body is streamed NDJSON (one book JSON per line, same
+        fields as POST /book) or CSV (header with the same field names, genres separated
+        by `;`). Missing authors, categories and genres are created. Invalid rows are
+        reported and skipped, the rest is imported.
+        """
+        fmt = args["format"]
+        if fmt is None:
+            fmt = "csv" if request.mimetype == "text/csv" else "ndjson"
+
+        report = import_books(text_stream(request.stream), fmt)
+
+        return jsonify({
+            "success": report.failed == 0,
+            **report.format()
+        }), 200
+
+
+@blp.route("/export")
+class BookExport(MethodView):
+    @require_auth("get:books-details")
+    @blp.arguments(ExportArgsSchema, location="query")
+    def get(self, args):
+        """
+        The whole catalogue as NDJSON, one book per line in the format of GET /books/<id>,
+        ordered by id. The body is streamed while books are read, gzipped with `gzip=true`.
+        """
+        chunks = stream_with_context(export_books())
+
+        if args["gzip"]:
+            response = Response(gzip_stream(chunks), mimetype="application/gzip")
+            response.headers["Content-Disposition"] = "attachment; filename=books.ndjson.gz"
+        else:
+            response = Response(chunks, mimetype="application/x-ndjson")
+            response.headers["Content-Disposition"] = "attachment; filename=books.ndjson"
+
+        return response
 
 
 @blp.route("/books/<int:id>")
-class Book(MethodView):
+class BookDetail(MethodView):
     @require_auth("get:books-details")
+    @response_cache.cached("book:{id}", "authors", "categories", "genres")
     def get(self, id: int):
-        try:
-            book = Book.query.filter_by(id=id)
-            
-            return jsonify({
-                "success": True,
-                "book": book.long()
-            }), 200
-        except:
+        book = Book.long_query().filter_by(id=id).one_or_none()
+
+        if not book:
             # user inputted book's id by himself
             abort(404, message="REQUESTED BOOK DOES NOT EXIST")
 
+        return jsonify({
+            "success": True,
+            "book": book.long()
+        }), 200
+
     @require_auth("delete:books")
     def delete(self, id: int):
-        book = Book.query.filter_by(id=id)
+        book = db.session.get(Book, id)
 
         if not book:
             abort(404, message="BOOK NOT FOUND")
 
         try:
-            book.delete()
+            book.delete()  # signals model_deleted, which updates the cache and in-process indexes
             return jsonify({
                 "success": True,
-                "deleted_book_id": book.id
+                "deleted_book_id": id
             }), 200
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
-        finally:
-            db.session.close()
+            abort(500)
 
-    # @require_auth("patch:books")
-    def patch(self, id: int):
+    @require_auth("patch:books")
+    @blp.arguments(GenreArgsSchema, location="query")
+    def patch(self, args, id: int):
         """
         Get new book's data in form of JSON data. e.g.:
         {
@@ -119,56 +235,167 @@ class Book(MethodView):
             "author": string | only name of the author,
             "category": string | category name,
             "genres": list<string> | list with names of genres
-            "description": string,
-            "rating": float,
-            "rates": int, number of rates,
-            "downloads": int, number of downloads
+            "description": string
         }
+        rating, rates and downloads are counted by POST /books/<id>/rating and GET /books/<id>/file.
+        Genres replace those of the book and are looked up at once, missing ones are created with
+        `?create_genres=true`.
         """
-        book = Book.query.filter_by(id=id)  # get book
-        json_data = request.get_json()  # get json data
-
-        if id != int(json_data["id"]):  # user changed or sent by himself json data to server
-            abort(422)
+        book = db.session.get(Book, id)
 
         if not book:  # user typed URL by himself
-            abort(404)
-
-        if not json_data:  # server did not receive data to update
-            abort(422)
+            abort(404, message="BOOK NOT FOUND")
 
-        author = Author.query.filter_by(name=json_data["author"])
+        json_data = request.get_json()
 
-        if not author: # probably user sent json data by himself
+        if not json_data or json_data.get("id") != id:  # user changed or sent by himself json data to server
             abort(422)
 
-        category = Category.query.filter_by(name=json_data["category"])
+        try:
+            author = Author.query.filter_by(name=json_data["author"]).one_or_none()
+            if not author:
+                abort(404, message="AUTHOR NOT FOUND")
 
-        if not category:  # probably user sent json by himself
-            abort(422)
+            category = Category.query.filter_by(name=json_data["category"]).one_or_none()
+            if not category:
+                abort(404, message="CATEGORY NOT FOUND")
+
+            genre_ids, created_genres = Genre.ids_by_name(json_data["genres"], create=args["create_genres"])
+            if len(genre_ids) < len(set(json_data["genres"])):
+                abort(404, message="GENRE NOT FOUND")
 
-        try:
             book.name = json_data["title"]
-            book.num_pages = json_data["num_of_pages"]
+            book.num_of_pages = json_data["num_of_pages"]
             book.year_of_publishing = json_data["year_of_publishing"]
-            book.author = author
-            book.category = category
+            book.author_id = author.id
+            book.category_id = category.id
             book.description = json_data["description"]
-            book.rating = json_data["rating"]
-            book.rates = json_data["rates"]
-            book.downloads = json_data["downloads"]
-
-            for genre in json_data["genres"]:
-                genre_object = Genre.query.filter_by(name=genre).one_or_none()
-                
-                if genre_object:
-                    book.genres.append(genre_object)        
+
+            replace_associations(book_genre, "book_id", id, "genre_id", genre_ids.values())
+            db.session.expire(book, ["genres"])
+
             book.update()
-    
-        except exc:
-            print(exc)
+            if created_genres:
+                models_changed.send(Genre, ids=created_genres)
+
+            return jsonify({
+                "success": True,
+                "updated_book": book.short()
+            }), 200
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
             abort(500)
-        finally:
-            db.session.close()
- 
\ No newline at end of file
+
+
+@blp.route("/books/<int:id>/similar")
+class BookSimilar(MethodView):
+    @require_auth("get:books-details")
+    @response_cache.cached("books", "authors")
+    @blp.arguments(SimilarArgsSchema, location="query")
+    def get(self, args, id: int):
+        """
+        Books related to the book: sharing its genres (Jaccard similarity), its author or its
+        category, lifted by rating and downloads. `score` is the value books are ranked by.
+        """
+        similar = similar_books.similar(id, args["limit"])
+
+        if similar is None:
+            abort(404, message="REQUESTED BOOK DOES NOT EXIST")
+
+        scores = dict(similar)
+        books = Book.short_rows_query().filter(Book.id.in_(scores)).all() if scores else []
+        books.sort(key=lambda book: (-scores[book.id], book.id))
+
+        return jsonify({
+            "success": True,
+            "book_id": id,
+            "books": [dict(Book.short_row(book), score=round(scores[book.id], 4)) for book in books]
+        }), 200
+
+
+@blp.route("/books/<int:id>/file")
+class BookFile(MethodView):
+    @require_auth("get:books-details")
+    def get(self, id: int):
+        """
+        Download file of the book. Supports `Range` requests (resuming, seeking in readers).
+        The file is handed to the WSGI server's `wsgi.file_wrapper`, which sends it with
+        `sendfile()` where available (or to the front proxy when USE_X_SENDFILE is set).
+        """
+        book = Book.query.filter_by(id=id).one_or_none()
+
+        if not book or not storage.exists(book.file_sha256):
+            abort(404, message="BOOK FILE NOT FOUND")
+
+        response = send_file(
+            storage.path(book.file_sha256),
+            mimetype="application/octet-stream",
+            as_attachment=True,
+            download_name=book.name,
+            conditional=True,
+            etag=book.file_sha256,
+            max_age=0
+        )
+
+        # count a download once: full transfers and the first chunk of ranged ones
+        if response.status_code == 200 or (
+            response.status_code == 206 and request.range and request.range.ranges[0][0] == 0
+        ):
+            counters.add_download(id)
+
+        return response
+
+    @require_auth("patch:books")
+    def put(self, id: int):
+        """
+        Upload file of the book as raw request body (application/octet-stream), streamed to disk.
+        Identical files are stored once; a replaced file is removed by `flask storage gc`
+        when no other book uses it.
+        """
+        book = Book.query.filter_by(id=id).one_or_none()
+
+        if not book:
+            abort(404, message="BOOK NOT FOUND")
+
+        stored = storage.save(request.stream)
+
+        try:
+            book.file_sha256 = stored.sha256
+            book.file_size = stored.size
+            book.update()
+
+            return jsonify({
+                "success": True,
+                "book_id": id,
+                "size": stored.size,
+                "sha256": stored.sha256,
+                "deduplicated": not stored.created
+            }), 200
+        except exc.SQLAlchemyError as e:
+            print(e)
+            db.session.rollback()
+            abort(500)
+
+
+@blp.route("/books/<int:id>/rating")
+class BookRating(MethodView):
+    @require_auth("post:ratings")
+    @blp.arguments(RatingSchema)
+    def post(self, data, id: int):
+        """
+        Rate the book. Example of JSON data:
+        {
+            "rating": float | from 1 to 5
+        }
+        Ratings are batched and applied to the book's average within a few seconds.
+        """
+        if not db.session.query(Book.query.filter_by(id=id).exists()).scalar():
+            abort(404, message="BOOK NOT FOUND")
+
+        counters.add_rating(id, data["rating"])
+
+        return jsonify({
+            "success": True,
+            "book_id": id
+        }), 202
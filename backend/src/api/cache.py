@@ -0,0 +1,256 @@
+"""
+Response cache for read-only catalogue endpoints.
+
+Cached views declare the tags their response depends on, e.g. `("books", "authors")`
+for GET /book or `("book:{id}", ...)` for a detail route (formatted with view kwargs).
+Every tag has a generation number; the cache key of a response contains the current
+generations of its tags, so bumping a tag makes every response depending on it
+unreachable without scanning the cache. Model write methods bump tags through
+`signals`:
+
+    Book      -> books, book:<id>
+    Author    -> authors, author:<id>
+    Category  -> categories, category:<id>
+    Genre     -> genres
+
+Each cached response carries an ETag, conditional requests get 304 Not Modified.
+
+A response read from a replica may predate writes the replica has not applied yet, even
+though its key has the bumped generations, so it is kept for `replica_ttl` seconds only.
+
+Backends: `MemoryBackend` (in-process LRU, default) or `RedisBackend`, shared by all
+workers, which works with any client having `get/set/mget/incr`, e.g. `FakeRedis`.
+"""
+
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, make_response, request
+
+from backend.src.database.models import Author, Book, Category, Genre
+from backend.src.database.signals import model_deleted, model_saved, models_changed
+
+CACHE_TTL = 300  # seconds, upper bound on staleness should an invalidation be missed
+CACHE_SIZE = 2048  # responses kept by MemoryBackend
+REPLICA_CACHE_TTL = 5  # seconds, for responses read from a replica, bounds replication lag in the cache
+
+TAGS = {  # model -> (tag of lists, tag of one row)
+    Book: ("books", "book"),
+    Author: ("authors", "author"),
+    Category: ("categories", "category"),
+    Genre: ("genres", "genre"),
+}
+
+
+class MemoryBackend:
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def mget(self, keys: list) -> list:
+        with self._lock:
+            return [self._counters.get(key) for key in keys]
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    def __init__(self, client, prefix: str = "e-library:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: int) -> None:
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def mget(self, keys: list) -> list:
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(self.prefix + key)
+
+
+class FakeRedis:
+    """In-process stand-in for a Redis client, implements what `RedisBackend` uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value, ex: int = None) -> bool:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def mget(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._data.get(key, (0, None))[0]) + 1
+            self._data[key] = (str(value).encode(), None)
+            return value
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl: int = CACHE_TTL, replica_ttl: int = REPLICA_CACHE_TTL):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.replica_ttl = replica_ttl
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+        model_saved.connect(self._on_saved, weak=False)
+        model_deleted.connect(self._on_deleted, weak=False)
+        models_changed.connect(self._on_changed, weak=False)
+
+    def init_app(self, app, backend=None) -> None:
+        """
+        Use `backend`, or Redis at RESPONSE_CACHE_REDIS_URL when configured and the
+        `redis` package is installed, or a fresh in-process LRU.
+        """
+
+        if backend is None and app.config.get("RESPONSE_CACHE_REDIS_URL"):
+            try:
+                import redis
+            except ImportError:
+                app.logger.warning("redis is not installed, using in-process response cache")
+            else:
+                backend = RedisBackend(redis.Redis.from_url(app.config["RESPONSE_CACHE_REDIS_URL"]))
+
+        self.backend = backend or MemoryBackend(app.config.get("RESPONSE_CACHE_SIZE", CACHE_SIZE))
+        self.ttl = app.config.get("RESPONSE_CACHE_TTL", self.ttl)
+        self.replica_ttl = app.config.get("RESPONSE_CACHE_REPLICA_TTL", self.replica_ttl)
+        app.extensions["response_cache"] = self
+
+    def cached(self, *tags):
+        """Cache successful responses of a GET view, see module docstring for `tags`."""
+
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                key = self.key(request.full_path, [tag.format(**kwargs) for tag in tags])
+
+                entry = self.lookup(key)
+                if entry is not None:
+                    return self._respond(*entry)
+
+                response = make_response(f(*args, **kwargs))
+
+                if response.status_code != 200 or response.direct_passthrough:
+                    return response
+
+                etag, mimetype, body = self.store(
+                    key, response.mimetype, response.get_data(), from_replica=g.get("db_replica") is not None
+                )
+
+                return self._respond(etag, mimetype, body, response)
+
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, *tags) -> None:
+        for tag in tags:
+            self.backend.incr(f"gen:{tag}")
+
+    def key(self, full_path: str, tags: list) -> str:
+        """Cache key of the response to `full_path` (path?query) depending on formatted `tags`."""
+
+        generations = self.backend.mget([f"gen:{tag}" for tag in tags])
+        version = ",".join(
+            f"{tag}={int(generation or 0)}" for tag, generation in zip(tags, generations)
+        )
+
+        return f"resp:{full_path}|{version}"
+
+    def lookup(self, key: str):
+        """(etag, mimetype, body) of a cached response, or None."""
+
+        entry = self.backend.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        return self._unpack(entry)
+
+    def store(self, key: str, mimetype: str, body: bytes, from_replica: bool = False) -> tuple:
+        etag = hashlib.sha1(body).hexdigest()
+        self.backend.set(key, self._pack(etag, mimetype, body), self.replica_ttl if from_replica else self.ttl)
+
+        return etag, mimetype, body
+
+    def _respond(self, etag: str, mimetype: str, body: bytes, response=None):
+        if response is None:
+            response = make_response(body)
+            response.mimetype = mimetype
+
+        response.set_etag(etag)
+
+        if request.if_none_match.contains(etag):
+            self.stats["not_modified"] += 1
+            response = make_response("", 304)
+            response.set_etag(etag)
+
+        return response
+
+    @staticmethod
+    def _pack(etag: str, mimetype: str, body: bytes) -> bytes:
+        return f"{etag}\n{mimetype}\n".encode() + body
+
+    @staticmethod
+    def _unpack(entry: bytes) -> tuple:
+        etag, mimetype, body = entry.split(b"\n", 2)
+        return etag.decode(), mimetype.decode(), body
+
+    def _on_saved(self, sender, instance):
+        self._on_changed(sender, ids=[instance.id])
+
+    def _on_deleted(self, sender, instance, id):
+        self._on_changed(sender, ids=[id])
+
+    def _on_changed(self, sender, ids):
+        if sender not in TAGS:
+            return
+
+        list_tag, row_tag = TAGS[sender]
+        self.invalidate(list_tag, *(f"{row_tag}:{id}" for id in ids))
+
+
+response_cache = ResponseCache()
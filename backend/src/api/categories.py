@@ -4,8 +4,10 @@ from flask.views import MethodView
 from sqlalchemy import exc
 
 from backend.src.database.models import Book, Category, db
-from backend.src.database.schemas import CategorySchema
+from backend.src.database.schemas import CategorySchema, PageArgsSchema
 from backend.src.auth.auth import require_auth
+from backend.src.api.cache import response_cache
+from backend.src.api.pagination import paginate
 
 
 blp = Blueprint("categories", __name__, description="Operation with categories")
@@ -14,9 +16,9 @@ blp = Blueprint("categories", __name__, description="Operation with categories")
 @blp.route("/categories")
 class CategoryList(MethodView):
     @require_auth("get:categories")
+    @response_cache.cached("categories", "books")
     def get(self):
-        categories = Category.query.all()
-        data = [category.short() for category in categories]
+        data = [category.short(num_of_books) for category, num_of_books in Category.with_num_of_books()]
 
         return jsonify({
             "success": True,
@@ -53,19 +55,32 @@ class CategoryList(MethodView):
                     abort(400, "BOOK NOT FOUND")
 
             new_category.insert()
-        except exc:
-            print(exc)
+        except exc.SQLAlchemyError as e:
+            print(e)
             db.session.rollback()
             abort(400)
-        finally:
-            db.session.close()
 
 
 @blp.route("/categories/<int:id>")
-class Category(MethodView):
+class CategoryDetail(MethodView):
     @require_auth("get:categories_details")
-    def get(self, id: int):
-        pass
+    @response_cache.cached("category:{id}", "books", "authors")
+    @blp.arguments(PageArgsSchema, location="query")
+    def get(self, args, id: int):
+        category = Category.query.filter_by(id=id).one_or_none()
+
+        if not category:
+            abort(404, message="CATEGORY NOT FOUND")
+
+        books, next_cursor = paginate(
+            Book.short_rows_query().filter(Book.category_id == id), Book.id, args["limit"], args["after"]
+        )
+
+        return jsonify({
+            "success": True,
+            "category": category.long(books),
+            "next_cursor": next_cursor
+        }), 200
 
     @require_auth("patch:categories")
     def patch(self, id: int):
@@ -0,0 +1,285 @@
+"""
+Request-level performance instrumentation of the Flask app, served on GET /metrics in
+the Prometheus text format.
+
+For every request, by method and URL rule:
+- latency histogram (with the response status);
+- histograms of the number of SQL statements and of the total SQL time, taken from
+  engine events of every engine (primary and replicas);
+- auth verification time spent in `require_auth`.
+
+Statements slower than `slow_query_threshold` seconds are logged to the
+`backend.src.api.metrics` logger, wherever they run (requests, CLI commands, counter
+flushes). Within a request, a statement executed `n_plus_one_threshold` times or more is
+flagged as a probable N+1 query (one lazy load per row of a list). Recent slow and
+repeated statements are listed on GET /stats/queries.
+
+Metrics are kept per worker process, like /stats/db-pool. Routes served by the async
+handlers of asgi.py do not go through the Flask app, their middleware binds a
+`RequestStats` to the asyncio task of the request with `bind()` instead.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend.src.database.pool import pool_stats
+
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.1"))  # seconds, statements above are logged
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))  # executions of one statement per request flagged
+RECENT_QUERIES = 100  # slow and repeated statements kept for /stats/queries
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+AUTH_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+POOL_METRICS = (  # (metric, type, key of `pool_stats()`), labelled with the bind of the pool
+    ("elibrary_db_pool_in_use", "gauge", "in_use"),
+    ("elibrary_db_pool_checkouts_total", "counter", "checkouts"),
+    ("elibrary_db_pool_timeouts_total", "counter", "timeouts"),
+    ("elibrary_db_pool_wait_seconds_total", "counter", "wait_seconds_total"),
+)
+
+logger = logging.getLogger(__name__)
+
+_async_request_stats = ContextVar("async_request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket..., count, sum]
+
+    def observe(self, values: tuple, value: float) -> None:
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+        for values, series in sorted(self.series.items()):
+            labels = list(zip(self.labels, values))
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                lines.append(f"{self.name}_bucket{_labels(labels + [('le', bound)])} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(labels)} {series[-2]}")
+
+        return lines
+
+
+class RequestStats:
+    """SQL statements and auth time of the request being handled."""
+
+    def __init__(self, method: str, endpoint: str):
+        self.method = method
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.status = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.auth_seconds = None
+
+
+class RequestMetrics:
+    def __init__(self, slow_query_threshold: float = SLOW_QUERY_THRESHOLD,
+                 n_plus_one_threshold: int = N_PLUS_ONE_THRESHOLD):
+        self.slow_query_threshold = slow_query_threshold
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def init_app(self, app, slow_query_threshold: float = None, n_plus_one_threshold: int = None) -> None:
+        if slow_query_threshold is not None:
+            self.slow_query_threshold = slow_query_threshold
+        if n_plus_one_threshold is not None:
+            self.n_plus_one_threshold = n_plus_one_threshold
+
+        app.before_request(self._start_request)
+        app.after_request(self._set_status)
+        app.teardown_request(self._finish_request)  # also runs for unhandled exceptions
+        app.extensions["request_metrics"] = self
+
+    def reset(self) -> None:
+        with self._lock:
+            self.latency = Histogram(
+                "elibrary_request_duration_seconds", "Time to handle a request.",
+                ("method", "endpoint", "status"), LATENCY_BUCKETS
+            )
+            self.sql_queries = Histogram(
+                "elibrary_request_sql_queries", "SQL statements executed by a request.",
+                ("method", "endpoint"), QUERY_COUNT_BUCKETS
+            )
+            self.sql_seconds = Histogram(
+                "elibrary_request_sql_seconds", "Total time of the SQL statements of a request.",
+                ("method", "endpoint"), LATENCY_BUCKETS
+            )
+            self.auth_seconds = Histogram(
+                "elibrary_auth_verification_seconds", "Time to verify the token of a request.",
+                ("method", "endpoint"), AUTH_BUCKETS
+            )
+            self.slow_queries_total = 0
+            self.n_plus_one_total = Counter()  # (method, endpoint) -> requests with a repeated statement
+            self.recent_slow_queries = deque(maxlen=RECENT_QUERIES)
+            self.recent_n_plus_one = deque(maxlen=RECENT_QUERIES)
+
+    def render(self, pools: dict = None) -> str:
+        """All metrics in the Prometheus text format, with metrics of connection `pools` by bind name."""
+
+        with self._lock:
+            lines = [
+                *self.latency.render(),
+                *self.sql_queries.render(),
+                *self.sql_seconds.render(),
+                *self.auth_seconds.render(),
+                "# HELP elibrary_slow_queries_total SQL statements slower than the slow query threshold.",
+                "# TYPE elibrary_slow_queries_total counter",
+                f"elibrary_slow_queries_total {self.slow_queries_total}",
+                "# HELP elibrary_n_plus_one_total Requests executing one statement at least N+1 threshold times.",
+                "# TYPE elibrary_n_plus_one_total counter",
+                *(
+                    f"elibrary_n_plus_one_total{_labels(zip(('method', 'endpoint'), key))} {count}"
+                    for key, count in sorted(self.n_plus_one_total.items())
+                ),
+            ]
+
+        stats = {name: pool_stats(pool) for name, pool in sorted((pools or {}).items())}
+        for metric, kind, key in POOL_METRICS:
+            lines += [
+                f"# TYPE {metric} {kind}",
+                *(f"{metric}{_labels([('pool', name)])} {values[key]}" for name, values in stats.items())
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def response(self, pools: dict = None) -> Response:
+        return Response(self.render(pools), mimetype="text/plain; version=0.0.4")
+
+    def format(self) -> dict:
+        with self._lock:
+            return {
+                "slow_query_threshold": self.slow_query_threshold,
+                "n_plus_one_threshold": self.n_plus_one_threshold,
+                "slow_queries": list(self.recent_slow_queries),
+                "n_plus_one": list(self.recent_n_plus_one),
+            }
+
+    def current(self):
+        """`RequestStats` of the request being handled, None outside of requests."""
+
+        if has_request_context():
+            return g.get("request_stats")
+
+        return _async_request_stats.get()
+
+    @staticmethod
+    def bind(stats: RequestStats):
+        """Make `stats` current in this context (asyncio task), returns a token for `unbind()`."""
+
+        return _async_request_stats.set(stats)
+
+    @staticmethod
+    def unbind(token) -> None:
+        _async_request_stats.reset(token)
+
+    def finish(self, stats: RequestStats) -> None:
+        """Record a handled request."""
+
+        key = (stats.method, stats.endpoint)
+        repeated = [
+            (statement, count) for statement, count in stats.statements.items()
+            if count >= self.n_plus_one_threshold
+        ]
+
+        with self._lock:
+            self.latency.observe((*key, str(stats.status)), time.perf_counter() - stats.start)
+            self.sql_queries.observe(key, stats.sql_count)
+            self.sql_seconds.observe(key, stats.sql_seconds)
+            if stats.auth_seconds is not None:
+                self.auth_seconds.observe(key, stats.auth_seconds)
+
+            if repeated:
+                self.n_plus_one_total[key] += 1
+            for statement, count in repeated:
+                self.recent_n_plus_one.append(
+                    {"method": key[0], "endpoint": key[1], "statement": statement, "count": count}
+                )
+
+        for statement, count in repeated:
+            logger.warning("probable N+1 query, %d executions in %s %s: %s", count, *key, statement)
+
+    @staticmethod
+    def _endpoint() -> str:
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    def _start_request(self):
+        g.request_stats = RequestStats(request.method, self._endpoint())
+
+    def _set_status(self, response):
+        if "request_stats" in g:
+            g.request_stats.status = response.status_code
+
+        return response
+
+    def _finish_request(self, exc=None):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return
+
+        if exc is not None or stats.status is None:
+            stats.status = 500
+        stats.auth_seconds = g.get("auth_seconds")
+        self.finish(stats)
+
+    def _before_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, connection, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is None:
+            return
+        seconds = time.perf_counter() - start
+
+        stats = self.current()
+        if stats is not None:
+            stats.sql_count += 1
+            stats.sql_seconds += seconds
+            stats.statements[statement] += 1
+
+        if seconds >= self.slow_query_threshold:
+            endpoint = f"{stats.method} {stats.endpoint}" if stats is not None else None
+            with self._lock:
+                self.slow_queries_total += 1
+                self.recent_slow_queries.append({"endpoint": endpoint, "statement": statement, "seconds": round(seconds, 6)})
+            logger.warning("slow query, %.3f s in %s: %s", seconds, endpoint or "no request", statement)
+
+
+def _labels(pairs) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+request_metrics = RequestMetrics()
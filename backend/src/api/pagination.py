@@ -0,0 +1,61 @@
+"""
+Keyset (cursor) pagination for list endpoints.
+
+Pages are selected with `WHERE id > :after ORDER BY id LIMIT :limit` instead of
+OFFSET, so every page costs the same no matter how deep into the table it is.
+The cursor handed to clients is an opaque url-safe token wrapping the last id.
+"""
+
+import base64
+import binascii
+import json
+
+from flask_smorest import abort
+
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """Return id wrapped in the cursor. Aborts with 400 if the cursor was tampered with."""
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        abort(400, message="INVALID CURSOR")
+
+    if not isinstance(last_id, int):
+        abort(400, message="INVALID CURSOR")
+
+    return last_id
+
+
+def page_of(query, id_column, limit: int, after: str = None):
+    """
+    Restrict `query` (ORM Query or select statement) to one page ordered by `id_column`.
+    One extra row is fetched to know whether there is a next page without COUNT(*).
+    """
+
+    if after:
+        query = query.filter(id_column > decode_cursor(after))
+
+    return query.order_by(id_column).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int):
+    """Return rows of the page and the cursor of the next page (None on the last page)."""
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].id)
+
+
+def paginate(query, id_column, limit: int, after: str = None):
+    """Return one page of `query` ordered by `id_column` and the cursor of the next page."""
+
+    return split_page(page_of(query, id_column, limit, after).all(), limit)
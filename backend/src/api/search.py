@@ -0,0 +1,49 @@
+from flask import jsonify
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from backend.src.database.models import Book
+from backend.src.database.schemas import SearchArgsSchema, SuggestArgsSchema
+from backend.src.auth.auth import require_auth
+from backend.src.api.cache import response_cache
+from backend.src.search.engines import search
+from backend.src.search.suggest import suggestions
+
+
+blp = Blueprint("search", __name__, description="Full-text search over books")
+
+
+@blp.route("/search")
+class Search(MethodView):
+    @require_auth("get:books")
+    @response_cache.cached("books", "authors")
+    @blp.arguments(SearchArgsSchema, location="query")
+    def get(self, args):
+        """Books matching all terms of `q` in title, description or author name, most relevant first."""
+
+        scores = dict(search.search(args["q"], args["limit"]))
+        books = Book.short_rows_query().filter(Book.id.in_(scores)).all() if scores else []
+        books.sort(key=lambda book: (-scores[book.id], book.id))
+
+        return jsonify({
+            "success": True,
+            "books": [dict(Book.short_row(book), score=round(scores[book.id], 4)) for book in books],
+            "total": len(books)
+        }), 200
+
+
+@blp.route("/suggest")
+class Suggest(MethodView):
+    @require_auth("get:books")
+    @response_cache.cached("books", "authors", "genres")
+    @blp.arguments(SuggestArgsSchema, location="query")
+    def get(self, args):
+        """Titles, authors and genres with a word starting with `q`, most downloaded first, for as-you-type search."""
+
+        matches = suggestions.suggest(args["q"], args["limit"])
+
+        return jsonify({
+            "success": True,
+            "suggestions": matches,
+            "total": len(matches)
+        }), 200
@@ -1,13 +1,34 @@
-import json
-from urllib.request import urlopen
-from flask import request
+import os
+import time
+from flask import g, request
 from functools import wraps
 from jose import jwt
 
+from backend.src.auth.jwks import JWKSKeyStore, url_fetcher
+from backend.src.auth.token_cache import VerifiedTokenCache
+
 
 AUTH0_DOMAIN = ""
 ALGORITHMS = []
 API_AUDIENCE = ""
+JWKS_TTL = int(os.getenv("JWKS_TTL", "600"))  # seconds between background refreshes of the signing keys
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))  # max number of cached verified tokens
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))  # seconds a verified token is trusted without re-verification
+
+
+"""
+JWKS key store, shared by all requests of the process.
+Can be replaced by a store with another fetcher, e.g. `file_fetcher` in tests.
+"""
+
+jwks_store = JWKSKeyStore(url_fetcher(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"), ttl=JWKS_TTL)
+
+
+"""
+Payloads of already verified tokens. Cache hits skip signature verification.
+"""
+
+token_cache = VerifiedTokenCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
 
 
 """
@@ -22,7 +43,11 @@ class AuthError(Exception):
 
 
 def get_token_auth_header():
-    auth_header = request.headers['Authentication']
+    return parse_auth_header(request.headers.get('Authentication'))
+
+
+def parse_auth_header(auth_header: str) -> str:
+    """Return token of `bearer <token>` header value."""
 
     if not auth_header:
         raise AuthError({
@@ -63,8 +88,11 @@ def check_permission(permission: str, payload: dict) -> bool:
 
 
 def verify_decode_jwt(token: str):
-    json_url = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.load(json_url.read())
+    payload = token_cache.get(token)
+
+    if payload is not None:
+        return payload
+
     jwt_header = jwt.get_unverified_header(token)
 
     if "kid" not in jwt_header:
@@ -73,16 +101,7 @@ def verify_decode_jwt(token: str):
             "description": "Malformed token."
         }, 401)
 
-    rsa_key = {}
-
-    for key in jwks:
-        if key["kid"] == jwt_header["kid"]:
-            rsa_key = {
-                "kid": key["kid"],
-                "kty": key["kty"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    rsa_key = jwks_store.get_key(jwt_header["kid"])
 
     if rsa_key:
         try:
@@ -92,6 +111,7 @@ def verify_decode_jwt(token: str):
                                  audience=API_AUDIENCE,
                                  issuer=f"https://{AUTH0_DOMAIN}"
                                  )
+            token_cache.put(token, payload)
 
             return payload
         except jwt.ExpiredSignatureError:
@@ -121,11 +141,16 @@ def require_auth(permission=""):
     def require_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            start = time.perf_counter()
+            try:
+                token = get_token_auth_header()
+                payload = verify_decode_jwt(token)
+            finally:
+                g.auth_seconds = time.perf_counter() - start  # observed by request metrics, see api/metrics.py
             check_permission(permission, payload)
+            g.jwt_payload = payload  # views are MethodView methods, so the payload is not passed positionally
 
-            return f(payload, *args, **kwargs)
+            return f(*args, **kwargs)
 
         return wrapper
 
@@ -0,0 +1,143 @@
+"""
+In-process JWKS key store for the auth layer.
+
+Signing keys are fetched from the issuer once, indexed by `kid` and refreshed
+in a background thread every `ttl` seconds, so verifying a token does not cost
+an HTTPS round trip to the issuer.
+"""
+
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+def url_fetcher(url: str, timeout: float = 5.0):
+    """Fetcher that downloads the JWKS document from `url`."""
+
+    def fetch() -> dict:
+        with urlopen(url, timeout=timeout) as response:
+            return json.load(response)
+
+    return fetch
+
+
+def file_fetcher(path: str):
+    """Fetcher that reads the JWKS document from a local file. Handy for tests."""
+
+    def fetch() -> dict:
+        with open(path) as jwks_file:
+            return json.load(jwks_file)
+
+    return fetch
+
+
+class JWKSKeyStore:
+    """
+    Keys of a JWKS document indexed by `kid`.
+
+    - keys are refreshed every `ttl` seconds by a daemon thread (started on first use);
+    - an unknown `kid` triggers one refetch, at most once per `min_refetch_interval`
+      seconds, so a client spraying random `kid`s can not hammer the issuer;
+    - when the issuer is unreachable the keys fetched last are served.
+    """
+
+    def __init__(self, fetcher, ttl: float = 600, min_refetch_interval: float = 30, background: bool = True):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.background = background
+
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_key(self, kid: str):
+        """Return RSA key with given `kid` or None if the issuer does not know it."""
+
+        self._ensure_started()
+
+        if not self.background and self._is_stale() and self._may_refetch():
+            self.refresh()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self.stats["hits"] += 1
+            return key
+
+        self.stats["misses"] += 1
+
+        # unknown kid: the issuer may have rotated its keys since the last refresh
+        if self._may_refetch():
+            self.refresh()
+
+        return self._keys.get(kid)
+
+    def refresh(self) -> bool:
+        """Fetch JWKS document and replace the keys. Keeps old keys on failure."""
+
+        with self._lock:
+            self._last_attempt = time.monotonic()
+            try:
+                jwks = self.fetcher()
+            except Exception:
+                self.stats["refresh_errors"] += 1
+                return False
+
+            self._keys = {
+                key["kid"]: {
+                    "kid": key["kid"],
+                    "kty": key["kty"],
+                    "n": key["n"],
+                    "e": key["e"]
+                }
+                for key in jwks.get("keys", [])
+                if "kid" in key
+            }
+            self._fetched_at = time.monotonic()
+            self.stats["refreshes"] += 1
+
+            return True
+
+    def start(self) -> None:
+        """Start background refresh thread."""
+
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="jwks-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop background refresh thread."""
+
+        self._stop.set()
+        with self._thread_lock:
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+
+    def _ensure_started(self) -> None:
+        if self._fetched_at == 0.0 and self._last_attempt == 0.0:
+            self.refresh()
+
+        if self.background and self._thread is None:
+            self.start()
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+    def _may_refetch(self) -> bool:
+        return time.monotonic() - self._last_attempt >= self.min_refetch_interval
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl):
+            self.refresh()
@@ -0,0 +1,76 @@
+"""
+Cache of verified JWT payloads.
+
+Clients reuse the same bearer token for many requests, so the payload of a token
+which passed signature and claims verification is kept in a bounded LRU cache.
+Entries are keyed by a SHA-256 digest of the token (raw tokens are never stored)
+and expire together with the token (`exp` claim) or after `ttl` seconds.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.stats = {"hits": 0, "misses": 0}
+
+        self._entries = OrderedDict()  # digest -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        """Return cached payload of the token or None."""
+
+        key = self.digest(token)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        """Cache verified payload until the token expires."""
+
+        expires_at = time.time() + self.ttl
+        if "exp" in payload:
+            expires_at = min(expires_at, float(payload["exp"]))
+
+        key = self.digest(token)
+
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all cached payloads, e.g. after signing keys were revoked."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,79 @@
+"""
+`flask books ...` and `flask schema ...` commands.
+"""
+
+import json
+import os
+
+import click
+from flask.cli import AppGroup
+from flask_migrate import stamp
+
+from backend.src.database.exporter import CHUNK_SIZE as EXPORT_CHUNK_SIZE, export_books, gzip_stream
+from backend.src.database.importer import CHUNK_SIZE, FORMATS, import_books
+from backend.src.database.models import db_drop_and_create_all, upgrade_db
+
+books_cli = AppGroup("books", help="Manage the catalogue.")
+
+
+@books_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default=None,
+              help="Format of the file. Guessed from its extension by default.")
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True, help="Books inserted per transaction.")
+def import_command(path: str, fmt: str, chunk_size: int):
+    """Import books from an NDJSON or CSV file."""
+
+    if fmt is None:
+        fmt = "csv" if os.path.splitext(path)[1].lower() == ".csv" else "ndjson"
+
+    with open(path, encoding="utf-8", newline="") as stream:
+        report = import_books(stream, fmt, chunk_size).format()
+
+    for error in report["errors"]:
+        click.echo(f"line {error['line']}: {json.dumps(error['errors'])}", err=True)
+    click.echo(
+        f"inserted {report['inserted']}, failed {report['failed']} "
+        f"in {report['seconds']}s ({report['rows_per_second']} rows/s)"
+    )
+
+
+@books_cli.command("export")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--gzip", "compress", is_flag=True, help="Compress the file. Implied by a .gz extension.")
+@click.option("--chunk-size", default=EXPORT_CHUNK_SIZE, show_default=True, help="Books read per round trip.")
+def export_command(path: str, compress: bool, chunk_size: int):
+    """Export all books to an NDJSON file, one book per line."""
+
+    chunks = export_books(chunk_size)
+    if compress or path.endswith(".gz"):
+        chunks = gzip_stream(chunks)
+
+    size = 0
+    with open(path, "wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+            size += len(chunk)
+
+    click.echo(f"exported {size} bytes to {path}")
+
+
+schema_cli = AppGroup("schema", help="Manage the database schema. Nothing is created or dropped at app start.")
+
+
+@schema_cli.command("upgrade")
+def upgrade_command():
+    """Apply pending migrations, see also `flask db`."""
+
+    upgrade_db()
+    click.echo("schema is up to date")
+
+
+@schema_cli.command("reset")
+@click.confirmation_option(prompt="Drop every table of the primary database and create empty ones?")
+def reset_command():
+    """Drop and create all tables, marked as migrated to the latest revision."""
+
+    db_drop_and_create_all()
+    stamp(revision="head")
+    click.echo("schema was reset")
@@ -0,0 +1,155 @@
+"""
+Batched book counters.
+
+Downloads and ratings of popular books arrive many times per second. Instead of a
+read-modify-write and a commit per event, increments are summed up in memory per book
+and written every `flush_interval` seconds (or as soon as `max_pending` events are
+waiting) with one atomic UPDATE per book:
+
+    UPDATE book SET downloads = downloads + :downloads,
+                    rating = (rating * rates + :rating_sum) / (rates + :rates),
+                    rates = rates + :rates
+    WHERE id = :book_id
+
+Both sides of the SET clause see the old row, so the running average stays correct
+no matter how many workers flush concurrently. Pending increments are flushed on
+interpreter shutdown.
+"""
+
+import atexit
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, case, func, update
+
+from backend.src.database.models import Book, db
+from backend.src.database.signals import models_changed
+
+
+class CounterAggregator:
+    def __init__(self, flush_interval: float = 5.0, max_pending: int = 1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.app = None
+
+        self._pending = defaultdict(lambda: [0, 0.0, 0])  # book id -> [downloads, sum of ratings, number of ratings]
+        self._num_pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app, background: bool = True) -> None:
+        self.app = app
+        app.extensions["counters"] = self
+
+        if background and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="book-counters", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def add_download(self, book_id: int, n: int = 1) -> None:
+        self._add(book_id, downloads=n)
+
+    def add_rating(self, book_id: int, rating: float) -> None:
+        self._add(book_id, rating_sum=rating, rates=1)
+
+    def flush(self) -> int:
+        """Write pending increments to the database. Returns number of updated books."""
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(lambda: [0, 0.0, 0])
+                self._num_pending = 0
+
+            if not pending:
+                return 0
+
+            params = [
+                {"book_id": book_id, "d_downloads": downloads, "d_rating_sum": rating_sum, "d_rates": rates}
+                for book_id, (downloads, rating_sum, rates) in sorted(pending.items())  # fixed lock order
+            ]
+
+            try:
+                with self.app.app_context():
+                    db.session.execute(self._statement(), params)
+                    db.session.commit()
+            except Exception as e:
+                print(e)
+                with self.app.app_context():
+                    db.session.rollback()
+                self._restore(pending)
+                return 0
+
+            models_changed.send(Book, ids=[param["book_id"] for param in params])
+
+            return len(params)
+
+    def shutdown(self) -> None:
+        """Stop background thread and drain pending increments."""
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.app is not None:
+            self.flush()
+
+    @staticmethod
+    def _statement():
+        book = Book.__table__
+        downloads = func.coalesce(book.c.downloads, 0)
+        rating = func.coalesce(book.c.rating, 0.0)
+        rates = func.coalesce(book.c.rates, 0)
+        d_rates = bindparam("d_rates")
+
+        return (
+            update(book)
+            .where(book.c.id == bindparam("book_id"))
+            .values(
+                downloads=downloads + bindparam("d_downloads"),
+                rating=case(
+                    (d_rates == 0, book.c.rating),
+                    else_=(rating * rates + bindparam("d_rating_sum")) / (rates + d_rates)
+                ),
+                rates=rates + d_rates
+            )
+        )
+
+    def _add(self, book_id: int, downloads: int = 0, rating_sum: float = 0.0, rates: int = 0) -> None:
+        with self._lock:
+            counters = self._pending[book_id]
+            counters[0] += downloads
+            counters[1] += rating_sum
+            counters[2] += rates
+            self._num_pending += 1
+            full = self._num_pending >= self.max_pending
+
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def _restore(self, pending: dict) -> None:
+        """Put back increments of a failed flush, they are retried with the next one."""
+
+        with self._lock:
+            for book_id, (downloads, rating_sum, rates) in pending.items():
+                counters = self._pending[book_id]
+                counters[0] += downloads
+                counters[1] += rating_sum
+                counters[2] += rates
+                self._num_pending += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+counters = CounterAggregator()
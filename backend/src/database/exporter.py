@@ -0,0 +1,42 @@
+"""
+Streaming export of the catalogue as NDJSON, one `Book.long()` record per line.
+
+Books are read in id order through a server-side cursor (`yield_per`), so only one
+chunk of rows is held at a time. Authors and categories are joined into the same
+statement, genres of each chunk are loaded with one IN query (see `Book.long_options`).
+The session's identity map only holds weak references, so exported rows are freed
+with their chunk. Encoded chunks are yielded as they are ready, optionally through a
+streaming gzip compressor, so memory use does not grow with the size of the catalogue.
+"""
+
+import zlib
+
+from flask import current_app
+from sqlalchemy import select
+
+from backend.src.database.models import Book, db
+
+CHUNK_SIZE = 1000
+
+
+def export_books(chunk_size: int = CHUNK_SIZE):
+    """Yield NDJSON of all books in chunks of encoded lines. Call inside app context."""
+
+    statement = select(Book).options(*Book.long_options()).order_by(Book.id).execution_options(yield_per=chunk_size)
+
+    for partition in db.session.scalars(statement).partitions():
+        lines = [current_app.json.dumps(book.long()) for book in partition]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def gzip_stream(chunks, level: int = 6):
+    """Compress a stream of bytes into one gzip member, chunk by chunk."""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
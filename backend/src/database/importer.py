@@ -0,0 +1,239 @@
+"""
+Bulk import of books from NDJSON or CSV.
+
+Rows are validated with `BookSchema` and written in chunks:
+- authors, categories and genres are resolved through name -> id maps preloaded once
+  per import; names missing from the maps are inserted with one multi-row INSERT each;
+- books of a chunk are inserted with one executemany INSERT ... RETURNING id, their
+  `book_genre` rows with another one, and the chunk is committed once.
+
+A chunk which fails in the database is retried row by row inside savepoints, so one
+bad row is reported instead of aborting the whole import.
+
+After the commit of a chunk, `models_changed` is sent once per model with the ids of
+the books inserted and of the authors, categories and genres they use (created or not).
+
+NDJSON: one `BookSchema` object per line.
+CSV: header with `BookSchema` field names, genres separated by `;`.
+"""
+
+import csv
+import io
+import json
+import time
+
+from marshmallow import ValidationError
+from sqlalchemy import exc, insert, select
+
+from backend.src.database.models import Author, Book, Category, Genre, book_genre, db
+from backend.src.database.schemas import BookSchema
+from backend.src.database.signals import models_changed
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("ndjson", "csv")
+
+
+def read_ndjson(stream):
+    """Yield (line number, row) pairs. Undecodable lines are yielded as exceptions."""
+
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as e:
+            yield line_no, e
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+
+    for row in reader:
+        row.pop(None, None)  # values without a header
+        if row.get("genres") is not None:
+            row["genres"] = [genre.strip() for genre in row["genres"].split(";") if genre.strip()]
+        yield reader.line_num, row
+
+
+def read_rows(stream, fmt: str):
+    """Yield (line number, row) pairs from a text stream in given format."""
+
+    if fmt == "ndjson":
+        return read_ndjson(stream)
+    if fmt == "csv":
+        return read_csv(stream)
+
+    raise ValueError(f"unknown format {fmt!r}, expected one of {FORMATS}")
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.started_at = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line_no: int, errors) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "errors": errors})
+
+    def finish(self) -> "ImportReport":
+        self.seconds = time.perf_counter() - self.started_at
+        return self
+
+    def format(self) -> dict:
+        processed = self.inserted + self.failed
+
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(processed / self.seconds, 1) if self.seconds else None
+        }
+
+
+class BookImporter:
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.schema = BookSchema()
+
+        # preloaded once per import, extended with inserted rows
+        self.authors = self._load_map(Author)
+        self.categories = self._load_map(Category)
+        self.genres = self._load_map(Genre)
+
+    def run(self, rows) -> ImportReport:
+        """Import (line number, row) pairs, see `read_rows`."""
+
+        report = ImportReport()
+        chunk = []
+
+        for line_no, row in rows:
+            if isinstance(row, Exception):
+                report.error(line_no, {"_schema": [str(row)]})
+                continue
+
+            try:
+                chunk.append((line_no, self.schema.load(row)))
+            except ValidationError as e:
+                report.error(line_no, e.messages)
+                continue
+
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk, report)
+                chunk = []
+
+        if chunk:
+            self._import_chunk(chunk, report)
+
+        return report.finish()
+
+    @staticmethod
+    def _load_map(model) -> dict:
+        names = {}
+        for id, name in db.session.execute(select(model.id, model.name).order_by(model.id.desc())):
+            names[name] = id  # lowest id wins for duplicated names
+
+        return names
+
+    def _resolve(self, model, names: dict, wanted: set) -> None:
+        """Insert rows for names missing in `names` and add their ids to it."""
+
+        missing = sorted(wanted - names.keys())
+        if not missing:
+            return
+
+        db.session.execute(insert(model.__table__), [{"name": name} for name in missing])
+        rows = db.session.execute(select(model.id, model.name).where(model.name.in_(missing)))
+        for id, name in rows:
+            names.setdefault(name, id)
+
+    def _import_chunk(self, chunk: list, report: ImportReport) -> None:
+        try:
+            book_ids = self._write(chunk)
+            db.session.commit()
+            written = chunk
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            self._reload_maps()
+            book_ids, written = [], []
+
+            for line_no, data in chunk:
+                try:
+                    with db.session.begin_nested():
+                        book_ids.extend(self._write([(line_no, data)]))
+                    written.append((line_no, data))
+                except exc.SQLAlchemyError as e:
+                    report.error(line_no, {"_schema": [str(getattr(e, "orig", None) or e)]})
+                    self._reload_maps()
+            db.session.commit()
+
+        report.inserted += len(book_ids)
+        self._notify(book_ids, written)
+
+    def _write(self, chunk: list) -> list:
+        self._resolve(Author, self.authors, {data["author"] for _, data in chunk})
+        self._resolve(Category, self.categories, {data["category"] for _, data in chunk})
+        self._resolve(Genre, self.genres, {genre for _, data in chunk for genre in data["genres"]})
+
+        books = [
+            {
+                "name": data["name"],
+                "description": data["description"],
+                "author_id": self.authors[data["author"]],
+                "category_id": self.categories[data["category"]],
+                "num_of_pages": data["num_of_pages"],
+                "year_of_publishing": data["year_of_publishing"],
+                "rating": data.get("rating", 0.0),
+                "rates": data.get("rates", 0),
+                "downloads": data.get("downloads", 0)
+            }
+            for _, data in chunk
+        ]
+
+        book_ids = db.session.scalars(
+            insert(Book.__table__).returning(Book.__table__.c.id, sort_by_parameter_order=True),
+            books
+        ).all()
+
+        associations = [
+            {"book_id": book_id, "genre_id": self.genres[genre]}
+            for book_id, (_, data) in zip(book_ids, chunk)
+            for genre in set(data["genres"])
+        ]
+        if associations:
+            db.session.execute(insert(book_genre), associations)
+
+        return book_ids
+
+    def _reload_maps(self) -> None:
+        """Drop ids inserted by a rolled back transaction."""
+
+        self.authors = self._load_map(Author)
+        self.categories = self._load_map(Category)
+        self.genres = self._load_map(Genre)
+
+    def _notify(self, book_ids: list, written: list) -> None:
+        """Let in-process indexes and the response cache know about a committed chunk."""
+
+        if not book_ids:
+            return
+
+        models_changed.send(Author, ids=sorted({self.authors[data["author"]] for _, data in written}))
+        models_changed.send(Category, ids=sorted({self.categories[data["category"]] for _, data in written}))
+        models_changed.send(Genre, ids=sorted({self.genres[genre] for _, data in written for genre in data["genres"]}))
+        models_changed.send(Book, ids=book_ids)
+
+
+def import_books(stream, fmt: str, chunk_size: int = CHUNK_SIZE) -> ImportReport:
+    """Import books from a text stream. Call inside app context."""
+
+    return BookImporter(chunk_size).run(read_rows(stream, fmt))
+
+
+def text_stream(binary_stream):
+    return io.TextIOWrapper(binary_stream, encoding="utf-8", newline="")
@@ -0,0 +1,262 @@
+"""
+Top-N leaderboards of books: most downloaded and best rated, overall or within a
+category or genre.
+
+Each leaderboard keeps the best `size` books of its scope in memory, sorted, and is
+refreshed incrementally from model signals and counter flushes, so reading the top K
+costs O(K) and never scans the book table. Within one process, the kept entries are
+the top of the scope; when books leave the board (their score dropped below the last
+kept one, they were deleted or moved to another category) and fewer than `size` are
+left while the scope has more books, the board is refilled with one ORDER BY ... LIMIT
+query. Boards are built by the first request for their scope: all books, a category, a
+genre or books of a genre in a category.
+
+Signals and counter flushes of other workers are not seen here: boards are dropped and
+refilled when the fingerprint of the book table moves, see `resync.py`, so they lag
+behind other workers by up to INDEX_RESYNC_INTERVAL seconds.
+
+Ratings are ranked by their Bayesian average, which pulls books with few rates
+towards the mean rating of the catalogue:
+
+    score = (prior_weight * mean + rating * rates) / (prior_weight + rates)
+
+The mean is taken when the boards are first filled, and again after every rebuild.
+"""
+
+import bisect
+import contextlib
+import os
+import threading
+
+from flask import has_app_context
+from sqlalchemy import func, select
+
+from backend.src.database.models import Book, book_genre, db
+from backend.src.database.resync import Resync
+from backend.src.database.signals import model_deleted, model_saved, models_changed
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))  # books kept per leaderboard, largest K served
+RATING_PRIOR_WEIGHT = float(os.getenv("RATING_PRIOR_WEIGHT", "10"))  # rates the catalogue mean counts as
+
+RANKINGS = ("downloads", "rating")
+
+
+class Leaderboard:
+    """Best books of one scope for one ranking, entries are (-score, book id) ascending."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = []
+        self.keys = {}  # book id -> entry
+        self.complete = True  # every book of the scope is on the board
+        self.stale = True  # needs a refill before it can be read
+
+    def fill(self, rows: list) -> None:
+        """Replace entries with (book id, score) rows of the scope's best books."""
+
+        self.entries = sorted((-score, book_id) for book_id, score in rows)
+        self.keys = {entry[1]: entry for entry in self.entries}
+        self.complete = len(rows) < self.size
+        self.stale = False
+
+    def update(self, book_id: int, score: float) -> None:
+        entry = (-score, book_id)
+        self._discard(book_id)
+
+        # books off the board score at most as high as its last entry
+        if self.complete or (self.entries and entry < self.entries[-1]):
+            bisect.insort(self.entries, entry)
+            self.keys[book_id] = entry
+
+            while len(self.entries) > self.size:
+                del self.keys[self.entries.pop()[1]]
+                self.complete = False
+
+        self._check()
+
+    def remove(self, book_id: int) -> None:
+        self._discard(book_id)
+        self._check()
+
+    def top(self, k: int) -> list:
+        return [(book_id, -score) for score, book_id in self.entries[:k]]
+
+    def _discard(self, book_id: int) -> None:
+        entry = self.keys.pop(book_id, None)
+        if entry is not None:
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+    def _check(self) -> None:
+        # the best of the books off the board is unknown
+        if not self.complete and len(self.entries) < self.size:
+            self.stale = True
+
+
+class Leaderboards:
+    def __init__(self, size: int = LEADERBOARD_SIZE, prior_weight: float = RATING_PRIOR_WEIGHT):
+        self.size = size
+        self.prior_weight = prior_weight
+        self.prior_mean = None
+        self.app = None
+
+        self._boards = {}  # (ranking, (category id, genre id)) -> Leaderboard, None ids match any
+        self._resync = Resync(self._fingerprint_select)
+        self._lock = threading.RLock()
+
+        model_saved.connect(self._on_saved, sender=Book, weak=False)
+        model_deleted.connect(self._on_deleted, sender=Book, weak=False)
+        models_changed.connect(self._on_changed, sender=Book, weak=False)
+
+    def init_app(self, app, size: int = None) -> None:
+        """Boards are built by the first request, nothing is read here."""
+
+        self.app = app
+        if size is not None:
+            self.size = size
+        self.rebuild()
+        app.extensions["leaderboards"] = self
+
+    def top(self, ranking: str, k: int, category_id: int = None, genre_id: int = None) -> list:
+        """Up to `k` (book id, score) pairs, best first, of books in the category and genre if given."""
+
+        scope = (category_id, genre_id)
+
+        with self._lock:
+            if self._resync.stale():
+                self.rebuild()
+            if not self._boards:
+                self._resync.mark()
+
+            board = self._board(ranking, scope)
+            if board.stale:
+                board.fill(self._query_top(ranking, scope))
+
+            return board.top(k)
+
+    def rebuild(self) -> None:
+        """Drop all boards and take the mean rating anew. Boards are refilled on read."""
+
+        with self._lock:
+            self._boards = {}
+            self.prior_mean = None
+            self._resync.reset()
+
+    def score(self, ranking: str, downloads, rating, rates) -> float:
+        if ranking == "downloads":
+            return float(downloads or 0)
+
+        rates = rates or 0
+        return (self.prior_weight * self._mean() + (rating or 0.0) * rates) / (self.prior_weight + rates)
+
+    @staticmethod
+    def _fingerprint_select():
+        genre_links = select(func.count()).select_from(book_genre).scalar_subquery()
+
+        return select(
+            func.count(Book.id), func.max(Book.id), func.sum(Book.downloads), func.sum(Book.rates),
+            func.sum(Book.category_id), genre_links
+        )
+
+    def _board(self, ranking: str, scope) -> Leaderboard:
+        board = self._boards.get((ranking, scope))
+        if board is None:
+            board = self._boards[(ranking, scope)] = Leaderboard(self.size)
+
+        return board
+
+    def _mean(self) -> float:
+        if self.prior_mean is None:
+            rates = func.coalesce(Book.rates, 0)
+            total, count = db.session.execute(
+                select(func.sum(func.coalesce(Book.rating, 0.0) * rates), func.sum(rates))
+            ).one()
+            self.prior_mean = total / count if count else 0.0
+
+        return self.prior_mean
+
+    def _score_column(self, ranking: str):
+        if ranking == "downloads":
+            return func.coalesce(Book.downloads, 0)
+
+        rates = func.coalesce(Book.rates, 0)
+        return (self.prior_weight * self._mean() + func.coalesce(Book.rating, 0.0) * rates) / (self.prior_weight + rates)
+
+    def _query_top(self, ranking: str, scope) -> list:
+        score = self._score_column(ranking)
+        query = select(Book.id, score).order_by(score.desc(), Book.id).limit(self.size)
+
+        category_id, genre_id = scope
+        if category_id is not None:
+            query = query.where(Book.category_id == category_id)
+        if genre_id is not None:
+            query = query.join(book_genre, book_genre.c.book_id == Book.id).where(book_genre.c.genre_id == genre_id)
+
+        return [(book_id, float(value)) for book_id, value in db.session.execute(query)]
+
+    @staticmethod
+    def _scopes(category_id: int, genre_ids) -> set:
+        return {(category, genre) for category in (None, category_id) for genre in (None, *genre_ids)}
+
+    def _apply(self, rows: list, genres: dict) -> None:
+        """Move books of (id, category id, downloads, rating, rates) rows on every board."""
+
+        for book_id, category_id, downloads, rating, rates in rows:
+            scopes = self._scopes(category_id, genres.get(book_id, ()))
+
+            for (ranking, scope), board in self._boards.items():
+                if board.stale:
+                    continue
+                if scope in scopes:
+                    board.update(book_id, self.score(ranking, downloads, rating, rates))
+                else:
+                    board.remove(book_id)
+
+    def _genres_of(self, book_ids: list) -> dict:
+        genres = {}
+        if all(genre_id is None for _, (_, genre_id) in self._boards):
+            return genres
+
+        rows = db.session.execute(
+            select(book_genre.c.book_id, book_genre.c.genre_id).where(book_genre.c.book_id.in_(book_ids))
+        )
+        for book_id, genre_id in rows:
+            genres.setdefault(book_id, []).append(genre_id)
+
+        return genres
+
+    def _refresh(self, book_ids: list, rows: list = None) -> None:
+        """Apply current values of given books, read from the database unless `rows` are given."""
+
+        if not self._boards or not book_ids:
+            return
+
+        if has_app_context() or self.app is None:
+            context = contextlib.nullcontext()
+        else:
+            context = self.app.app_context()  # counter flushes run outside of requests
+
+        with context, self._lock:
+            if rows is None:
+                rows = db.session.execute(
+                    select(Book.id, Book.category_id, Book.downloads, Book.rating, Book.rates)
+                    .where(Book.id.in_(book_ids))
+                ).all()
+            self._apply(rows, self._genres_of(book_ids))
+
+    def _on_saved(self, sender, instance):
+        if not self._boards:
+            return
+
+        row = (instance.id, instance.category_id, instance.downloads, instance.rating, instance.rates)
+        self._refresh([instance.id], [row])
+
+    def _on_deleted(self, sender, instance, id):
+        with self._lock:
+            for board in self._boards.values():
+                board.remove(id)
+
+    def _on_changed(self, sender, ids):
+        self._refresh(list(ids))
+
+
+leaderboards = Leaderboards()
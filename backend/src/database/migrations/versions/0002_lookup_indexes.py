@@ -0,0 +1,54 @@
+"""Indexes on lookup columns: names, book foreign keys, reverse genre lookups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('author', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_author_name'), ['name'], unique=False)
+
+    with op.batch_alter_table('category', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_category_name'), ['name'], unique=False)
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_book_name'), ['name'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_author_id'), ['author_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_category_id'), ['category_id'], unique=False)
+
+    with op.batch_alter_table('author_genre', schema=None) as batch_op:
+        batch_op.create_index('ix_author_genre_genre_id', ['genre_id'], unique=False)
+
+    with op.batch_alter_table('book_genre', schema=None) as batch_op:
+        batch_op.create_index('ix_book_genre_genre_id', ['genre_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('book_genre', schema=None) as batch_op:
+        batch_op.drop_index('ix_book_genre_genre_id')
+
+    with op.batch_alter_table('author_genre', schema=None) as batch_op:
+        batch_op.drop_index('ix_author_genre_genre_id')
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_book_category_id'))
+        batch_op.drop_index(batch_op.f('ix_book_author_id'))
+        batch_op.drop_index(batch_op.f('ix_book_name'))
+
+    with op.batch_alter_table('category', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_category_name'))
+
+    with op.batch_alter_table('author', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_author_name'))
@@ -0,0 +1,30 @@
+"""Indexes on filtered book columns: year of publishing, number of pages, rating
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_book_year_of_publishing'), ['year_of_publishing'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_num_of_pages'), ['num_of_pages'], unique=False)
+        batch_op.create_index(batch_op.f('ix_book_rating'), ['rating'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_book_rating'))
+        batch_op.drop_index(batch_op.f('ix_book_num_of_pages'))
+        batch_op.drop_index(batch_op.f('ix_book_year_of_publishing'))
@@ -0,0 +1,46 @@
+"""Book file columns and full-text search indexes, added after the initial schema
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('file_sha256', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('file_size', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_book_file_sha256'), ['file_sha256'], unique=False)
+
+    # full-text search, see backend/src/search/engines.py
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_book_search ON book USING gin (("
+            "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), 'C')))"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_author_search ON author USING gin ("
+            "setweight(to_tsvector('simple', name), 'B'))"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_author_search")
+        op.execute("DROP INDEX IF EXISTS ix_book_search")
+
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_book_file_sha256'))
+        batch_op.drop_column('file_size')
+        batch_op.drop_column('file_sha256')
@@ -4,29 +4,87 @@ Data Models for e-Library API
 
 import os
 
+from flask_migrate import Migrate, stamp, upgrade
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, func, insert, inspect, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from backend.src.database.pool import InstrumentedQueuePool
+from backend.src.database.replicas import RoutingSession, replica_router
+from backend.src.database.signals import model_deleted, model_saved
 
 DB_HOST = os.getenv("DB_HOST", "127.0.0.1:5432")
 DB_USER = os.getenv("DB_USER", "mildof")
 DB_PASSWORD = os.getenv("DB_PASSWORD", " ")
 DB_NAME = os.getenv("DB_NAME", "test_lib")
-DB_PATH = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+DB_PATH = os.getenv("DATABASE_URL", f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
+
+# Connection pool, per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))  # connections kept open
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # extra connections opened under load, closed when returned
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds after which a connection is reopened
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Read replicas, comma separated database URLs
+DB_REPLICAS = [url.strip() for url in os.getenv("DB_REPLICAS", "").split(",") if url.strip()]
+DB_REPLICA_STRATEGY = os.getenv("DB_REPLICA_STRATEGY", "round_robin")  # or least_connections
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "10"))  # seconds between health checks
+DB_REPLICA_PRIMARY_WINDOW = float(os.getenv("DB_REPLICA_PRIMARY_WINDOW", "5"))  # seconds reads stay on the primary after a write
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+BASELINE_REVISION = "0001"  # schema of databases created by `db_drop_and_create_all` before migrations
+
 
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+migrate = Migrate(directory=MIGRATIONS_DIR)
 
-db = SQLAlchemy()
 
+def engine_options(database_path: str) -> dict:
+    """Pool settings for the engine. SQLite keeps SQLAlchemy's defaults (no server connections to pool)."""
 
-def setup_db(app, database_path=DB_PATH):
+    if database_path.startswith("sqlite"):
+        return {}
+
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def setup_db(app, database_path=DB_PATH, replicas=None):
     """
-    Gets Flask Application instance and database path. Initialize Database and bind application with SQLAlchemy service
+    Gets Flask Application instance, database path and optional list of read replica URLs
+    (DB_REPLICAS by default). Initialize Database and bind application with SQLAlchemy service.
+    Reads of GET requests are routed to the replicas, see `replicas.py`.
+
+    Session lifecycle: one session per request (app context). Model methods only commit;
+    the session is rolled back if needed, closed and its connection returned to the pool
+    when the app context is torn down, so views and models never close it themselves.
     """
 
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
-    app.config["SQLALCHEMY_TRACK_MODIFICATION"] = False
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(database_path))
+
+    if replicas is None:
+        replicas = DB_REPLICAS
+    replica_binds = {f"replica_{i}": {"url": url, **engine_options(url)} for i, url in enumerate(replicas)}
+    app.config.setdefault("SQLALCHEMY_BINDS", {}).update(replica_binds)
 
     with app.app_context():
         db.app = app
         db.init_app(app)
+        migrate.init_app(app, db)
+        replica_router.init_app(
+            app, db, list(replica_binds),
+            strategy=DB_REPLICA_STRATEGY, health_interval=DB_REPLICA_HEALTH_INTERVAL,
+            primary_window=DB_REPLICA_PRIMARY_WINDOW
+        )
 
 
 def db_drop_and_create_all() -> None:
@@ -35,15 +93,29 @@ def db_drop_and_create_all() -> None:
     Can be used to test application and initialize fresh app.
     """
 
-    db.drop_all()
-    db.create_all()
+    db.drop_all(bind_key=None)  # primary only, replicas get the schema through replication
+    db.create_all(bind_key=None)
+
+
+def upgrade_db() -> None:
+    """
+    Bring the schema of the primary database to the latest migration (`flask db upgrade`).
+    Databases created by `db_drop_and_create_all` have no migration history, they are
+    stamped at the baseline revision first. Call inside app context.
+    """
+
+    tables = inspect(db.engine).get_table_names()
+    if "book" in tables and "alembic_version" not in tables:
+        stamp(revision=BASELINE_REVISION)
+
+    upgrade()
 
 
 class Author(db.Model):
     __tablename__ = "author"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(255), nullable=False, index=True)
     age = db.Column(db.Integer, nullable=True)
 
     # Relationships:
@@ -53,11 +125,35 @@ class Author(db.Model):
     def __repr__(self):
         print(f"<Author '{self.name}', {self.age}>")
 
+    @classmethod
+    def short_options(cls) -> tuple:
+        """Loader options for `short()` representation. Reads only own columns."""
+
+        return ()
+
+    @classmethod
+    def long_options(cls) -> tuple:
+        """Loader options for `long()` representation. Books (with their author) and genres are loaded eagerly."""
+
+        return (
+            selectinload(cls.books).joinedload(Book.author),
+            selectinload(cls.genres)
+        )
+
+    @classmethod
+    def short_query(cls):
+        return cls.query.options(*cls.short_options())
+
+    @classmethod
+    def long_query(cls):
+        return cls.query.options(*cls.long_options())
+
     def insert(self) -> None:
         """Add Author instance to database."""
 
         db.session.add(self)
         db.session.commit()
+        model_saved.send(Author, instance=self)
 
     def short(self) -> dict:
         """Short representation of Author instance."""
@@ -80,60 +176,76 @@ class Author(db.Model):
 
     def update(self) -> None:
         """Update Author instance in database"""
-        try:
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+
+        db.session.commit()
+        model_saved.send(Author, instance=self)
 
     def delete(self) -> None:
         """Delete Author instance from database."""
-        try:
-            db.session.delete(self)
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+
+        author_id = self.id
+        db.session.delete(self)
+        db.session.commit()
+        model_deleted.send(Author, instance=self, id=author_id)
 
 
 class Category(db.Model):
     __tablename__ = "category"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     books = db.relationship("Book", backref="category", lazy=True)
 
-    def short(self) -> dict:
+    @classmethod
+    def num_of_books_select(cls):
+        """Statement selecting (category, number of books) pairs with one grouped COUNT."""
+
+        return (
+            select(cls, func.count(Book.id))
+            .outerjoin(Book, Book.category_id == cls.id)
+            .group_by(cls.id)
+            .order_by(cls.id)
+        )
+
+    @classmethod
+    def with_num_of_books(cls):
+        """(category, number of books) pairs, see `num_of_books_select`."""
+
+        return db.session.execute(cls.num_of_books_select()).all()
+
+    def count_books_select(self):
+        return select(func.count(Book.id)).where(Book.category_id == self.id)
+
+    def count_books(self) -> int:
+        return db.session.execute(self.count_books_select()).scalar()
+
+    def short(self, num_of_books: int = None) -> dict:
+        """Short representation. Pass `num_of_books` when it was already counted, see `with_num_of_books`."""
+
         return {
+            "id": self.id,
             "name": self.name,
-            "num_of_books": len(self.books)
+            "num_of_books": self.count_books() if num_of_books is None else num_of_books
         }
 
-    def long(self) -> dict:
+    def long(self, books: list, num_of_books: int = None) -> dict:
+        """Long representation with one page of category's books, rows of `Book.short_rows_query`."""
+
         return {
+            "id": self.id,
             "name": self.name,
-            "books": [book.short() for book in self.books],
-            "num_of_books": len(self.books)
+            "books": [Book.short_row(book) for book in books],
+            "num_of_books": self.count_books() if num_of_books is None else num_of_books
         }
 
     def insert(self):
-        try:
-            db.session.add(self)
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+        db.session.add(self)
+        db.session.commit()
+        model_saved.send(Category, instance=self)
 
     def update(self):
-        try:
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+        db.session.commit()
+        model_saved.send(Category, instance=self)
 
 
 class Book(db.Model):
@@ -142,18 +254,72 @@ class Book(db.Model):
     __tablename__ = "book"
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255), nullable=False)
+    name = db.Column(db.String(255), nullable=False, index=True)
     description = db.Column(db.Text(), nullable=True)
-    rating = db.Column(db.Float, default=0.0)  # Average rating of the book
+    rating = db.Column(db.Float, default=0.0, index=True)  # Average rating of the book
     rates = db.Column(db.Integer, default=0)  # How many people rated the book
     downloads = db.Column(db.Integer, default=0)  # How many times book was downloaded
-    num_of_pages = db.Column(db.Integer, default=0)
-    year_of_publishing = db.Column(db.Integer, default=1999)
+    num_of_pages = db.Column(db.Integer, default=0, index=True)
+    year_of_publishing = db.Column(db.Integer, default=1999, index=True)
+    file_sha256 = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the book file, its key in storage
+    file_size = db.Column(db.Integer, nullable=True)  # size of the uploaded book file in bytes
 
     # Relationships:
     genres = db.relationship("Genre", secondary="book_genre", backref="books")
-    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey("author.id"), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey("author.id"), nullable=False, index=True)
+
+    @classmethod
+    def short_options(cls) -> tuple:
+        """Loader options for `short()` representation. Author is joined into the same statement."""
+
+        return (joinedload(cls.author),)
+
+    @classmethod
+    def long_options(cls) -> tuple:
+        """Loader options for `long()` representation. Author and category are joined, genres are selected in one IN query."""
+
+        return (
+            joinedload(cls.author),
+            joinedload(cls.category),
+            selectinload(cls.genres)
+        )
+
+    @classmethod
+    def short_query(cls):
+        return cls.query.options(*cls.short_options())
+
+    @classmethod
+    def long_query(cls):
+        return cls.query.options(*cls.long_options())
+
+    @classmethod
+    def short_columns(cls) -> tuple:
+        """Columns of `short()` representation, labelled by its keys. Author name needs a join, see `short_rows_select`."""
+
+        return (
+            cls.id,
+            Author.name.label("author"),
+            cls.name.label("title"),
+            cls.rating,
+            cls.downloads
+        )
+
+    @classmethod
+    def short_rows_select(cls):
+        """Statement selecting `short_columns()` tuples. No Book instances are built for them."""
+
+        return select(*cls.short_columns()).join(Author, Author.id == cls.author_id)
+
+    @classmethod
+    def short_rows_query(cls):
+        return db.session.query(*cls.short_columns()).join(Author, Author.id == cls.author_id)
+
+    @staticmethod
+    def short_row(row) -> dict:
+        """`short()` representation of a row of `short_columns()`."""
+
+        return row._asdict()
 
     def short(self) -> dict:
         return {
@@ -168,7 +334,7 @@ class Book(db.Model):
         return {
             "id": self.id,
             "title": self.name,
-            "num_of_pages": self.num_pages,
+            "num_of_pages": self.num_of_pages,
             "year_of_publishing": self.year_of_publishing,
             "author": self.author.name,
             "category": self.category.name,
@@ -179,16 +345,32 @@ class Book(db.Model):
             "downloads": self.downloads,
         }
 
+    @classmethod
+    def file_references(cls) -> dict:
+        """Reference count of every stored book file: SHA-256 -> number of books using it."""
+
+        rows = (
+            db.session.query(cls.file_sha256, func.count(cls.id))
+            .filter(cls.file_sha256.isnot(None))
+            .group_by(cls.file_sha256)
+        )
+
+        return dict(rows.all())
+
     def insert(self) -> None:
         db.session.add(self)
         db.session.commit()
+        model_saved.send(Book, instance=self)
 
     def update(self) -> None:
         db.session.commit()
+        model_saved.send(Book, instance=self)
 
     def delete(self) -> None:
+        book_id = self.id
         db.session.delete(self)
         db.session.commit()
+        model_deleted.send(Book, instance=self, id=book_id)
 
 
 class Genre(db.Model):
@@ -200,32 +382,76 @@ class Genre(db.Model):
     def format(self) -> str:
         return self.name
 
+    @classmethod
+    def ids_by_name(cls, names, create: bool = False) -> tuple:
+        """
+        (name -> id, ids of created genres) of given genre names, read with one IN query.
+        Missing genres are inserted with one multi-row INSERT if `create` is set, otherwise
+        they are left out of the result. The caller commits, then sends `models_changed`
+        for the created ids.
+        """
+
+        names = set(names)
+        if not names:
+            return {}, []
+
+        ids = dict(db.session.execute(select(cls.name, cls.id).where(cls.name.in_(names))).all())
+
+        missing = names - ids.keys()
+        if not (create and missing):
+            return ids, []
+
+        created = dict(db.session.execute(
+            insert(cls).returning(cls.name, cls.id), [{"name": name} for name in sorted(missing)]
+        ).all())
+        ids.update(created)
+
+        return ids, sorted(created.values())
+
     def insert(self):
-        try:
-            db.session.add(self)
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+        db.session.add(self)
+        db.session.commit()
+        model_saved.send(Genre, instance=self)
 
     def update(self):
-        try:
-            db.session.commit()
-        except:
-            db.session.rollback()
-        finally:
-            db.session.close()
+        db.session.commit()
+        model_saved.send(Genre, instance=self)
 
 
 author_genre = db.Table(
     "author_genre",
     db.Column("author_id", db.Integer, db.ForeignKey("author.id"), primary_key=True),
-    db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True)
+    db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True),
+    db.Index("ix_author_genre_genre_id", "genre_id")  # authors of a genre, the primary key covers genres of an author
 )
 
 book_genre = db.Table(
     "book_genre",
     db.Column("book_id", db.Integer, db.ForeignKey("book.id"), primary_key=True),
-    db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True)
+    db.Column("genre_id", db.Integer, db.ForeignKey("genre.id"), primary_key=True),
+    db.Index("ix_book_genre_genre_id", "genre_id")  # books of a genre, the primary key covers genres of a book
 )
+
+
+def replace_associations(table, owner_column: str, owner_id: int, target_column: str, target_ids) -> tuple:
+    """
+    Make rows of the association `table` link `owner_id` to exactly `target_ids`, e.g. genres of
+    a book in `book_genre`. Costs one SELECT of the current links, one DELETE and one executemany
+    INSERT at most, whatever the number of links. Returns (added, removed) target ids.
+
+    Relationship collections loaded before are stale afterwards, expire them, e.g.
+    `db.session.expire(book, ["genres"])`.
+    """
+
+    owner, target = table.c[owner_column], table.c[target_column]
+
+    current = set(db.session.scalars(select(target).where(owner == owner_id)))
+    wanted = set(target_ids)
+    added, removed = wanted - current, current - wanted
+
+    if removed:
+        db.session.execute(delete(table).where(owner == owner_id, target.in_(removed)))
+    if added:
+        db.session.execute(insert(table), [{owner_column: owner_id, target_column: id} for id in sorted(added)])
+
+    return added, removed
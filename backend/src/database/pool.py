@@ -0,0 +1,118 @@
+"""
+Instrumented connection pool.
+
+`InstrumentedQueuePool` is a `QueuePool` which records how long requests wait for a
+connection and how many connections are in use, so pool exhaustion shows up in
+numbers before it shows up as timeouts. Every pool (primary, each replica) keeps its own
+`PoolMetrics`, which survive `engine.dispose()`.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0  # new DBAPI connections
+            self.invalidations = 0
+            self.timeouts = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def record_checkout(self) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def record_checkin(self) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.in_use = max(self.in_use - 1, 0)
+
+    def record_connect(self) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def format(self, pool=None) -> dict:
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), checked_in=pool.checkedin(), overflow=pool.overflow())
+
+        return data
+
+
+def pool_stats(pool) -> dict:
+    """Metrics of `pool`, zeros for pools which are not instrumented (SQLite keeps SQLAlchemy's)."""
+
+    metrics = pool.metrics if isinstance(pool, InstrumentedQueuePool) else PoolMetrics()
+    return metrics.format(pool)
+
+
+class InstrumentedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+        # `recreate()` hands over the listeners of the disposed pool, and its metrics
+        if "_dispatch" not in kwargs:
+            self._listen(self.metrics)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+
+        return pool
+
+    def _listen(self, metrics: PoolMetrics) -> None:
+        event.listen(self, "checkout", lambda *args: metrics.record_checkout())
+        event.listen(self, "checkin", lambda *args: metrics.record_checkin())
+        event.listen(self, "connect", lambda *args: metrics.record_connect())
+        event.listen(self, "invalidate", lambda *args: metrics.record_invalidation())
@@ -0,0 +1,233 @@
+"""
+Routing of read queries to read replicas.
+
+Replica URLs are configured as extra binds (`replica_0`, `replica_1`, ...). During a
+GET/HEAD request, `RoutingSession` sends reads to one replica picked for the whole
+request (round-robin or least in-flight requests). Everything else stays on the primary:
+- requests with other methods, CLI commands and background threads;
+- flushes and INSERT/UPDATE/DELETE statements;
+- every read after the first write of a request (read-after-write consistency);
+- every read for `primary_window` seconds after a model write of this process, so the
+  requests following a write, which fill the response cache under the bumped tag
+  generations, do not read from a replica that has not caught up yet.
+
+Replicas are `SELECT 1`-probed every `health_interval` seconds, failing replicas are
+ejected from the rotation until they pass again. With no healthy replica, reads fall
+back to the primary. App start does not connect to replicas: they are taken as healthy,
+the first read request probes them and a daemon thread takes over afterwards (requests
+probe again themselves only when the thread is not running and a probe is due).
+"""
+
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql.dml import UpdateBase
+
+from backend.src.database.signals import model_deleted, model_saved
+
+READ_METHODS = ("GET", "HEAD")
+STRATEGIES = ("round_robin", "least_connections")
+
+
+class ReplicaRouter:
+    def __init__(self, strategy: str = "round_robin", health_interval: float = 10, primary_window: float = 5):
+        self.strategy = self._validate_strategy(strategy)
+        self.health_interval = health_interval
+        self.primary_window = primary_window
+
+        self.engines = {}  # bind key -> engine
+        self.healthy = set()
+        self.in_flight = {}  # bind key -> requests currently reading from the replica
+        self.stats = {}
+
+        self._cycle = itertools.count()
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._checked_at = None  # monotonic time of the last probe
+        self._written_at = None  # monotonic time of the last model write
+        self._stop = threading.Event()
+        self._thread = None
+
+        # download counter flushes (`models_changed`) do not count: they would keep reads on the primary
+        model_saved.connect(self._on_write, weak=False)
+        model_deleted.connect(self._on_write, weak=False)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def init_app(self, app, db, bind_keys: list, strategy: str = None, health_interval: float = None,
+                 primary_window: float = None, background: bool = True) -> None:
+        """Route reads of `app` to engines of given binds. Call inside app context."""
+
+        if strategy is not None:
+            self.strategy = self._validate_strategy(strategy)
+        if health_interval is not None:
+            self.health_interval = health_interval
+        if primary_window is not None:
+            self.primary_window = primary_window
+
+        self.engines = {key: db.engines[key] for key in bind_keys}
+        self.in_flight = {key: 0 for key in bind_keys}
+        self.healthy = set(bind_keys)  # until probed, see `_check_if_due`
+        self.stats = {"replica_reads": 0, "primary_reads": 0, "ejections": 0}
+        self._checked_at = None
+        self._written_at = None
+        app.extensions["replica_router"] = self
+
+        if not bind_keys:
+            return
+
+        app.teardown_request(self._release)
+
+        if background and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self._thread.start()
+
+    def engine_for(self, session, clause):
+        """Replica engine to run `clause` on, or None for the primary."""
+
+        if not self.enabled or not has_request_context() or request.method not in READ_METHODS:
+            return None
+
+        # pending changes are autoflushed before a query, so the flush marks the request too
+        if session._flushing or isinstance(clause, UpdateBase):
+            g.db_use_primary = True
+
+        if g.get("db_use_primary") or self._recently_written():
+            self.stats["primary_reads"] += 1
+            return None
+
+        key = g.get("db_replica")
+        if key is None:
+            key = self._choose()
+            if key is None:
+                self.stats["primary_reads"] += 1
+                return None
+            g.db_replica = key
+
+        self.stats["replica_reads"] += 1
+        return self.engines[key]
+
+    def acquire(self):
+        """
+        Bind key of the replica a read-only request outside of Flask (asgi.py) should use,
+        or None for the primary. Give it back with `release()`.
+        """
+
+        key = None if self._recently_written() else self._choose()
+        self.stats["replica_reads" if key is not None else "primary_reads"] += 1
+
+        return key
+
+    def release(self, key) -> None:
+        if key is not None:
+            with self._lock:
+                self.in_flight[key] -= 1
+
+    def check_health(self) -> None:
+        with self._probe_lock:
+            self._probe()
+
+    def _probe(self) -> None:
+        self._checked_at = time.monotonic()
+
+        for key, engine in self.engines.items():
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except Exception as e:
+                with self._lock:
+                    if key in self.healthy:
+                        print(f"read replica {key} ejected: {e}")
+                        self.healthy.discard(key)
+                        self.stats["ejections"] += 1
+            else:
+                with self._lock:
+                    self.healthy.add(key)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def format(self) -> dict:
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "replicas": {
+                    key: {"healthy": key in self.healthy, "in_flight": self.in_flight[key]}
+                    for key in self.engines
+                },
+                **self.stats
+            }
+
+    @staticmethod
+    def _validate_strategy(strategy: str) -> str:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown strategy {strategy!r}, expected one of {STRATEGIES}")
+
+        return strategy
+
+    def _check_if_due(self) -> None:
+        if self._checked_at is not None and (
+            self._thread is not None or time.monotonic() - self._checked_at < self.health_interval
+        ):
+            return
+
+        # one request probes, concurrent ones keep the current rotation instead of waiting
+        if self._probe_lock.acquire(blocking=False):
+            try:
+                self._probe()
+            finally:
+                self._probe_lock.release()
+
+    def _recently_written(self) -> bool:
+        return self._written_at is not None and time.monotonic() - self._written_at < self.primary_window
+
+    def _on_write(self, sender, **kwargs) -> None:
+        self._written_at = time.monotonic()
+
+    def _choose(self):
+        self._check_if_due()
+
+        with self._lock:
+            candidates = sorted(self.healthy)
+            if not candidates:
+                return None
+
+            if self.strategy == "least_connections":
+                key = min(candidates, key=lambda candidate: self.in_flight[candidate])
+            else:
+                key = candidates[next(self._cycle) % len(candidates)]
+
+            self.in_flight[key] += 1
+            return key
+
+    def _release(self, exc=None) -> None:
+        self.release(g.pop("db_replica", None))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session which lets `replica_router` pick the engine of reads."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = replica_router.engine_for(self, clause)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
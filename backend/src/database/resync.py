@@ -0,0 +1,58 @@
+"""
+Resynchronisation of in-process structures with writes of other worker processes.
+
+Leaderboards, similar books and suggestions are built from the catalogue and kept in
+sync from model signals, which only fire in the process that wrote. With several workers
+(gunicorn, uvicorn --workers) every structure also holds a `Resync`: on a read, at most
+every `interval` seconds, it reads a fingerprint of the tables the structure is built
+from (counts, max ids, sums of a few columns: one aggregate query) and asks for a
+rebuild when it moved since the build. Local writes move it too, so they cost at most
+one rebuild per interval. Writes no aggregate notices, e.g. a rename in another worker,
+are picked up by the rebuild every `max_age` seconds.
+"""
+
+import os
+import time
+
+from backend.src.database.models import db
+
+INDEX_RESYNC_INTERVAL = float(os.getenv("INDEX_RESYNC_INTERVAL", "30"))  # seconds between fingerprint reads
+INDEX_MAX_AGE = float(os.getenv("INDEX_MAX_AGE", "600"))  # seconds after which a structure is rebuilt anyway
+
+
+class Resync:
+    def __init__(self, fingerprint_select, interval: float = INDEX_RESYNC_INTERVAL, max_age: float = INDEX_MAX_AGE):
+        """`fingerprint_select` returns the select statement of one row of aggregates."""
+
+        self.fingerprint_select = fingerprint_select
+        self.interval = interval
+        self.max_age = max_age
+        self.reset()
+
+    def reset(self) -> None:
+        self.fingerprint = None
+        self.built_at = self.checked_at = None
+
+    def mark(self) -> None:
+        """Record the state a structure is built from. Call inside app context, right before the build."""
+
+        self.fingerprint = self._read()
+        self.built_at = self.checked_at = time.monotonic()
+
+    def stale(self) -> bool:
+        """Whether the structure built after the last `mark()` must be rebuilt. False before any build."""
+
+        if self.built_at is None:
+            return False
+
+        now = time.monotonic()
+        if now - self.built_at >= self.max_age:
+            return True
+        if now - self.checked_at < self.interval:
+            return False
+
+        self.checked_at = now
+        return self._read() != self.fingerprint
+
+    def _read(self) -> tuple:
+        return tuple(db.session.execute(self.fingerprint_select()).one())
@@ -1,4 +1,8 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 
 class BookSchema(Schema):
@@ -7,7 +11,7 @@ class BookSchema(Schema):
     author = fields.Str(required=True)
     category = fields.Str(required=True)
     description = fields.Str(required=True)
-    num_of_pages = fields.Int(required=True)
+    num_of_pages = fields.Int(required=True, validate=validate.Range(min=0))
     year_of_publishing = fields.Int(required=True)
     genres = fields.List(fields.Str(), required=True)
 
@@ -17,6 +21,73 @@ class BookSchema(Schema):
     downloads = fields.Int()
 
 
+class ImportArgsSchema(Schema):
+    """Query string of POST /book/import."""
+
+    format = fields.Str(
+        load_default=None,
+        validate=validate.OneOf(["ndjson", "csv"]),
+        metadata={"description": "Format of the body. Taken from Content-Type (text/csv) by default."},
+    )
+
+
+class GenreArgsSchema(Schema):
+    """Query string of book and author mutations."""
+
+    create_genres = fields.Bool(
+        load_default=False,
+        metadata={"description": "Create genres missing from the catalogue instead of answering 404."},
+    )
+
+
+class TopArgsSchema(Schema):
+    """Query string of GET /book/top."""
+
+    by = fields.Str(
+        load_default="downloads",
+        validate=validate.OneOf(["downloads", "rating"]),
+        metadata={"description": "Rank by downloads or by Bayesian average rating."},
+    )
+    category = fields.Str(load_default=None, metadata={"description": "Only books of the category with this name."})
+    genre = fields.Str(load_default=None, metadata={"description": "Only books of the genre with this name."})
+    limit = fields.Int(
+        load_default=10,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        metadata={"description": f"Number of books (1-{MAX_PAGE_SIZE})."},
+    )
+
+
+class SuggestArgsSchema(Schema):
+    """Query string of GET /suggest."""
+
+    q = fields.Str(required=True, validate=validate.Length(min=1), metadata={"description": "Beginning of a title, author or genre name, or of any of its words."})
+    limit = fields.Int(
+        load_default=10,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        metadata={"description": f"Max number of suggestions (1-{MAX_PAGE_SIZE})."},
+    )
+
+
+class SimilarArgsSchema(Schema):
+    """Query string of GET /books/<id>/similar."""
+
+    limit = fields.Int(
+        load_default=10,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        metadata={"description": f"Number of books (1-{MAX_PAGE_SIZE})."},
+    )
+
+
+class ExportArgsSchema(Schema):
+    """Query string of GET /export."""
+
+    gzip = fields.Bool(load_default=False, metadata={"description": "Send the export as books.ndjson.gz."})
+
+
+class RatingSchema(Schema):
+    rating = fields.Float(required=True, validate=validate.Range(min=1, max=5))
+
+
 class AuthorSchema(Schema):
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
@@ -36,4 +107,48 @@ class GenreSchema(Schema):
     name = fields.Str(required=True)
 
 
+class PageArgsSchema(Schema):
+    """Query string of paginated list endpoints."""
+
+    limit = fields.Int(
+        load_default=DEFAULT_PAGE_SIZE,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        metadata={"description": f"Number of items per page (1-{MAX_PAGE_SIZE})."},
+    )
+    after = fields.Str(
+        load_default=None,
+        metadata={"description": "Opaque cursor from `next_cursor` of the previous page."},
+    )
+
+
+class BookListArgsSchema(PageArgsSchema):
+    """Query string of GET /book: a page of books matching every given filter."""
+
+    genre = fields.List(fields.Str(), load_default=None, metadata={"description": "Genre names, repeat for several."})
+    genre_match = fields.Str(
+        load_default="any",
+        validate=validate.OneOf(["any", "all"]),
+        metadata={"description": "Books having any or all of the genres."},
+    )
+    category = fields.Str(load_default=None, metadata={"description": "Name of the category."})
+    author = fields.Str(load_default=None, metadata={"description": "Name of the author."})
+    year_of_publishing_min = fields.Int(load_default=None)
+    year_of_publishing_max = fields.Int(load_default=None)
+    num_of_pages_min = fields.Int(load_default=None, validate=validate.Range(min=0))
+    num_of_pages_max = fields.Int(load_default=None, validate=validate.Range(min=0))
+    rating_min = fields.Float(load_default=None, validate=validate.Range(min=0, max=5))
+    facets = fields.Bool(
+        load_default=False,
+        metadata={"description": "Include the total and counts of books per value of each filter, best asked with the first page."},
+    )
+
+
+class SearchArgsSchema(Schema):
+    """Query string of GET /search."""
 
+    q = fields.Str(required=True, validate=validate.Length(min=1), metadata={"description": "Search terms, each matched as a prefix."})
+    limit = fields.Int(
+        load_default=DEFAULT_PAGE_SIZE,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+        metadata={"description": f"Max number of results (1-{MAX_PAGE_SIZE})."},
+    )
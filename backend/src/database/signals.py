@@ -0,0 +1,19 @@
+"""
+Signals sent by model write methods (`insert`, `update`, `delete`) after commit,
+and by bulk writers which update rows without loading them (`models_changed`).
+
+Derived in-process structures, e.g. the search index, subscribe to them to stay
+in sync with the database. Sender is the model class, e.g.:
+
+    @model_saved.connect_via(Book)
+    def on_book_saved(sender, instance):
+        ...
+"""
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+model_saved = _signals.signal("model-saved")  # kwargs: instance
+model_deleted = _signals.signal("model-deleted")  # kwargs: instance, id
+models_changed = _signals.signal("models-changed")  # kwargs: ids; bulk writes bypassing model methods
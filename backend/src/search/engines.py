@@ -0,0 +1,297 @@
+"""
+Full-text search over book titles, descriptions and author names.
+
+`FullTextSearch` is bound to the app like `db` and picks an engine by database dialect:
+- `PostgresSearchEngine` ranks rows with `tsvector`/`tsquery`, backed by GIN indexes;
+- `MemorySearchEngine` is a pure-Python inverted index, used on SQLite (tests, local runs).
+
+Both treat every query term as a prefix and return only books matching all terms.
+"""
+
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict
+
+from sqlalchemy import DDL, and_, event, func, literal_column, or_
+
+from backend.src.database.models import Author, Book, db
+from backend.src.database.signals import model_deleted, model_saved, models_changed
+
+TOKEN_RE = re.compile(r"\w+")
+
+# relevance of a term depending on the field it was found in
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "author": 2.0,
+    "description": 1.0,
+}
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+class SearchEngine:
+    """Interface of search engines."""
+
+    def add(self, book) -> None:
+        """(Re)index a book."""
+        raise NotImplementedError
+
+    def remove(self, book_id: int) -> None:
+        """Drop a book from the index."""
+        raise NotImplementedError
+
+    def missing(self, book_ids: list) -> list:
+        """Ids of `book_ids` which are not indexed."""
+        raise NotImplementedError
+
+    def rebuild(self, books) -> None:
+        """Index books from scratch."""
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int) -> list:
+        """Return up to `limit` (book id, score) pairs, best first."""
+        raise NotImplementedError
+
+
+class MemorySearchEngine(SearchEngine):
+    def __init__(self):
+        self._postings = defaultdict(dict)  # term -> {book id: weight}
+        self._documents = {}  # book id -> set of terms
+        self._vocabulary = []  # sorted terms, for prefix lookups
+        self._lock = threading.RLock()
+
+    def add(self, book) -> None:
+        weights = defaultdict(float)
+        fields = {
+            "name": book.name,
+            "author": book.author.name if book.author else "",
+            "description": book.description,
+        }
+        for field, text in fields.items():
+            for term in tokenize(text):
+                weights[term] += FIELD_WEIGHTS[field]
+
+        with self._lock:
+            self._remove(book.id)
+            for term, weight in weights.items():
+                if term not in self._postings:
+                    bisect.insort(self._vocabulary, term)
+                self._postings[term][book.id] = weight
+            self._documents[book.id] = set(weights)
+
+    def remove(self, book_id: int) -> None:
+        with self._lock:
+            self._remove(book_id)
+
+    def missing(self, book_ids: list) -> list:
+        with self._lock:
+            return [book_id for book_id in book_ids if book_id not in self._documents]
+
+    def rebuild(self, books) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._vocabulary.clear()
+            for book in books:
+                self.add(book)
+
+    def search(self, query: str, limit: int) -> list:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            total = len(self._documents) or 1
+            scores = None
+
+            for prefix in terms:
+                term_scores = defaultdict(float)
+                for term in self._expand(prefix):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for book_id, weight in postings.items():
+                        term_scores[book_id] += weight * idf
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        book_id: score + term_scores[book_id]
+                        for book_id, score in scores.items()
+                        if book_id in term_scores
+                    }
+
+                if not scores:
+                    return []
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def _expand(self, prefix: str) -> list:
+        """Terms of the vocabulary starting with `prefix`."""
+
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + "\U0010ffff")
+
+        return self._vocabulary[start:end]
+
+    def _remove(self, book_id: int) -> None:
+        for term in self._documents.pop(book_id, ()):
+            postings = self._postings[term]
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, term)]
+
+
+class PostgresSearchEngine(SearchEngine):
+    """Index lives in the database (GIN indexes below), so write hooks are no-ops."""
+
+    CONFIG = "simple"
+
+    @classmethod
+    def book_vector(cls):
+        return func.setweight(
+            func.to_tsvector(cls.CONFIG, func.coalesce(Book.name, "")), literal_column("'A'")
+        ).op("||")(
+            func.setweight(func.to_tsvector(cls.CONFIG, func.coalesce(Book.description, "")), literal_column("'C'"))
+        )
+
+    @classmethod
+    def author_vector(cls):
+        return func.setweight(func.to_tsvector(cls.CONFIG, Author.name), literal_column("'B'"))
+
+    def add(self, book) -> None:
+        pass
+
+    def remove(self, book_id: int) -> None:
+        pass
+
+    def missing(self, book_ids: list) -> list:
+        return []
+
+    def rebuild(self, books) -> None:
+        pass
+
+    def search(self, query: str, limit: int) -> list:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        book_vector = self.book_vector()
+        author_vector = self.author_vector()
+        rank = func.ts_rank(
+            book_vector.op("||")(author_vector),
+            func.to_tsquery(self.CONFIG, " & ".join(f"{term}:*" for term in terms))
+        )
+
+        # every term must be found in the book or in its author, one condition per term keeps GIN indexes usable
+        conditions = []
+        for term in terms:
+            term_query = func.to_tsquery(self.CONFIG, f"{term}:*")
+            conditions.append(or_(book_vector.op("@@")(term_query), author_vector.op("@@")(term_query)))
+
+        rows = (
+            db.session.query(Book.id, rank)
+            .join(Author, Author.id == Book.author_id)
+            .filter(and_(*conditions))
+            .order_by(rank.desc(), Book.id)
+            .limit(limit)
+        )
+
+        return [(book_id, score) for book_id, score in rows]
+
+
+# GIN indexes over the same expressions PostgresSearchEngine queries with
+event.listen(Book.__table__, "after_create", DDL(
+    "CREATE INDEX IF NOT EXISTS ix_book_search ON book USING gin (("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')))"
+).execute_if(dialect="postgresql"))
+event.listen(Author.__table__, "after_create", DDL(
+    "CREATE INDEX IF NOT EXISTS ix_author_search ON author USING gin ("
+    "setweight(to_tsvector('simple', name), 'B'))"
+).execute_if(dialect="postgresql"))
+
+
+class FullTextSearch:
+    """Binds a search engine to the app and keeps it in sync with model writes."""
+
+    def __init__(self):
+        self.engine = MemorySearchEngine()
+        self.built = True
+        self._build_lock = threading.Lock()
+
+        model_saved.connect(self._on_book_saved, sender=Book, weak=False)
+        model_deleted.connect(self._on_book_deleted, sender=Book, weak=False)
+        models_changed.connect(self._on_books_changed, sender=Book, weak=False)
+        model_saved.connect(self._on_author_saved, sender=Author, weak=False)
+
+    def init_app(self, app, engine: SearchEngine = None, lazy: bool = False) -> None:
+        """
+        Pick engine by database dialect and index existing books. Call inside app context.
+        With `lazy`, books are indexed by the first search instead, so app start does not
+        read the whole catalogue.
+        """
+
+        if engine is None:
+            if db.engine.dialect.name == "postgresql":
+                engine = PostgresSearchEngine()
+            else:
+                engine = MemorySearchEngine()
+
+        self.engine = engine
+        self.built = False
+        app.extensions["search"] = self
+
+        if not lazy:
+            self.build()
+
+    def build(self) -> None:
+        with self._build_lock:
+            if not self.built:
+                self.engine.rebuild(Book.short_query().yield_per(1000))
+                self.built = True
+
+    def search(self, query: str, limit: int) -> list:
+        if not self.built:
+            self.build()
+
+        return self.engine.search(query, limit)
+
+    def _ready(self) -> bool:
+        """Whether writes must go to the index. Before a build they are picked up by the build itself."""
+
+        if self.built:
+            return True
+
+        with self._build_lock:  # waits for a running build, which may have missed the write
+            return self.built
+
+    def _on_book_saved(self, sender, instance):
+        if self._ready():
+            self.engine.add(instance)
+
+    def _on_book_deleted(self, sender, instance, id):
+        if self._ready():
+            self.engine.remove(id)
+
+    def _on_books_changed(self, sender, ids):
+        # bulk inserts (imports) add books; other bulk writes (counter flushes) leave indexed fields alone
+        if self._ready():
+            new_ids = self.engine.missing(list(ids))
+            if new_ids:
+                for book in Book.short_query().filter(Book.id.in_(new_ids)):
+                    self.engine.add(book)
+
+    def _on_author_saved(self, sender, instance):
+        # author name is part of every book's document
+        if self._ready():
+            for book in instance.books:
+                self.engine.add(book)
+
+
+search = FullTextSearch()
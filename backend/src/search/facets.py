@@ -0,0 +1,199 @@
+"""
+Faceted filtering of books.
+
+`BookFilter` turns the filters of GET /book into SQL conditions on `book`:
+- genre: names, books having any (default) or all of them, via `book_genre`;
+- category, author: names;
+- year_of_publishing, num_of_pages: inclusive ranges;
+- rating: minimum average rating.
+
+Facet counts are computed in the database, one grouped aggregate query per dimension.
+As usual for facets, the counts of a dimension apply every filter except its own,
+so they tell how many books each alternative value would give:
+
+    SELECT genre.name, count(book_genre.book_id) FROM book_genre JOIN genre ...
+    WHERE book_genre.book_id IN (SELECT book.id FROM book WHERE <other filters>)
+    GROUP BY genre.name ORDER BY count DESC LIMIT :facet_limit
+"""
+
+from sqlalchemy import Integer, case, cast, func, select
+
+from backend.src.database.models import Author, Book, Category, Genre, book_genre, db
+
+FACET_LIMIT = 20  # values per facet, most frequent first
+
+PAGE_BUCKETS = ((0, 99), (100, 199), (200, 299), (300, 499), (500, 999), (1000, None))
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+DIMENSIONS = ("genre", "category", "author", "year_of_publishing", "num_of_pages", "rating")
+
+
+class BookFilter:
+    def __init__(self, args: dict):
+        """`args` as loaded by `BookListArgsSchema`, missing or None filters are not applied."""
+
+        self.args = args
+
+    @property
+    def active(self) -> bool:
+        return any(self._condition(dimension) is not None for dimension in DIMENSIONS)
+
+    def conditions(self, exclude: str = None) -> list:
+        """SQL conditions on `book` of all filters except the `exclude` dimension."""
+
+        conditions = (self._condition(dimension) for dimension in DIMENSIONS if dimension != exclude)
+        return [condition for condition in conditions if condition is not None]
+
+    def count_select(self):
+        return select(func.count(Book.id)).where(*self.conditions())
+
+    def facet_selects(self) -> dict:
+        """Dimension -> statement selecting (value, number of books) rows."""
+
+        return {dimension: getattr(self, f"_{dimension}_facet")(self._matching(dimension)) for dimension in DIMENSIONS}
+
+    @staticmethod
+    def format_facets(rows: dict) -> dict:
+        """Facets for the response from rows of `facet_selects()` statements."""
+
+        rows = dict(rows)
+        stars = dict(rows["rating"])
+        rows["rating"] = [
+            (f"{threshold}+", sum(count for star, count in stars.items() if star >= threshold))
+            for threshold in RATING_THRESHOLDS
+        ]
+        # pages outside of every bucket (negative counts of old rows) are left out
+        rows["num_of_pages"] = sorted(
+            (row for row in rows["num_of_pages"] if row[0] is not None), key=lambda row: _bucket_order(row[0])
+        )
+
+        facets = {
+            dimension: [{"value": value, "count": count} for value, count in dimension_rows if count]
+            for dimension, dimension_rows in rows.items()
+        }
+
+        return facets
+
+    def facets(self) -> dict:
+        return self.format_facets({
+            dimension: db.session.execute(statement).all() for dimension, statement in self.facet_selects().items()
+        })
+
+    def _condition(self, dimension: str):
+        args = self.args
+
+        if dimension == "genre" and args.get("genre"):
+            books = select(book_genre.c.book_id).join(Genre, Genre.id == book_genre.c.genre_id)
+            books = books.where(Genre.name.in_(args["genre"]))
+            if args.get("genre_match") == "all":
+                books = books.group_by(book_genre.c.book_id).having(
+                    func.count(book_genre.c.genre_id) == len(set(args["genre"]))
+                )
+            return Book.id.in_(books)
+
+        if dimension == "category" and args.get("category") is not None:
+            return Book.category_id.in_(select(Category.id).where(Category.name == args["category"]))
+
+        if dimension == "author" and args.get("author") is not None:
+            return Book.author_id.in_(select(Author.id).where(Author.name == args["author"]))
+
+        if dimension in ("year_of_publishing", "num_of_pages"):
+            return _range(getattr(Book, dimension), args.get(f"{dimension}_min"), args.get(f"{dimension}_max"))
+
+        if dimension == "rating" and args.get("rating_min") is not None:
+            return Book.rating >= args["rating_min"]
+
+        return None
+
+    def _matching(self, dimension: str):
+        """Ids of books matching every filter except the one of `dimension`."""
+
+        return select(Book.id).where(*self.conditions(exclude=dimension))
+
+    @staticmethod
+    def _genre_facet(books):
+        count = func.count(book_genre.c.book_id)
+        return (
+            select(Genre.name, count)
+            .join(book_genre, book_genre.c.genre_id == Genre.id)
+            .where(book_genre.c.book_id.in_(books))
+            .group_by(Genre.name)
+            .order_by(count.desc(), Genre.name)
+            .limit(FACET_LIMIT)
+        )
+
+    @staticmethod
+    def _category_facet(books):
+        count = func.count(Book.id)
+        return (
+            select(Category.name, count)
+            .join(Book, Book.category_id == Category.id)
+            .where(Book.id.in_(books))
+            .group_by(Category.name)
+            .order_by(count.desc(), Category.name)
+            .limit(FACET_LIMIT)
+        )
+
+    @staticmethod
+    def _author_facet(books):
+        count = func.count(Book.id)
+        return (
+            select(Author.name, count)
+            .join(Book, Book.author_id == Author.id)
+            .where(Book.id.in_(books))
+            .group_by(Author.name)
+            .order_by(count.desc(), Author.name)
+            .limit(FACET_LIMIT)
+        )
+
+    @staticmethod
+    def _year_of_publishing_facet(books):
+        count = func.count(Book.id)
+        return (
+            select(Book.year_of_publishing, count)
+            .where(Book.id.in_(books), Book.year_of_publishing.isnot(None))
+            .group_by(Book.year_of_publishing)
+            .order_by(count.desc(), Book.year_of_publishing.desc())
+            .limit(FACET_LIMIT)
+        )
+
+    @staticmethod
+    def _num_of_pages_facet(books):
+        bucket = case(
+            *((_range(Book.num_of_pages, low, high), _bucket_label(low, high)) for low, high in PAGE_BUCKETS)
+        )
+        count = func.count(Book.id)
+        return (
+            select(bucket, count)
+            .where(Book.id.in_(books), Book.num_of_pages.isnot(None))
+            .group_by(bucket)
+        )
+
+    @staticmethod
+    def _rating_facet(books):
+        # books per whole star, summed up into "at least N stars" by `format_facets`
+        stars = cast(func.floor(Book.rating), Integer)
+        return (
+            select(stars, func.count(Book.id))
+            .where(Book.id.in_(books), Book.rating.isnot(None))
+            .group_by(stars)
+        )
+
+
+def _range(column, low, high):
+    if low is not None and high is not None:
+        return column.between(low, high)
+    if low is not None:
+        return column >= low
+    if high is not None:
+        return column <= high
+
+    return None
+
+
+def _bucket_label(low: int, high: int) -> str:
+    return f"{low}+" if high is None else f"{low}-{high}"
+
+
+def _bucket_order(label: str) -> int:
+    return int(label.rstrip("+").split("-")[0])
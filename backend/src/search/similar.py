@@ -0,0 +1,257 @@
+"""
+Similar books, scored from the book/genre graph of `book_genre`, the author and the category:
+
+    relatedness = GENRE_WEIGHT * jaccard(genres) + AUTHOR_WEIGHT * same author + CATEGORY_WEIGHT * same category
+    popularity = 1 + POPULARITY_WEIGHT * (rating / 5 + min(log(1 + downloads) / log(1 + DOWNLOADS_CAP), 1)) / 2
+    score = relatedness * popularity
+
+The genre membership matrix is kept in memory in sparse form, its rows grouped by
+distinct genre set: books having exactly the same genres share their Jaccard similarity
+to any other book, and a catalogue has far fewer genre sets than books. Books of each
+genre set, of each category and genre set, and of each category are kept sorted by
+popularity, so the top K is found without scoring every related book:
+1. books of the author are scored;
+2. genre sets sharing a genre with the book, in the book's category and in any category,
+   are visited by the score of their most popular book, and their books in popularity
+   order, until no book left can beat the K-th best;
+3. books of the category likewise, bounded by CATEGORY_WEIGHT * popularity.
+Except for books of the author, the bound of each walk is the exact score of the books
+sharing genres or the category through it, so the result is exact.
+
+The matrix is built by the first request with two queries, then kept in sync from
+model signals and counter flushes, re-reading only the changed books. Books written by
+other workers show up when the matrix is rebuilt: after the fingerprint of the books
+and their genre links moved, see `resync.py`, or after INDEX_MAX_AGE seconds for
+downloads and ratings, which only slightly lift scores.
+"""
+
+import bisect
+import contextlib
+import heapq
+import math
+import threading
+
+from flask import has_app_context
+from sqlalchemy import func, select
+
+from backend.src.database.models import Book, book_genre, db
+from backend.src.database.resync import Resync
+from backend.src.database.signals import model_deleted, model_saved, models_changed
+
+GENRE_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.5
+CATEGORY_WEIGHT = 0.25
+POPULARITY_WEIGHT = 0.5  # how much rating and downloads lift equally related books
+DOWNLOADS_CAP = 1_000_000  # downloads from which popularity does not grow anymore
+
+
+def popularity(rating, downloads) -> float:
+    downloads_score = min(math.log1p(downloads or 0) / math.log1p(DOWNLOADS_CAP), 1.0)
+    return 1 + POPULARITY_WEIGHT * ((rating or 0.0) / 5 + downloads_score) / 2
+
+
+class SimilarBooks:
+    def __init__(self):
+        self.app = None
+        self.built = False
+
+        self._books = {}  # book id -> (author id, category id, genre ids, popularity)
+        self._by_genres = {}  # genre ids -> [(-popularity, book id)] ascending
+        self._by_category_genres = {}  # (category id, genre ids) -> [(-popularity, book id)] ascending
+        self._by_category = {}  # category id -> [(-popularity, book id)] ascending
+        self._by_author = {}  # author id -> book ids
+        self._genre_sets = {}  # genre id -> genre sets containing it
+        self._resync = Resync(self._fingerprint_select)
+        self._lock = threading.RLock()
+
+        model_saved.connect(self._on_saved, sender=Book, weak=False)
+        model_deleted.connect(self._on_deleted, sender=Book, weak=False)
+        models_changed.connect(self._on_changed, sender=Book, weak=False)
+
+    def init_app(self, app) -> None:
+        """The matrix is built by the first request, nothing is read here."""
+
+        self.app = app
+        self.rebuild()
+        app.extensions["similar_books"] = self
+
+    def similar(self, book_id: int, k: int):
+        """Up to `k` (book id, score) pairs most similar to the book, best first. None for unknown books."""
+
+        with self._lock:
+            if self._resync.stale():
+                self.rebuild()
+            if not self.built:
+                self._build()
+
+            book = self._books.get(book_id)
+            if book is None:
+                return None
+
+            author_id, category_id, genres, _ = book
+            top = []  # min-heap of the best (score, -book id)
+            seen = {book_id}
+
+            def push(other: int) -> None:
+                if other in seen:
+                    return
+                seen.add(other)
+
+                entry = (self._score(book, self._books[other]), -other)
+                if len(top) < k:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+
+            def beaten(bound: float) -> bool:
+                return len(top) == k and bound < top[0][0]
+
+            for other in self._by_author.get(author_id, ()):
+                push(other)
+
+            # (relatedness, books): books of the genre set in the category score relatedness * popularity
+            visits = []
+            for other_genres in set().union(*(self._genre_sets.get(genre_id, ()) for genre_id in genres)):
+                relatedness = GENRE_WEIGHT * len(genres & other_genres) / len(genres | other_genres)
+                visits.append((relatedness, self._by_genres[other_genres]))
+
+                same_category = self._by_category_genres.get((category_id, other_genres))
+                if same_category:
+                    visits.append((relatedness + CATEGORY_WEIGHT, same_category))
+            visits.append((CATEGORY_WEIGHT, self._by_category.get(category_id, [])))
+
+            visits.sort(key=lambda visit: visit[0] * -visit[1][0][0] if visit[1] else 0.0, reverse=True)
+            for relatedness, entries in visits:
+                for negative_popularity, other in entries:
+                    if beaten(relatedness * -negative_popularity):
+                        break
+                    push(other)
+
+            return [(-negative_id, score) for score, negative_id in sorted(top, reverse=True)]
+
+    def rebuild(self) -> None:
+        """Drop the matrix, it is built again by the next request."""
+
+        with self._lock:
+            self.built = False
+            self._books, self._by_author, self._genre_sets = {}, {}, {}
+            self._by_genres, self._by_category_genres, self._by_category = {}, {}, {}
+            self._resync.reset()
+
+    @staticmethod
+    def _fingerprint_select():
+        genre_links = select(func.count()).select_from(book_genre).scalar_subquery()
+
+        return select(
+            func.count(Book.id), func.max(Book.id), func.sum(Book.author_id), func.sum(Book.category_id), genre_links
+        )
+
+    @staticmethod
+    def _score(book: tuple, other: tuple) -> float:
+        author_id, category_id, genres, _ = book
+        other_author_id, other_category_id, other_genres, other_popularity = other
+
+        union = len(genres | other_genres)
+        relatedness = (
+            GENRE_WEIGHT * (len(genres & other_genres) / union if union else 0.0)
+            + AUTHOR_WEIGHT * (author_id == other_author_id)
+            + CATEGORY_WEIGHT * (category_id == other_category_id)
+        )
+
+        return relatedness * other_popularity
+
+    def _build(self) -> None:
+        self.rebuild()
+        self._resync.mark()
+        for row, genres in self._load():
+            self._add(row, genres)
+        self.built = True
+
+    @staticmethod
+    def _load(book_ids: list = None):
+        """Yield ((id, author id, category id, rating, downloads), genre ids) of given or all books."""
+
+        books = select(Book.id, Book.author_id, Book.category_id, Book.rating, Book.downloads)
+        genres = select(book_genre.c.book_id, book_genre.c.genre_id)
+        if book_ids is not None:
+            books = books.where(Book.id.in_(book_ids))
+            genres = genres.where(book_genre.c.book_id.in_(book_ids))
+
+        genres_of = {}
+        for book_id, genre_id in db.session.execute(genres):
+            genres_of.setdefault(book_id, set()).add(genre_id)
+
+        for row in db.session.execute(books):
+            yield tuple(row), frozenset(genres_of.get(row[0], ()))
+
+    def _add(self, row: tuple, genres: frozenset) -> None:
+        book_id, author_id, category_id, rating, downloads = row
+        book_popularity = popularity(rating, downloads)
+        entry = (-book_popularity, book_id)
+
+        self._books[book_id] = (author_id, category_id, genres, book_popularity)
+        self._by_author.setdefault(author_id, set()).add(book_id)
+        bisect.insort(self._by_category.setdefault(category_id, []), entry)
+
+        if genres:
+            if genres not in self._by_genres:
+                self._by_genres[genres] = []
+                for genre_id in genres:
+                    self._genre_sets.setdefault(genre_id, set()).add(genres)
+            bisect.insort(self._by_genres[genres], entry)
+            bisect.insort(self._by_category_genres.setdefault((category_id, genres), []), entry)
+
+    def _remove(self, book_id: int) -> None:
+        book = self._books.pop(book_id, None)
+        if book is None:
+            return
+
+        author_id, category_id, genres, book_popularity = book
+        entry = (-book_popularity, book_id)
+
+        self._by_author[author_id].discard(book_id)
+        self._discard(self._by_category, category_id, entry)
+
+        if genres:
+            self._discard(self._by_category_genres, (category_id, genres), entry)
+            self._discard(self._by_genres, genres, entry)
+            if genres not in self._by_genres:
+                for genre_id in genres:
+                    self._genre_sets[genre_id].discard(genres)
+
+    @staticmethod
+    def _discard(lists: dict, key, entry: tuple) -> None:
+        entries = lists[key]
+        del entries[bisect.bisect_left(entries, entry)]
+        if not entries:
+            del lists[key]
+
+    def _refresh(self, book_ids: list) -> None:
+        """Re-read given books from the database."""
+
+        if not self.built or not book_ids:
+            return
+
+        if has_app_context() or self.app is None:
+            context = contextlib.nullcontext()
+        else:
+            context = self.app.app_context()  # counter flushes run outside of requests
+
+        with context, self._lock:
+            for book_id in book_ids:
+                self._remove(book_id)
+            for row, genres in self._load(book_ids):
+                self._add(row, genres)
+
+    def _on_saved(self, sender, instance):
+        self._refresh([instance.id])
+
+    def _on_deleted(self, sender, instance, id):
+        with self._lock:
+            self._remove(id)
+
+    def _on_changed(self, sender, ids):
+        self._refresh(list(ids))
+
+
+similar_books = SimilarBooks()
@@ -0,0 +1,392 @@
+"""
+Autocomplete of book titles, author names and genre names, served on GET /suggest.
+
+Names are folded for matching: compatibility decomposition (NFKD), combining marks
+dropped, case folded and whitespace collapsed, so "bronte" finds "Brontë" and
+"STRASSE" finds "Straße". A query matches a name when it is a prefix of the folded name
+from the start of any of its words. Matches are ranked by downloads: those of the book,
+summed over their books for authors and genres.
+
+The index is a sorted array of (slot, word offset) pairs packed into one integer,
+ordered by the folded name from that offset on, and looked up with `bisect`. Every
+indexed name takes one slot in parallel arrays of kinds, ids, downloads and, for books,
+author ids and genre ids; names and genre id tuples are interned. Books matching a one
+or two character prefix can be a good part of the catalogue, so the best matches of such
+prefixes are kept until a name under them changes.
+
+The index is built with one streaming query, then kept in sync from model signals and
+counter flushes, re-reading only the changed books: their downloads are moved from their
+previous author and genres to the current ones, so totals never need a scan. Names added
+by other workers show up when the index is rebuilt: after the fingerprint of books,
+authors and genres moved, see `resync.py`, or after INDEX_MAX_AGE seconds for renames
+and downloads.
+"""
+
+import bisect
+import contextlib
+import heapq
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+from flask import has_app_context
+from sqlalchemy import Integer, String, func, literal, null, select, union_all
+
+from backend.src.database.models import Author, Book, Genre, book_genre, db
+from backend.src.database.resync import Resync
+from backend.src.database.signals import model_deleted, model_saved, models_changed
+
+BOOK, AUTHOR, GENRE = 0, 1, 2
+KINDS = {BOOK: "book", AUTHOR: "author", GENRE: "genre"}
+BOOK_GENRE = 3  # rows of the build query linking a book to a genre
+
+MAX_SUGGESTIONS = 100  # largest limit served, matches kept per short prefix
+SHORT_PREFIX = 2  # folded queries up to this length are answered from kept matches
+BUILD_BATCH = 1000  # rows fetched at a time while building
+
+OFFSET_BITS = 16  # word offsets packed with slots, names are at most 255 characters
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+WORD_RE = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    if text.isascii():
+        return " ".join(text.lower().split())
+
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+
+    return " ".join(stripped.casefold().split())
+
+
+def fold_query(text: str) -> str:
+    """Fold like names, a trailing space is kept so "harry " only matches whole words."""
+
+    folded = fold(text)
+    return folded + " " if folded and text[-1:].isspace() else folded
+
+
+def _ref(kind: int, id: int) -> int:
+    return id << 2 | kind
+
+
+class SuggestIndex:
+    def __init__(self):
+        self.app = None
+        self.built = False
+        self._resync = Resync(self._fingerprint_select)
+        self._lock = threading.RLock()
+        self.rebuild()
+
+        model_saved.connect(self._on_book_saved, sender=Book, weak=False)
+        model_deleted.connect(self._on_book_deleted, sender=Book, weak=False)
+        models_changed.connect(self._on_books_changed, sender=Book, weak=False)
+        model_saved.connect(self._on_author_saved, sender=Author, weak=False)
+        model_deleted.connect(self._on_author_deleted, sender=Author, weak=False)
+        model_saved.connect(self._on_genre_saved, sender=Genre, weak=False)
+        models_changed.connect(self._on_genres_changed, sender=Genre, weak=False)
+
+    def init_app(self, app, lazy: bool = False) -> None:
+        """Build the index, call inside app context. With `lazy`, the first suggestion builds it."""
+
+        self.app = app
+        self.rebuild()
+        app.extensions["suggest"] = self
+
+        if not lazy:
+            self.build()
+
+    def build(self) -> None:
+        with self._lock:
+            if self.built:
+                return
+
+            self.rebuild()
+            self._resync.mark()
+            genres_of = {}
+            for kind, id, name, downloads, related_id in db.session.execute(self._rows_select()):
+                if kind == BOOK_GENRE:
+                    genres_of.setdefault(id, []).append(related_id)
+                else:
+                    self._new_slot(kind, id, name, downloads, related_id)
+
+            for book_id, genre_ids in genres_of.items():
+                slot = self._slots.get(_ref(BOOK, book_id))
+                if slot is not None:
+                    self._genres[slot] = self._genre_set(genre_ids)
+
+            totals = Counter()
+            for slot, kind in enumerate(self._kinds):
+                if kind == BOOK:
+                    totals[_ref(AUTHOR, self._authors[slot])] += self._downloads[slot]
+                    for genre_id in self._genres[slot]:
+                        totals[_ref(GENRE, genre_id)] += self._downloads[slot]
+
+            for key, downloads in totals.items():
+                slot = self._slots.get(key)
+                if slot is not None:
+                    self._downloads[slot] = downloads
+
+            keys = [key for slot in range(len(self._kinds)) for key in self._slot_keys(slot)]
+            keys.sort(key=self._suffix)
+            self._keys = array("q", keys)
+            self.built = True
+
+    def rebuild(self) -> None:
+        """Drop the index, it is built again by `build()` or the next suggestion."""
+
+        with self._lock:
+            self.built = False
+            self._kinds = array("b")
+            self._ids = array("q")
+            self._downloads = array("q")
+            self._authors = array("q")  # author id of book slots, -1 otherwise
+            self._genres = []  # genre ids of book slots
+            self._names = []
+            self._folded = []
+            self._slots = {}  # `_ref(kind, id)` -> slot
+            self._free = []  # slots of removed names
+            self._genre_sets = {(): ()}  # genre id tuples shared by books
+            self._keys = array("q")  # slot << OFFSET_BITS | offset, by folded name from offset
+            self._short = {}  # folded short prefix -> best slots
+            self._resync.reset()
+
+    @staticmethod
+    def _fingerprint_select():
+        def ids(model):
+            return (
+                select(func.count(model.id)).scalar_subquery(),
+                select(func.max(model.id)).scalar_subquery(),
+            )
+
+        genre_links = select(func.count()).select_from(book_genre).scalar_subquery()
+        moves = select(func.sum(Book.author_id)).scalar_subquery()
+
+        return select(*ids(Book), *ids(Author), *ids(Genre), genre_links, moves)
+
+    def suggest(self, query: str, limit: int) -> list:
+        """Up to `limit` {"type", "id", "name", "downloads"} matches of `query`, most downloaded first."""
+
+        prefix = fold_query(query)
+        if not prefix:
+            return []
+
+        with self._lock:
+            if self._resync.stale():
+                self.rebuild()
+            if not self.built:
+                self.build()
+
+            if len(prefix) <= SHORT_PREFIX:
+                slots = self._short.get(prefix)
+                if slots is None:
+                    slots = self._short[prefix] = self._best(prefix, MAX_SUGGESTIONS)
+                slots = slots[:limit]
+            else:
+                slots = self._best(prefix, limit)
+
+            return [
+                {
+                    "type": KINDS[self._kinds[slot]],
+                    "id": self._ids[slot],
+                    "name": self._names[slot],
+                    "downloads": self._downloads[slot],
+                }
+                for slot in slots
+            ]
+
+    @staticmethod
+    def _rows_select():
+        """(kind, id, name, downloads, author or genre id) rows of books, authors, genres and genres of books."""
+
+        no_name, no_id = null().cast(String), null().cast(Integer)
+        return union_all(
+            select(literal(BOOK), Book.id, Book.name, func.coalesce(Book.downloads, 0), Book.author_id),
+            select(literal(AUTHOR), Author.id, Author.name, literal(0), no_id),
+            select(literal(GENRE), Genre.id, Genre.name, literal(0), no_id),
+            select(literal(BOOK_GENRE), book_genre.c.book_id, no_name, literal(0), book_genre.c.genre_id),
+        ).execution_options(yield_per=BUILD_BATCH)
+
+    def _suffix(self, key: int) -> str:
+        return self._folded[key >> OFFSET_BITS][key & OFFSET_MASK:]
+
+    def _slot_keys(self, slot: int) -> list:
+        folded = self._folded[slot]
+        offsets = {0, *(match.start() for match in WORD_RE.finditer(folded))}
+
+        return [slot << OFFSET_BITS | offset for offset in sorted(offsets) if offset <= OFFSET_MASK]
+
+    def _best(self, prefix: str, limit: int) -> list:
+        start = bisect.bisect_left(self._keys, prefix, key=self._suffix)
+        end = bisect.bisect_left(self._keys, prefix + "\U0010ffff", key=self._suffix)
+        slots = {key >> OFFSET_BITS for key in self._keys[start:end]}
+
+        return heapq.nsmallest(limit, slots, key=lambda slot: (-self._downloads[slot], self._kinds[slot], self._ids[slot]))
+
+    def _forget(self, slot: int) -> None:
+        """Drop kept matches of the short prefixes of a name."""
+
+        folded = self._folded[slot]
+        for key in self._slot_keys(slot):
+            offset = key & OFFSET_MASK
+            for length in range(1, SHORT_PREFIX + 1):
+                self._short.pop(folded[offset:offset + length], None)
+
+    def _genre_set(self, genre_ids) -> tuple:
+        genre_ids = tuple(sorted(genre_ids))
+        return self._genre_sets.setdefault(genre_ids, genre_ids)
+
+    def _new_slot(self, kind: int, id: int, name: str, downloads: int, author_id) -> int:
+        values = (kind, id, downloads, -1 if author_id is None else author_id)
+        columns = (self._kinds, self._ids, self._downloads, self._authors)
+
+        if self._free:
+            slot = self._free.pop()
+            for column, value in zip(columns, values):
+                column[slot] = value
+            self._genres[slot], self._names[slot], self._folded[slot] = (), sys.intern(name), sys.intern(fold(name))
+        else:
+            slot = len(self._kinds)
+            for column, value in zip(columns, values):
+                column.append(value)
+            self._genres.append(())
+            self._names.append(sys.intern(name))
+            self._folded.append(sys.intern(fold(name)))
+
+        self._slots[_ref(kind, id)] = slot
+        return slot
+
+    def _set_name(self, kind: int, id: int, name: str) -> int:
+        """Slot of a name, added or renamed. Downloads of renamed ones are kept."""
+
+        slot = self._slots.get(_ref(kind, id))
+        if slot is not None and self._names[slot] == name:
+            return slot
+
+        downloads = self._downloads[slot] if slot is not None else 0
+        self._remove(kind, id)
+
+        slot = self._new_slot(kind, id, name, downloads, None)
+        for key in self._slot_keys(slot):
+            bisect.insort_right(self._keys, key, key=self._suffix)
+        self._forget(slot)
+
+        return slot
+
+    def _remove(self, kind: int, id: int) -> None:
+        slot = self._slots.pop(_ref(kind, id), None)
+        if slot is None:
+            return
+
+        self._forget(slot)
+        for key in self._slot_keys(slot):
+            index = bisect.bisect_left(self._keys, self._suffix(key), key=self._suffix)
+            while self._keys[index] != key:
+                index += 1
+            del self._keys[index]
+
+        self._genres[slot], self._names[slot], self._folded[slot] = (), "", ""
+        self._free.append(slot)
+
+    def _add_downloads(self, kind: int, id: int, delta: int) -> None:
+        slot = self._slots.get(_ref(kind, id))
+        if slot is not None and delta:
+            self._forget(slot)
+            self._downloads[slot] += delta
+
+    def _move_downloads(self, slot: int, delta: int) -> None:
+        """Add downloads of a book slot to its author and genres."""
+
+        self._add_downloads(AUTHOR, self._authors[slot], delta)
+        for genre_id in self._genres[slot]:
+            self._add_downloads(GENRE, genre_id, delta)
+
+    def _context(self):
+        if has_app_context() or self.app is None:
+            return contextlib.nullcontext()
+
+        return self.app.app_context()  # counter flushes run outside of requests
+
+    def _refresh_books(self, book_ids: list) -> None:
+        """Re-read given books with their genres."""
+
+        if not self.built or not book_ids:
+            return
+
+        with self._context(), self._lock:
+            rows = db.session.execute(
+                select(Book.id, Book.name, func.coalesce(Book.downloads, 0), Book.author_id).where(Book.id.in_(book_ids))
+            ).all()
+            genres_of = {}
+            for book_id, genre_id in db.session.execute(
+                select(book_genre.c.book_id, book_genre.c.genre_id).where(book_genre.c.book_id.in_(book_ids))
+            ):
+                genres_of.setdefault(book_id, []).append(genre_id)
+
+            # authors and genres may be inserted along with a book, without their own signal
+            self._add_missing(AUTHOR, Author, {row[3] for row in rows if row[3] is not None})
+            self._add_missing(GENRE, Genre, {genre_id for genre_ids in genres_of.values() for genre_id in genre_ids})
+
+            current = {row[0] for row in rows}
+            for book_id in book_ids:
+                slot = self._slots.get(_ref(BOOK, book_id))
+                if slot is not None:
+                    self._move_downloads(slot, -self._downloads[slot])
+                    if book_id not in current:
+                        self._remove(BOOK, book_id)
+
+            for book_id, name, downloads, author_id in rows:
+                slot = self._set_name(BOOK, book_id, name)
+                self._forget(slot)
+                self._downloads[slot] = downloads
+                self._authors[slot] = -1 if author_id is None else author_id
+                self._genres[slot] = self._genre_set(genres_of.get(book_id, ()))
+                self._move_downloads(slot, downloads)
+
+    def _add_missing(self, kind: int, model, ids: set) -> None:
+        missing = [id for id in ids if _ref(kind, id) not in self._slots]
+        if missing:
+            for id, name in db.session.execute(select(model.id, model.name).where(model.id.in_(missing))):
+                self._set_name(kind, id, name)
+
+    def _on_book_saved(self, sender, instance):
+        self._refresh_books([instance.id])
+
+    def _on_book_deleted(self, sender, instance, id):
+        self._refresh_books([id])
+
+    def _on_books_changed(self, sender, ids):
+        self._refresh_books(list(ids))
+
+    def _on_author_saved(self, sender, instance):
+        if not self.built:
+            return
+
+        # books may be given to an author by assignment, without a book signal
+        with self._context(), self._lock:
+            self._set_name(AUTHOR, instance.id, instance.name)
+            self._refresh_books(db.session.execute(select(Book.id).where(Book.author_id == instance.id)).scalars().all())
+
+    def _on_author_deleted(self, sender, instance, id):
+        with self._lock:
+            self._remove(AUTHOR, id)
+
+    def _on_genre_saved(self, sender, instance):
+        if self.built:
+            with self._lock:
+                self._set_name(GENRE, instance.id, instance.name)
+
+    def _on_genres_changed(self, sender, ids):
+        if not self.built:
+            return
+
+        with self._context(), self._lock:
+            for genre_id, name in db.session.execute(select(Genre.id, Genre.name).where(Genre.id.in_(ids))):
+                self._set_name(GENRE, genre_id, name)
+
+
+suggestions = SuggestIndex()
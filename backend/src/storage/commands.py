@@ -0,0 +1,25 @@
+"""
+`flask storage ...` commands.
+"""
+
+import click
+from flask.cli import AppGroup
+
+from backend.src.database.models import Book
+from backend.src.storage.storage import GC_GRACE_PERIOD, storage
+
+storage_cli = AppGroup("storage", help="Manage stored book files.")
+
+
+@storage_cli.command("gc")
+@click.option("--grace-period", default=GC_GRACE_PERIOD, show_default=True,
+              help="Keep unreferenced blobs younger than this many seconds.")
+@click.option("--dry-run", is_flag=True, help="Only list blobs which would be removed.")
+def collect_garbage(grace_period: int, dry_run: bool):
+    """Remove book files no book references."""
+
+    removed = storage.collect_garbage(Book.file_references(), grace_period=grace_period, dry_run=dry_run)
+
+    for sha256 in removed:
+        click.echo(sha256)
+    click.echo(f"{'would remove' if dry_run else 'removed'} {len(removed)} blob(s)")
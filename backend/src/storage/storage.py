@@ -0,0 +1,126 @@
+"""
+Content-addressed storage of book files on local disk.
+
+A file is stored once under a path derived from its SHA-256 (`ab/cd/abcd...`), so
+identical uploads share one blob and different files can never overwrite each other.
+Books reference blobs through `Book.file_sha256`; the number of books pointing at a
+blob is its reference count, and blobs nobody references are removed by
+`flask storage gc`.
+
+Uploads are copied from the request stream in fixed-size chunks (the body is never
+held in memory as a whole) and hashed on the fly. Data is written to a temporary
+file first and moved into place once complete, so readers never see partial blobs.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BOOKS_DIR = os.getenv("BOOKS_DIR", os.path.join(BACKEND_DIR, "resources", "books"))
+CHUNK_SIZE = int(os.getenv("BOOKS_CHUNK_SIZE", str(64 * 1024)))
+GC_GRACE_PERIOD = 3600  # seconds; younger blobs may belong to an upload whose book is not committed yet
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class StoredFile:
+    def __init__(self, path: str, size: int, sha256: str, created: bool):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.created = created  # False when an identical blob was already stored
+
+
+class BookStorage:
+    def __init__(self, root: str = BOOKS_DIR, chunk_size: int = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path(self, sha256: str) -> str:
+        if not SHA256_RE.match(sha256):
+            raise ValueError(f"not a SHA-256 hex digest: {sha256!r}")
+
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return bool(sha256) and os.path.isfile(self.path(sha256))
+
+    def save(self, stream) -> StoredFile:
+        """Copy `stream` (file-like object with `read(size)`) into the store."""
+
+        os.makedirs(self.root, exist_ok=True)
+
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+
+            if os.path.isfile(path):
+                os.unlink(tmp_path)
+                os.utime(path)  # keep a freshly re-uploaded blob out of reach of gc's grace period
+                return StoredFile(path, size, digest, created=False)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return StoredFile(path, size, digest, created=True)
+
+    def blobs(self):
+        """Yield SHA-256 of every stored blob."""
+
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if SHA256_RE.match(name):
+                    yield name
+
+    def collect_garbage(self, references: dict, grace_period: float = GC_GRACE_PERIOD, dry_run: bool = False) -> list:
+        """
+        Remove blobs without references. `references` maps SHA-256 to the number of
+        books using the blob. Returns SHA-256 of removed blobs.
+        """
+
+        removed = []
+        deadline = time.time() - grace_period
+
+        for sha256 in list(self.blobs()):
+            if references.get(sha256, 0) > 0:
+                continue
+
+            path = self.path(sha256)
+            if os.path.getmtime(path) > deadline:
+                continue
+
+            if not dry_run:
+                os.unlink(path)
+            removed.append(sha256)
+
+        # leftovers of interrupted uploads
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.startswith(".upload-") and os.path.getmtime(path) <= deadline and not dry_run:
+                    os.unlink(path)
+
+        return removed
+
+
+storage = BookStorage()
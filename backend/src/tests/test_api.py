@@ -0,0 +1,731 @@
+import asyncio
+import datetime
+import decimal
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+from backend.benchmarks.local_auth import LocalIssuer
+from backend.src.api.api import DEFAULT_CONFIG, create_app
+from backend.src.api.cache import FakeRedis, RedisBackend, response_cache
+from backend.src.api.json_provider import FastJSONProvider
+from backend.src.api.metrics import SLOW_QUERY_THRESHOLD, request_metrics
+from backend.src.auth import auth
+from backend.src.auth.jwks import JWKSKeyStore
+from backend.src.auth.token_cache import VerifiedTokenCache
+from backend.src.database.counters import counters
+from backend.src.database.models import Author, Book, Category, Genre, db
+from backend.src.database.replicas import replica_router
+from backend.src.database.signals import models_changed
+from backend.src.search.engines import search
+from backend.src.storage.storage import storage
+from backend.src.tests.test_db import QueryCounter
+
+
+class ApiTestCase(unittest.TestCase):
+    issuer = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer(bits=1024)
+
+    def setUp(self):
+        self.issuer.install()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.tmp_dir.name, "e-library.db")
+        self.app = create_app({"DATABASE_URL": f"sqlite:///{self.database_path}", "DB_REPLICAS": []})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        counters.flush()
+        with self.app.app_context():
+            db.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def headers(self, *permissions) -> dict:
+        return {"Authentication": f"bearer {self.issuer.token(list(permissions))}"}
+
+    def cli(self, *args) -> str:
+        result = self.app.test_cli_runner().invoke(args=list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+
+class TestCreateApp(ApiTestCase):
+    def test_creating_app_does_not_touch_database(self):
+        self.assertFalse(os.path.exists(self.database_path))
+
+    def test_schema_is_managed_by_commands(self):
+        self.cli("schema", "upgrade")
+
+        with self.app.app_context():
+            self.assertIn("book", inspect(db.engine).get_table_names())
+
+        response = self.client.get("/book", headers=self.headers("get:books"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["books"], [])
+
+        self.cli("schema", "reset", "--yes")
+        self.cli("schema", "upgrade")
+
+
+class TestMetrics(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        request_metrics.reset()
+        self.app.add_url_rule("/lazy-loads", view_func=lambda: [db.session.scalar(select(Book.id).where(Book.id == i)) for i in range(12)])
+        self.cli("schema", "upgrade")
+
+    def tearDown(self):
+        super().tearDown()
+        request_metrics.slow_query_threshold = SLOW_QUERY_THRESHOLD
+
+    def metrics(self) -> str:
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        return response.get_data(as_text=True)
+
+    def test_requests_are_measured(self):
+        self.client.get("/book", headers=self.headers("get:books"))
+        self.client.get("/book", headers=self.headers("get:books"))
+        metrics = self.metrics()
+
+        self.assertIn('elibrary_request_duration_seconds_count{method="GET",endpoint="/book",status="200"} 2', metrics)
+        self.assertIn('elibrary_auth_verification_seconds_count{method="GET",endpoint="/book"} 2', metrics)
+        self.assertIn('elibrary_request_sql_queries_bucket{method="GET",endpoint="/book",le="+Inf"} 2', metrics)
+        self.assertIn('elibrary_db_pool_checkouts_total{pool="primary"}', metrics)
+
+    def test_pool_stats_need_stats_permission(self):
+        self.assertEqual(self.client.get("/stats/db-pool").status_code, 401)
+        self.assertEqual(self.client.get("/stats/db-pool", headers=self.headers("get:books")).status_code, 401)
+
+        response = self.client.get("/stats/db-pool", headers=self.headers("get:stats"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("checkouts", response.get_json()["pools"]["primary"])
+
+    def test_pools_are_reported_by_bind(self):
+        replica = os.path.join(self.tmp_dir.name, "replica.db")
+        app = create_app({"DATABASE_URL": f"sqlite:///{self.database_path}", "DB_REPLICAS": [f"sqlite:///{replica}"]})
+        client = app.test_client()
+
+        try:
+            pools = client.get("/stats/db-pool", headers=self.headers("get:stats")).get_json()["pools"]
+            metrics = client.get("/metrics").get_data(as_text=True)
+        finally:
+            replica_router.stop()
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose()
+
+        self.assertEqual(sorted(pools), ["primary", "replica_0"])
+        self.assertIn('elibrary_db_pool_in_use{pool="replica_0"} 0', metrics)
+
+    def test_repeated_and_slow_statements_are_flagged(self):
+        self.client.get("/lazy-loads")
+        self.assertIn('elibrary_n_plus_one_total{method="GET",endpoint="/lazy-loads"} 1', self.metrics())
+        self.assertIn("elibrary_slow_queries_total 0", self.metrics())
+
+        request_metrics.slow_query_threshold = 0
+        self.client.get("/lazy-loads")
+        stats = self.client.get("/stats/queries", headers=self.headers("get:stats")).get_json()
+
+        self.assertEqual(len(stats["n_plus_one"]), 2)
+        self.assertEqual(stats["n_plus_one"][0]["count"], 12)
+        self.assertEqual(len(stats["slow_queries"]), 12)
+        self.assertEqual(stats["slow_queries"][0]["endpoint"], "GET /lazy-loads")
+
+    def test_failed_requests_and_statements_are_measured(self):
+        def fail():
+            try:
+                db.session.execute(text("SELECT * FROM no_such_table"))
+            except OperationalError:
+                db.session.rollback()
+            db.session.scalar(select(Book.id))
+            raise RuntimeError("unhandled")
+
+        self.app.add_url_rule("/fail", view_func=fail)
+        request_metrics.slow_query_threshold = 0
+
+        with self.assertRaises(RuntimeError):
+            self.client.get("/fail")
+
+        self.assertIn('elibrary_request_duration_seconds_count{method="GET",endpoint="/fail",status="500"} 1', self.metrics())
+        # the failed statement left no start time behind, the next one is timed on its own
+        self.assertIn('elibrary_request_sql_queries_bucket{method="GET",endpoint="/fail",le="1"} 1', self.metrics())
+        self.assertEqual(request_metrics.format()["slow_queries"][-1]["statement"], "SELECT book.id \nFROM book")
+
+        response = self.client.get("/stats/queries", headers=self.headers("get:books"))
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(response.get_json()["success"])
+
+
+class TestAuth(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cli("schema", "upgrade")
+        self.fetches = 0
+
+    def fetch_jwks(self) -> dict:
+        self.fetches += 1
+        if self.fetches > 1 and self.issuer_down:
+            raise OSError("issuer unreachable")
+        return self.issuer.jwks
+
+    def install_store(self, issuer_down: bool = False, **options) -> None:
+        self.issuer_down = issuer_down
+        auth.jwks_store = JWKSKeyStore(self.fetch_jwks, background=False, **options)
+
+    def get_books(self, *permissions) -> int:
+        return self.client.get("/book", headers=self.headers("get:books", *permissions)).status_code
+
+    def test_signing_keys_are_fetched_once(self):
+        self.install_store()
+
+        # distinct tokens, none of them served by the verified token cache
+        self.assertEqual([self.get_books(f"extra:{i}") for i in range(3)], [200] * 3)
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(auth.jwks_store.stats["hits"], 3)
+
+    def test_last_keys_are_served_while_the_issuer_is_down(self):
+        self.install_store(issuer_down=True, ttl=0, min_refetch_interval=0)
+
+        self.assertEqual([self.get_books(f"extra:{i}") for i in range(2)], [200, 200])
+        self.assertEqual(auth.jwks_store.stats["refresh_errors"], 2)
+
+    def test_verified_tokens_skip_verification_until_they_expire(self):
+        self.install_store()
+        headers = self.headers("get:books")
+
+        with mock.patch.object(auth.jwt, "decode", wraps=auth.jwt.decode) as decode:
+            for _ in range(3):
+                self.assertEqual(self.client.get("/book", headers=headers).status_code, 200)
+            self.assertEqual(decode.call_count, 1)
+
+            expired = time.time() + auth.token_cache.ttl + 1
+            with mock.patch("backend.src.auth.token_cache.time.time", return_value=expired):
+                self.assertEqual(self.client.get("/book", headers=headers).status_code, 200)
+            self.assertEqual(decode.call_count, 2)
+
+        self.assertEqual(len(auth.token_cache), 1)  # the re-verified token replaced its expired entry
+
+
+class TestAuthCaches(unittest.TestCase):
+    @staticmethod
+    def jwks(*kids) -> dict:
+        return {"keys": [{"kid": kid, "kty": "RSA", "n": f"n-{kid}", "e": "AQAB", "use": "sig"} for kid in kids]}
+
+    def test_keys_are_served_from_memory_until_stale(self):
+        fetch = mock.Mock(side_effect=[self.jwks("a"), self.jwks("a", "b")])
+        store = JWKSKeyStore(fetch, ttl=60, min_refetch_interval=0, background=False)
+
+        self.assertEqual(store.get_key("a")["n"], "n-a")
+        self.assertEqual(store.get_key("a")["n"], "n-a")
+        self.assertEqual((fetch.call_count, store.stats["hits"]), (1, 2))
+
+        with mock.patch("backend.src.auth.jwks.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNotNone(store.get_key("b"))
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_unknown_kid_refetches_at_most_once_per_interval(self):
+        fetch = mock.Mock(side_effect=[self.jwks("a"), self.jwks("a", "rotated"), self.jwks("a")])
+        store = JWKSKeyStore(fetch, ttl=600, min_refetch_interval=30, background=False)
+        store.get_key("a")
+
+        with mock.patch("backend.src.auth.jwks.time.monotonic", return_value=time.monotonic() + 31):
+            self.assertEqual(store.get_key("rotated")["n"], "n-rotated")
+            self.assertIsNone(store.get_key("forged"))
+
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(store.stats["misses"], 2)
+
+    def test_verified_payloads_expire_with_their_token(self):
+        cache = VerifiedTokenCache(maxsize=2, ttl=300)
+        now = time.time()
+        cache.put("short", {"exp": now + 10})
+        cache.put("long", {"exp": now + 3600})
+
+        self.assertEqual(cache.get("short"), {"exp": now + 10})
+        with mock.patch("backend.src.auth.token_cache.time.time", return_value=now + 11):
+            self.assertIsNone(cache.get("short"))
+            self.assertIsNotNone(cache.get("long"))
+        with mock.patch("backend.src.auth.token_cache.time.time", return_value=now + 301):
+            self.assertIsNone(cache.get("long"))  # `ttl` bounds tokens living longer
+
+        cache.put("a", {})
+        cache.put("b", {})
+        cache.put("c", {})
+        self.assertEqual((len(cache), cache.get("a")), (2, None))
+        self.assertEqual(cache.stats, {"hits": 2, "misses": 3})
+
+
+class TestBookFile(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage_root = mock.patch.object(storage, "root", os.path.join(self.tmp_dir.name, "books"))
+        self.storage_root.start()
+        self.cli("schema", "upgrade")
+
+        with self.app.app_context():
+            db.session.add(Book(name="book", author=Author(name="author", age=40), category=Category(name="category")))
+            db.session.commit()
+
+    def tearDown(self):
+        self.storage_root.stop()
+        super().tearDown()
+
+    def download(self, **headers):
+        return self.client.get("/books/1/file", headers={**self.headers("get:books-details"), **headers})
+
+    def test_downloads_support_ranges_and_count_once(self):
+        self.assertEqual(self.download().status_code, 404)
+
+        response = self.client.put("/books/1/file", data=b"0123456789", headers=self.headers("patch:books"))
+        self.assertEqual(response.get_json()["size"], 10)
+
+        response = self.download()
+        self.assertEqual((response.status_code, response.data), (200, b"0123456789"))
+        etag = response.headers["ETag"]
+        self.assertEqual(self.download(Range="bytes=0-3").data, b"0123")
+        self.assertEqual(self.download(Range="bytes=4-").status_code, 206)
+        self.assertEqual(self.download(**{"If-None-Match": etag}).status_code, 304)
+
+        counters.flush()
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Book, 1).downloads, 2)
+
+
+class TestResponseCache(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cli("schema", "upgrade")
+        self.stats = dict(response_cache.stats)
+
+        with self.app.app_context():
+            Author(name="author", age=40).insert()
+
+    def counted(self) -> dict:
+        return {key: value - self.stats[key] for key, value in response_cache.stats.items()}
+
+    def get(self, path: str, permission: str, **headers):
+        return self.client.get(path, headers={**self.headers(permission), **headers})
+
+    def test_responses_are_cached_until_a_write(self):
+        first = self.get("/authors/1", "get:authors_details")
+        second = self.get("/authors/1", "get:authors_details")
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(self.get("/authors/1", "get:authors_details", **{"If-None-Match": first.headers["ETag"]}).status_code, 304)
+        self.assertEqual(self.counted(), {"hits": 2, "misses": 1, "not_modified": 1})
+
+        with self.app.app_context():
+            author = db.session.get(Author, 1)
+            author.name = "renamed"
+            author.update()
+
+        response = self.get("/authors/1", "get:authors_details", **{"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["author"]["name"], "renamed")
+        self.assertEqual(self.counted()["misses"], 2)
+
+    def test_errors_are_not_cached(self):
+        for _ in range(2):
+            response = self.get("/authors/99", "get:authors_details")
+            self.assertEqual(response.status_code, 404)
+            self.assertNotIn("ETag", response.headers)
+
+        self.assertEqual(self.get("/authors/1", "get:books").status_code, 401)
+        self.assertEqual(self.counted(), {"hits": 0, "misses": 2, "not_modified": 0})
+
+    def test_redis_backend_shares_entries_between_apps(self):
+        redis = FakeRedis()
+        response_cache.init_app(self.app, backend=RedisBackend(redis))
+
+        body = self.get("/authors", "get:authors").get_json()
+        other = create_app({"DATABASE_URL": "sqlite:///" + os.path.join(self.tmp_dir.name, "empty.db"), "DB_REPLICAS": []})
+        response_cache.init_app(other, backend=RedisBackend(redis))
+
+        # served from Redis without touching the (schemaless) database of the other app
+        response = other.test_client().get("/authors", headers=self.headers("get:authors"))
+        self.assertEqual(response.get_json(), body)
+        self.assertEqual(self.counted()["hits"], 1)
+
+
+class TestPagination(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cli("schema", "upgrade")
+
+        with self.app.app_context():
+            category = Category(name="category")
+            db.session.add_all([
+                Book(name=f"book {i}", author=Author(name=f"author {i}", age=40), category=category)
+                for i in range(5)
+            ])
+            db.session.commit()
+
+    def pages(self, path: str, key: str, permission: str) -> list:
+        """Ids of every page of `path` walked with `next_cursor`, two items per page."""
+
+        pages, query = [], {"limit": 2}
+        while True:
+            response = self.client.get(path, query_string=query, headers=self.headers(permission))
+            self.assertEqual(response.status_code, 200, response.get_json())
+            pages.append([item["id"] for item in response.get_json()[key]])
+
+            cursor = response.get_json()["next_cursor"]
+            if cursor is None:
+                return pages
+            query["after"] = cursor
+
+    def test_lists_are_walked_with_cursors(self):
+        self.assertEqual(self.pages("/book", "books", "get:books"), [[1, 2], [3, 4], [5]])
+        self.assertEqual(self.pages("/authors", "authors", "get:authors"), [[1, 2], [3, 4], [5]])
+
+    def test_bad_cursors_and_limits_are_rejected(self):
+        headers = self.headers("get:books")
+
+        response = self.client.get("/book?after=not-a-cursor", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["message"], "INVALID CURSOR")
+        self.assertEqual(self.client.get("/book?limit=0", headers=headers).status_code, 422)
+        self.assertEqual(self.client.get("/book?limit=100000", headers=headers).status_code, 422)
+
+
+class TestMutations(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cli("schema", "upgrade")
+
+        with self.app.app_context():
+            db.session.add_all([Author(name="author", age=40), Author(name="other", age=50), Category(name="category")])
+            db.session.add_all([Genre(name=f"genre {i}") for i in range(50)])
+            db.session.commit()
+
+    def post_book(self, genres: list, query: str = "", **fields):
+        book = {
+            "name": "book", "author": "author", "category": "category", "description": "",
+            "num_of_pages": 100, "year_of_publishing": 2000, "genres": genres, **fields,
+        }
+        return self.client.post(f"/book{query}", json=book, headers=self.headers("post:books"))
+
+    def test_book_genres_cost_constant_queries(self):
+        counts = []
+        for genres in ([f"genre {i}" for i in range(2)], [f"genre {i}" for i in range(50)]):
+            with self.app.app_context(), QueryCounter(db.engine) as counter:
+                response = self.post_book(genres)
+            self.assertEqual(response.status_code, 201, response.get_json())
+            counts.append(counter.count)
+
+        self.assertEqual(counts[0], counts[1])
+        with self.app.app_context():
+            self.assertEqual(len(db.session.get(Book, response.get_json()["new_book"]["id"]).genres), 50)
+
+    def test_missing_genres_are_created_on_request(self):
+        self.assertEqual(self.post_book(["genre 0", "new genre"]).status_code, 404)
+        self.assertEqual(self.post_book(["genre 0", "new genre"], "?create_genres=true").status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(Book.query.count(), 1)
+            self.assertEqual(sorted(genre.name for genre in Book.query.one().genres), ["genre 0", "new genre"])
+
+    def test_created_genres_are_signalled_after_commit(self):
+        committed = []
+
+        def on_genres_changed(sender, ids):
+            with db.engine.connect() as connection:  # sees committed rows only
+                committed.append(connection.scalars(select(Genre.name).where(Genre.id.in_(ids))).all())
+
+        with models_changed.connected_to(on_genres_changed, sender=Genre):
+            # unknown authors are rejected before genres are created
+            self.assertEqual(self.post_book(["other genre"], "?create_genres=true", author="nobody").status_code, 404)
+            self.assertEqual(self.post_book(["new genre"], "?create_genres=true").status_code, 201)
+
+        self.assertEqual(committed, [["new genre"]])
+        with self.app.app_context():
+            self.assertIsNone(Genre.query.filter_by(name="other genre").one_or_none())
+
+    def test_book_patch_replaces_genres_with_constant_queries(self):
+        book_id = self.post_book(["genre 0"]).get_json()["new_book"]["id"]
+        headers = self.headers("patch:books")
+        patch = {
+            "id": book_id, "title": "patched", "author": "other", "category": "category", "description": "",
+            "num_of_pages": 120, "year_of_publishing": 2001,
+        }
+
+        self.assertEqual(
+            self.client.patch(f"/books/{book_id}", json={**patch, "genres": ["unknown"]}, headers=headers).status_code, 404
+        )
+
+        counts = []
+        for genres in ([f"genre {i}" for i in range(1, 3)], [f"genre {i}" for i in range(10, 50)]):
+            with self.app.app_context(), QueryCounter(db.engine) as counter:
+                response = self.client.patch(f"/books/{book_id}", json={**patch, "title": f"{len(genres)} genres", "genres": genres}, headers=headers)
+            self.assertEqual(response.status_code, 200, response.get_json())
+            counts.append(counter.count)
+
+        self.assertEqual(counts[0], counts[1])
+        with self.app.app_context():
+            book = db.session.get(Book, book_id)
+            self.assertEqual((book.name, book.num_of_pages, book.author.name), ("40 genres", 120, "other"))
+            self.assertEqual(len(book.genres), 40)
+
+    def test_book_list_facets_are_opt_in(self):
+        self.assertEqual(self.post_book(["genre 0"], num_of_pages=-1).status_code, 422)
+        self.assertEqual(self.post_book(["genre 0"]).status_code, 201)
+        headers = self.headers("get:books")
+
+        self.assertNotIn("facets", self.client.get("/book", headers=headers).get_json())
+        facets = self.client.get("/book?facets=true", headers=headers).get_json()["facets"]
+        self.assertEqual(facets["num_of_pages"], [{"value": "100-199", "count": 1}])
+
+    def test_suggestions_follow_posted_books(self):
+        headers = self.headers("get:books")
+
+        self.assertEqual(self.client.get("/suggest", headers=headers).status_code, 422)
+        self.assertEqual(self.client.get("/suggest?q=new", headers=headers).get_json()["suggestions"], [])
+
+        self.post_book(["new genre"], "?create_genres=true")
+        response = self.client.get("/suggest?q=NEW&limit=5", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(match["type"], match["name"]) for match in response.get_json()["suggestions"]],
+            [("genre", "new genre")]
+        )
+
+    def test_deleted_books_leave_cached_and_indexed_listings(self):
+        headers = self.headers("get:books", "get:books-details")
+        kept = self.post_book(["genre 0"], name="Wizard").get_json()["new_book"]["id"]
+        deleted = self.post_book(["genre 0"], name="Wizard sequel").get_json()["new_book"]["id"]
+
+        def listed() -> dict:
+            def ids(path: str, key: str = "books") -> set:
+                response = self.client.get(path, headers=headers)
+                self.assertEqual(response.status_code, 200, response.get_json())
+                return {item["id"] for item in response.get_json()[key] if item.get("type", "book") == "book"}
+
+            return {
+                "list": ids("/book"),
+                "top": ids("/book/top?by=downloads"),
+                "similar": ids(f"/books/{kept}/similar"),
+                "suggest": ids("/suggest?q=wiz", "suggestions"),
+            }
+
+        self.assertEqual(listed(), {"list": {kept, deleted}, "top": {kept, deleted}, "similar": {deleted}, "suggest": {kept, deleted}})
+        self.assertEqual(self.client.get(f"/books/{deleted}", headers=headers).status_code, 200)
+
+        response = self.client.delete(f"/books/{deleted}", headers=self.headers("delete:books"))
+        self.assertEqual(response.get_json(), {"success": True, "deleted_book_id": deleted})
+
+        self.assertEqual(listed(), {"list": {kept}, "top": {kept}, "similar": set(), "suggest": {kept}})
+        self.assertEqual(self.client.get(f"/books/{deleted}", headers=headers).status_code, 404)
+        self.assertEqual(self.client.delete(f"/books/{deleted}", headers=self.headers("delete:books")).status_code, 404)
+
+    def test_search_index_follows_api_deletes(self):
+        headers = self.headers("get:books")
+        book_ids = [self.post_book(["genre 0"], name=name).get_json()["new_book"]["id"] for name in ("Earthsea", "Earthsea tales")]
+
+        def found(query: str) -> list:
+            return [book["id"] for book in self.client.get(f"/search?q={query}", headers=headers).get_json()["books"]]
+
+        self.assertEqual(found("earthsea"), book_ids)
+        self.assertEqual(self.client.delete(f"/books/{book_ids[0]}", headers=self.headers("delete:books")).status_code, 200)
+
+        self.assertEqual(found("earthsea"), book_ids[1:])
+        with self.app.app_context():
+            self.assertEqual([book_id for book_id, _ in search.search("earthsea", 10)], book_ids[1:])
+
+    def test_authors_are_deleted_once_they_have_no_books(self):
+        headers = self.headers("delete:authors")
+        book_id = self.post_book(["genre 0"]).get_json()["new_book"]["id"]
+
+        self.assertEqual(self.client.delete("/authors/1", headers=headers).status_code, 409)
+        self.client.delete(f"/books/{book_id}", headers=self.headers("delete:books"))
+        self.assertEqual(self.client.delete("/authors/1", headers=headers).get_json(), {"success": True, "deleted_author_id": 1})
+        self.assertEqual(self.client.delete("/authors/1", headers=headers).status_code, 404)
+
+    def test_author_patch_moves_books_and_replaces_genres(self):
+        book_id = self.post_book(["genre 0"]).get_json()["new_book"]["id"]
+        headers = self.headers("patch:authors")
+
+        with self.app.app_context():
+            author, other = Author.query.order_by(Author.id).all()
+            author_id, other_id = author.id, other.id
+            author.genres = Genre.query.filter(Genre.name.in_(["genre 0", "genre 1"])).all()
+            db.session.commit()
+
+        # the book would be left without author
+        patch = {"id": author_id, "name": "author", "age": 41, "books": [], "genres": []}
+        self.assertEqual(self.client.patch(f"/authors/{author_id}", json=patch, headers=headers).status_code, 422)
+
+        patch = {"id": other_id, "name": "other", "age": 51, "books": [{"id": book_id}], "genres": ["genre 1", "genre 2"]}
+        response = self.client.patch(f"/authors/{other_id}", json=patch, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            other = db.session.get(Author, other_id)
+            self.assertEqual(other.age, 51)
+            self.assertEqual([book.id for book in other.books], [book_id])
+            self.assertEqual(sorted(genre.name for genre in other.genres), ["genre 1", "genre 2"])
+            self.assertEqual(db.session.get(Author, author_id).books, [])
+
+
+class TestAsgi(ApiTestCase):
+    """Async routes of asgi.py, driven with raw ASGI messages."""
+
+    def setUp(self):
+        self.issuer.install()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.tmp_dir.name, "e-library.db")
+
+        # the module builds its apps on import, from the default config
+        config = {"DATABASE_URL": f"sqlite:///{self.database_path}", "DB_REPLICAS": []}
+        with mock.patch.dict(DEFAULT_CONFIG, config):
+            sys.modules.pop("backend.src.api.asgi", None)
+            self.asgi = importlib.import_module("backend.src.api.asgi")
+
+        self.app = self.asgi.flask_app
+        self.client = self.app.test_client()
+        self.loop = asyncio.new_event_loop()
+        self.storage_root = mock.patch.object(storage, "root", os.path.join(self.tmp_dir.name, "books"))
+        self.storage_root.start()
+        request_metrics.reset()
+
+        self.cli("schema", "upgrade")
+        with self.app.app_context():
+            author, category = Author(name="author", age=40), Category(name="category")
+            db.session.add_all([
+                Book(name=f"book {i}", author=author, category=category, description="", num_of_pages=100,
+                     year_of_publishing=2000, genres=[Genre(name=f"genre {i}")])
+                for i in range(3)
+            ])
+            db.session.commit()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.engine.dispose())
+        self.loop.close()
+        self.storage_root.stop()
+        super().tearDown()
+
+    def get(self, path: str, query: str = "", **headers) -> tuple:
+        """(status, headers, body) of GET `path` on the ASGI app."""
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "server": ("testserver", 80), "client": ("127.0.0.1", 50000),
+            "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+            "headers": [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()],
+        }
+        messages = []
+        requested, sent = False, asyncio.Event()
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            await sent.wait()  # file responses listen for the client going away
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                sent.set()
+
+        self.loop.run_until_complete(self.asgi.app(scope, receive, send))
+
+        start, *body = messages
+        response_headers = {name.decode(): value.decode() for name, value in start["headers"]}
+        return start["status"], response_headers, b"".join(message.get("body", b"") for message in body)
+
+    def auth(self, permission: str) -> dict:
+        return {"Authentication": f"bearer {self.issuer.token([permission])}"}
+
+    def test_list_and_detail_match_flask_routes_and_are_cached(self):
+        status, _, body = self.get("/book", "limit=2&foo=1", **self.auth("get:books"))
+        self.assertEqual(status, 200, body)
+        self.assertEqual([book["title"] for book in json.loads(body)["books"]], ["book 0", "book 1"])
+
+        status, headers, body = self.get("/books/1", **self.auth("get:books-details"))
+        flask_response = self.client.get("/books/1", headers=self.auth("get:books-details"))
+        self.assertEqual(status, 200, body)
+        self.assertEqual(json.loads(body), flask_response.get_json())
+
+        status, _, body = self.get("/books/1", **self.auth("get:books-details"), if_none_match=headers["etag"])
+        self.assertEqual((status, body), (304, b""))
+
+        patch = {
+            "id": 1, "title": "renamed", "author": "author", "category": "category", "description": "",
+            "num_of_pages": 100, "year_of_publishing": 2000, "genres": ["genre 0"],
+        }
+        self.assertEqual(self.client.patch("/books/1", json=patch, headers=self.auth("patch:books")).status_code, 200)
+        status, _, body = self.get("/books/1", **self.auth("get:books-details"), if_none_match=headers["etag"])
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["book"]["title"], "renamed")
+
+        metrics = request_metrics.render()
+        self.assertIn('elibrary_request_duration_seconds_count{method="GET",endpoint="/books/<int:id>",status="304"} 1', metrics)
+        self.assertIn('elibrary_auth_verification_seconds_count{method="GET",endpoint="/book"} 1', metrics)
+
+    def test_bad_args_and_missing_rows_are_rejected(self):
+        status, _, body = self.get("/book", "limit=many", **self.auth("get:books"))
+        self.assertEqual(status, 422)
+        self.assertIn("limit", json.loads(body)["errors"]["query"])
+
+        status, _, body = self.get("/books/99", **self.auth("get:books-details"))
+        self.assertEqual(status, 404)
+        self.assertEqual(json.loads(body)["message"], "REQUESTED BOOK DOES NOT EXIST")
+
+        status, _, _ = self.get("/book")
+        self.assertEqual(status, 401)
+
+    def test_file_downloads_count_full_and_first_partial_bodies(self):
+        content = b"0123456789"
+        self.client.put("/books/1/file", data=content, headers=self.auth("patch:books"))
+        auth = self.auth("get:books-details")
+
+        status, headers, body = self.get("/books/1/file", **auth)
+        self.assertEqual((status, body), (200, content))
+
+        self.assertEqual(self.get("/books/1/file", **auth, range="bytes=0-3")[::2], (206, b"0123"))
+        self.assertEqual(self.get("/books/1/file", **auth, range="bytes=4-")[::2], (206, b"456789"))
+        self.assertEqual(self.get("/books/1/file", **auth, if_none_match=headers["etag"])[::2], (304, b""))
+        self.assertEqual(self.get("/books/2/file", **auth)[0], 404)
+
+        counters.flush()
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Book, 1).downloads, 2)
+
+
+class TestFastJSONProvider(unittest.TestCase):
+    def test_output_matches_default_provider(self):
+        app = Flask(__name__)
+        fast, default = FastJSONProvider(app), DefaultJSONProvider(app)
+        data = {
+            "title": "Ğalaba",
+            "rating": 4.25,
+            "ids": [1, 2**70],
+            "published": datetime.date(1968, 1, 1),
+            "updated": datetime.datetime(2020, 5, 17, 12, 30),
+            "price": decimal.Decimal("9.99"),
+            "uuid": uuid.UUID(int=1),
+        }
+
+        with app.app_context():
+            self.assertEqual(json.loads(fast.response(data).get_data()), json.loads(default.response(data).get_data()))
+            self.assertEqual(fast.loads(fast.dumps(data)), default.loads(default.dumps(data)))
+
+
+if __name__ == "__main__":
+    unittest.main()